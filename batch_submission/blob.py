@@ -96,7 +96,7 @@ def upload_file_to_container(
     path_2, ext_2 = os.path.splitext(file_path)
     path_1, ext_1 = os.path.splitext(path_2)
 
-    if ext_2 in ['.json', '.csv', '.xlsx']:
+    if ext_2 in ['.json', '.csv', '.xlsx', '.pkl']:
         pass
     elif ext_1 != '.tar' and ext_2 != '.gz':
         raise TypeError(
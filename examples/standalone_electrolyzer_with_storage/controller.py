@@ -4,9 +4,11 @@ import numpy as np
 import pandas as pd
 
 from pulp import COIN, LpProblem, LpMinimize, LpVariable, value, PULP_CBC_CMD
+from scipy import sparse
 import os
 
 from hoptimiser.system_layouts.topologies.standalone_electrolzyer_with_storage import SystemLayout
+from hoptimiser.solvers import get_solver
 
 
 class Controller:
@@ -402,15 +404,27 @@ class ControllerOld:
 
 
 class LPController:
+    # Rows of the LP, columns are [offsite_h2_yield_energy, storage_response_energy, h2_demand_energy]:
+    _A_MATRIX = sparse.csr_matrix(np.array([[-1.0, -1.0, 1.0],
+                                            [0.0, -1.0, 1.0]]))
+
     def __init__(self, system_layout: SystemLayout, kwargs: Dict) -> None:
         self._system_layout = system_layout
         self._kwargs = kwargs
+        # 'CBC' builds the LP with PuLP, 'HiGHS' or 'highspy' solve it in-process without any temporary files
+        self._solver = kwargs.get('lp_solver', 'CBC')
 
     def lp(self, h2_demand_min_energy: float, h2_demand_max_energy: float,
            tank_possible_charge_kwh_h2: float, tank_possible_discharge_kwh_h2: float,
            electrolyzer_min_h2_yield_energy: float, electrolyzer_max_h2_yield_energy: float,
            offsite_h2_yield_energy_max: float):
 
+        if self._solver != 'CBC':
+            return self._lp_in_process(h2_demand_min_energy, h2_demand_max_energy,
+                                       tank_possible_charge_kwh_h2, tank_possible_discharge_kwh_h2,
+                                       electrolyzer_min_h2_yield_energy, electrolyzer_max_h2_yield_energy,
+                                       offsite_h2_yield_energy_max)
+
         model = LpProblem("Minimize_grid_import", LpMinimize)
         offsite_h2_yield_energy = LpVariable('offsite_h2_yield_energy', 0.0, offsite_h2_yield_energy_max)
         storage_response_energy = LpVariable('storage_response_energy',
@@ -444,6 +458,39 @@ class LPController:
         #solver.solve(model)
 
 
+        return results
+
+    def _lp_in_process(self, h2_demand_min_energy: float, h2_demand_max_energy: float,
+                       tank_possible_charge_kwh_h2: float, tank_possible_discharge_kwh_h2: float,
+                       electrolyzer_min_h2_yield_energy: float, electrolyzer_max_h2_yield_energy: float,
+                       offsite_h2_yield_energy_max: float):
+        """
+        Same LP as lp(), held as arrays and passed to an in-process solver.
+        """
+        # Minimise the dirty energy imported from the grid:
+        c = np.array([-1.0, -1.0, 1.0])
+
+        # We should always fill the tank when we can and discharge when needed:
+        if h2_demand_min_energy - offsite_h2_yield_energy_max > 0:
+            storage_response = min(tank_possible_discharge_kwh_h2, h2_demand_min_energy - offsite_h2_yield_energy_max)
+        else:
+            storage_response = max(tank_possible_charge_kwh_h2, h2_demand_min_energy - offsite_h2_yield_energy_max)
+
+        col_lower = np.array([0.0, storage_response, h2_demand_min_energy])
+        col_upper = np.array([offsite_h2_yield_energy_max, storage_response, h2_demand_max_energy])
+        # Grid imports can never be negative and electroyzer production must be within technical bounds:
+        row_lower = np.array([0.0, electrolyzer_min_h2_yield_energy])
+        row_upper = np.array([np.inf, electrolyzer_max_h2_yield_energy])
+
+        solved, x = get_solver(self._solver)(c, self._A_MATRIX, row_lower, row_upper, col_lower, col_upper,
+                                             np.zeros(3, dtype=int), 0.1)
+        if not solved:
+            raise Exception('LP controller failed to find a feasible dispatch.')
+
+        results = {'offsite_h2_yield_energy': x[0], 'storage_response_energy': x[1], 'h2_demand_energy': x[2]}
+        results['objective_value'] = float(np.dot(c, x))
+        results['grid_import_energy'] = results['objective_value']
+
         return results
 
     def _request_import_power_at_electrolyzer(self, row: pd.Series) -> Tuple[float, float, float, float]:
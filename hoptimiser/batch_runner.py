@@ -14,6 +14,9 @@ from batch_submission.config import POOL_ID
 from batch_submission.utils import chunk
 
 from hoptimiser.component_inputs_reader import read_component_data, populate_combinations
+from hoptimiser.input_bundle import InputBundle
+from hoptimiser.screening import screen_combinations
+from hoptimiser.multi_fidelity import full_fidelity_selection, validation_sample, fidelity_rank_correlation
 
 from hoptimiser.config import PROJECT_ROOT_DIR
 
@@ -25,9 +28,10 @@ class HoptimiserBatchRunner:
         'conda env create -f batch_environment.yml',
     ]
 
-    def __init__(self, analysis_name: str, combinations: list):
+    def __init__(self, analysis_name: str, combinations: list, representative_days: int = None):
         self.analysis_name = analysis_name
         self.combinations = combinations
+        self.representative_days = representative_days
 
         self._max_tasks_per_job: int = 100
         self.batch_job = BatchSubmission()
@@ -62,6 +66,17 @@ class HoptimiserBatchRunner:
             file_path='inputs/price_profiles.csv',
         )
 
+        # parse the inputs once here, so each task loads the cached bundle rather than re-reading the workbook
+        input_bundle = InputBundle.from_files('inputs/component_inputs.xlsx', 'inputs/demand_profiles.csv', 'inputs/price_profiles.csv', cache_dir='inputs/cache')
+        input_bundle_file = upload_file_to_container(
+            blob_service_client=self.batch_job.blob_service_client,
+            container_name='input',
+            file_path=os.path.join('inputs', 'cache', 'input_bundle_' + input_bundle.files_hash + '.pkl'),
+        )
+
+        # the representative days, if given, override the input so a screening run can share the workbook
+        representative_days = '' if self.representative_days is None else f' {self.representative_days}'
+
         for c in self.combinations:
             str_c = str(c).replace(" ", "")
             output_dir = f'{str(c)[1:-1].replace(",", "_").replace(" ", "")}'
@@ -75,7 +90,7 @@ class HoptimiserBatchRunner:
 
                     'source activate hoptimiser',
 
-                    f'python -m hoptimiser.variable_price_orchestrator {str_c} True &> {output_dir}/log.txt'
+                    f'python -m hoptimiser.variable_price_orchestrator {str_c} True{representative_days} &> {output_dir}/log.txt'
                 ],
                 "output_file_pattern_list": [
                     '*/log.txt',
@@ -84,7 +99,7 @@ class HoptimiserBatchRunner:
                     '*/lcoh2_result.json',
                 ],
                 "output_container_sas_url": self.batch_job.output_container_sas_url,
-                "resource_files": [component_file, demand_file, price_file],
+                "resource_files": [component_file, demand_file, price_file, input_bundle_file],
             }
             self.task_list += [task]
 
@@ -140,37 +155,13 @@ class HoptimiserBatchRunner:
                 count += 1
 
 
-if __name__ == '__main__':
-
-    analysis_name = 'batch-analysis'
-
-    analysis_name = analysis_name.lower()
-
-    maximum_nodes = 350
-    input_file_name_components = 'component_inputs.xlsx'
-
-    tank_df, electrolyser_df, data_years = read_component_data(
-        os.path.join(PROJECT_ROOT_DIR, 'inputs', input_file_name_components))
-    combinations = populate_combinations(tank_df, electrolyser_df,
-                                         os.path.join(PROJECT_ROOT_DIR, 'inputs', input_file_name_components))
-
-    input_file_name_components = os.path.join(
-        PROJECT_ROOT_DIR, 'inputs',
-        'component_inputs.xlsx',
-    )
-
-    technical_inputs = pd.read_excel(input_file_name_components, sheet_name='Technical Inputs')
-    technical_inputs.set_index('Parameter', inplace=True)
-
-    n_best_results_download = min(int(technical_inputs['Value']['Number of Batch Setups to Download']),
-                                  len(combinations))
-
-    print('Number of combinations = ', len(combinations))
-    print('The following number of best results will be downloaded in full:', n_best_results_download)
+def run_batch(analysis_name: str, combinations: list, n_best_results_download: int, representative_days: int = None) -> pd.DataFrame:
+    """Run the combinations on a new pool, wait for them to finish and return the results downloaded."""
 
     batch_runner = HoptimiserBatchRunner(
         analysis_name=analysis_name,
-        combinations=combinations
+        combinations=combinations,
+        representative_days=representative_days,
     )
 
     # check if pool exists:
@@ -242,7 +233,74 @@ if __name__ == '__main__':
     # delete container, jobs and pool:
     batch_runner.batch_job.cleanup()
 
-    results = pd.read_csv('batch_results/batch_results_temp.csv')
+    return pd.read_csv('batch_results/batch_results_temp.csv')
+
+
+if __name__ == '__main__':
+
+    analysis_name = 'batch-analysis'
+
+    analysis_name = analysis_name.lower()
+
+    maximum_nodes = 350
+    input_file_name_components = 'component_inputs.xlsx'
+
+    tank_df, electrolyser_df, data_years = read_component_data(
+        os.path.join(PROJECT_ROOT_DIR, 'inputs', input_file_name_components))
+    combinations = populate_combinations(tank_df, electrolyser_df,
+                                         os.path.join(PROJECT_ROOT_DIR, 'inputs', input_file_name_components))
+
+    input_file_name_components = os.path.join(
+        PROJECT_ROOT_DIR, 'inputs',
+        'component_inputs.xlsx',
+    )
+
+    technical_inputs = pd.read_excel(input_file_name_components, sheet_name='Technical Inputs')
+    technical_inputs.set_index('Parameter', inplace=True)
+
+    n_best_results_download = min(int(technical_inputs['Value']['Number of Batch Setups to Download']),
+                                  len(combinations))
+
+    print('Number of combinations = ', len(combinations))
+
+    # drop the combinations that would fail before solving anything, so they do not each take up a task
+    input_bundle = InputBundle.from_files('inputs/component_inputs.xlsx', 'inputs/demand_profiles.csv', 'inputs/price_profiles.csv', cache_dir='inputs/cache')
+    feasible = screen_combinations(combinations, input_bundle)
+    combinations = [c for c, ok in zip(combinations, feasible) if ok]
+    n_best_results_download = min(n_best_results_download, len(combinations))
+
+    print('The following number of best results will be downloaded in full:', n_best_results_download)
+
+    # with representative days, every combination is run on those first and only the best are run on the full year
+    representative_days = int(technical_inputs['Value'].get('Representative Days', 0))
+    full_fidelity_fraction = float(technical_inputs['Value'].get('Full Fidelity Fraction', 1)) #If below 1, only that fraction of the combinations are run on the full year
+    n_validation = int(technical_inputs['Value'].get('Fidelity Validation Combinations', 10)) #If above 0, this many of the combinations not selected are run on the full year too, to check the rank correlation
+
+    if representative_days > 0 and full_fidelity_fraction < 1:
+        print('Running every combination on ' + str(representative_days) + ' representative days a year...')
+        low_fidelity_results = run_batch(analysis_name + '-low', combinations, 0, representative_days)
+        low_fidelity_results.to_csv('batch_results/batch_results_low_fidelity.csv')
+
+        low_fidelity_lcoh2 = dict(zip(low_fidelity_results['combination'], low_fidelity_results['lcoh2']))
+        low_fidelity_lcoh2 = [low_fidelity_lcoh2.get(str(c).replace(" ", "")) for c in combinations]
+        selected = full_fidelity_selection(low_fidelity_lcoh2, full_fidelity_fraction)
+        print('Combinations in the best ' + str(full_fidelity_fraction) + ' to run on the full year = ', len(selected))
+
+        # plus a random few of the rest, as a correlation over the best alone says little about the ranking
+        validation = validation_sample(low_fidelity_lcoh2, set(selected), n_validation)
+        print('Combinations not selected run on the full year to check the ranking = ', len(validation))
+
+        low_fidelity_lcoh2 = [low_fidelity_lcoh2[i] for i in selected + validation]
+        combinations = [combinations[i] for i in selected + validation]
+        n_best_results_download = min(n_best_results_download, len(combinations))
+
+        results = run_batch(analysis_name, combinations, n_best_results_download, 0)
+
+        full_fidelity_lcoh2 = dict(zip(results['combination'], results['lcoh2']))
+        full_fidelity_lcoh2 = [full_fidelity_lcoh2.get(str(c).replace(" ", "")) for c in combinations]
+        print('Rank correlation between the low and full fidelity LCOH2 = ', fidelity_rank_correlation(low_fidelity_lcoh2, full_fidelity_lcoh2))
+    else:
+        results = run_batch(analysis_name, combinations, n_best_results_download)
 
     results['electrolyser_id'] = None
     results['number_of_electrolysers'] = None
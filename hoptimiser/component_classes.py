@@ -1,8 +1,81 @@
+import functools
+import numpy as np
 import pandas as pd
 
 
+def select_efficiency_breakpoints(load_factor, efficiency, n_breakpoints):
+    """
+    Indices of the n_breakpoints points of an efficiency curve, always keeping both ends, that minimise the squared
+    error at the dropped points against the efficiency of the level they fall in, which is the lower of the
+    efficiencies at the breakpoints either side.
+    """
+
+    efficiency = np.asarray(efficiency, dtype=float)
+    n_points = len(load_factor)
+
+    if n_breakpoints < 2:
+        raise Exception('At least two efficiency breakpoints are needed!')
+    if n_breakpoints >= n_points:
+        return list(range(n_points))
+
+    segment_error = np.full((n_points, n_points), np.inf)
+    for start in range(n_points):
+        for end in range(start + 1, n_points):
+            level_efficiency = min(efficiency[start], efficiency[end])
+            segment_error[start, end] = np.sum((efficiency[start + 1:end] - level_efficiency) ** 2)
+
+    # best_error[k, j] is the least error covering points 0 to j with k + 1 breakpoints ending at j
+    best_error = np.full((n_breakpoints, n_points), np.inf)
+    best_previous = np.zeros((n_breakpoints, n_points), dtype=int)
+    best_error[0, 0] = 0
+    for k in range(1, n_breakpoints):
+        for end in range(1, n_points):
+            errors = best_error[k - 1, 0:end] + segment_error[0:end, end]
+            best_previous[k, end] = np.argmin(errors)
+            best_error[k, end] = errors[best_previous[k, end]]
+
+    breakpoints = [n_points - 1]
+    for k in range(n_breakpoints - 1, 0, -1):
+        breakpoints.append(best_previous[k, breakpoints[-1]])
+
+    return breakpoints[::-1]
+
+
+@functools.lru_cache(maxsize=None)
+def learning_curves(stack_replacement_capex_curve_year, stack_replacement_capex_curve, efficiency_learning_curve_year, efficiency_learning_curve, n_rows):
+    """
+    The year by year curves of an electrolyser model that do not depend on when its stacks are replaced, for the years
+    in both the efficiency learning data and the first n_rows of the stack replacement data. Arguments are tuples so the
+    result can be cached, as every stack replacement variant of the model in a sweep shares it.
+    """
+
+    capex_year = np.asarray(stack_replacement_capex_curve_year)[0:n_rows]
+    capex_curve = np.asarray(stack_replacement_capex_curve, dtype=float)[0:n_rows]
+    cumulative_capex_curve = np.cumprod(1 + capex_curve)
+
+    # the learning years with stack replacement data, in learning data order, and their row in the stack replacement data
+    capex_row_of_year = {year: row for row, year in enumerate(capex_year.tolist())}
+    learning_year = np.asarray(efficiency_learning_curve_year)
+    keep = np.array([year in capex_row_of_year for year in learning_year.tolist()], dtype=bool)
+    capex_row = np.array([capex_row_of_year[year] for year in learning_year[keep].tolist()], dtype=int)
+    learning_curve = np.asarray(efficiency_learning_curve, dtype=float)[keep]
+
+    curves = {
+        'CalendarYear': learning_year[keep],
+        'capex_row': capex_row,
+        'efficiency_learning_curve': learning_curve,
+        'stack_replacement_capex_curve': capex_curve[capex_row],
+        'cumulative_capex_curve': cumulative_capex_curve[capex_row],
+        'cumulative_learning_curve': np.cumprod(1 + learning_curve),
+    }
+    for values in curves.values():
+        values.flags.writeable = False #shared by every caller
+
+    return curves
+
+
 class CombinedElectrolyser():
-    def __init__(self, selected_electrolyser, n_electrolysers, stack_replacement_years, first_operational_year, component_delivery_year, n_years, electrolyser_min_capacity, reduce_efficiencies, optimise_efficiencies):
+    def __init__(self, selected_electrolyser, n_electrolysers, stack_replacement_years, first_operational_year, component_delivery_year, n_years, electrolyser_min_capacity, reduce_efficiencies, optimise_efficiencies, n_efficiency_breakpoints=None):
 
         self.rated_power = selected_electrolyser['Capacity (MW)'] * 1000 * n_electrolysers
         self.min_power = max(selected_electrolyser['Capacity (MW)'] * 1000 * electrolyser_min_capacity, 1E-4)
@@ -12,7 +85,7 @@ class CombinedElectrolyser():
         self.full_efficiency_load_factor = self.efficiency_load_factor.copy()
 
         if reduce_efficiencies:
-            self._reduce_efficiencies()
+            self._reduce_efficiencies(n_efficiency_breakpoints)
             optimise_efficiencies = False
 
         self.capex = selected_electrolyser['CAPEX'] * n_electrolysers
@@ -43,16 +116,16 @@ class CombinedElectrolyser():
             self.efficiency_learning_curve_year = self.efficiency_learning_curve_year[years_to_remove:]
             self.efficiency_learning_curve = self.efficiency_learning_curve[years_to_remove:]
 
+        years_to_add = 0
         if component_delivery_year > first_operational_year:
             raise Exception('First operational year is earlier than capital cost data year, code cannot run!')
         elif component_delivery_year < first_operational_year: #we must add extra years at the start before operation
             years_to_add = first_operational_year - component_delivery_year
-            for years in range(1, years_to_add + 1):
-                year_to_add = first_operational_year - years
-                self.stack_replacement_capex_curve_year = [year_to_add] + self.stack_replacement_capex_curve_year
-                self.stack_replacement_capex_curve = [0.0] + self.stack_replacement_capex_curve
-                self.efficiency_learning_curve_year = [year_to_add] + self.efficiency_learning_curve_year
-                self.efficiency_learning_curve = [0.0] + self.efficiency_learning_curve
+            years_before_operation = list(range(component_delivery_year, first_operational_year))
+            self.stack_replacement_capex_curve_year = years_before_operation + list(self.stack_replacement_capex_curve_year)
+            self.stack_replacement_capex_curve = [0.0] * years_to_add + list(self.stack_replacement_capex_curve)
+            self.efficiency_learning_curve_year = years_before_operation + list(self.efficiency_learning_curve_year)
+            self.efficiency_learning_curve = [0.0] * years_to_add + list(self.efficiency_learning_curve)
 
         self.combined_stack_and_efficiencies_df = self._combine_learning_data(first_operational_year, stack_replacement_years, n_years, years_to_add)
 
@@ -60,48 +133,45 @@ class CombinedElectrolyser():
 
     def _combine_learning_data(self, first_operational_year, stack_replacement_years, n_years, years_to_add):
 
-        efficiency_learning_df = pd.DataFrame()
-        efficiency_learning_df['Year'] = self.efficiency_learning_curve_year
-        efficiency_learning_df['efficiency_learning_curve'] = self.efficiency_learning_curve
-        stack_replacement_df = pd.DataFrame()
-        stack_replacement_df['Year'] = self.stack_replacement_capex_curve_year
-        stack_replacement_df['stack_replacement_capex_curve'] = self.stack_replacement_capex_curve
-        stack_replacement_df['stack_replacement'] = False
-        stack_replacement_df['cumulative_capex_curve'] = 1 + stack_replacement_df['stack_replacement_capex_curve']
-
-        stack_replacement_df = stack_replacement_df[0:n_years + years_to_add]
-
-        for replacement_year in stack_replacement_years:
-            stack_replacement_df.loc[replacement_year + years_to_add - 1, 'stack_replacement'] = True
-
-        for y in range(1,len(stack_replacement_df)):
-            stack_replacement_df.loc[y, 'cumulative_capex_curve'] = stack_replacement_df.loc[y - 1, 'cumulative_capex_curve'] * stack_replacement_df.loc[y, 'cumulative_capex_curve']
-
-        stack_replacement_df['stack_final_capex'] = stack_replacement_df['cumulative_capex_curve'] * self.start_stack_replacement_cost
+        curves = learning_curves(tuple(self.stack_replacement_capex_curve_year), tuple(self.stack_replacement_capex_curve), tuple(self.efficiency_learning_curve_year), tuple(self.efficiency_learning_curve), n_years + years_to_add)
 
-        combined_stack_and_efficiencies_df = efficiency_learning_df.merge(stack_replacement_df)
-
-        combined_stack_and_efficiencies_df['cumulative_learning_curve'] = 1 + combined_stack_and_efficiencies_df['efficiency_learning_curve']
-        for y in range(1, len(combined_stack_and_efficiencies_df)):
-            combined_stack_and_efficiencies_df.loc[y, 'cumulative_learning_curve'] = combined_stack_and_efficiencies_df.loc[y - 1, 'cumulative_learning_curve'] * combined_stack_and_efficiencies_df.loc[y, 'cumulative_learning_curve']
+        year = curves['CalendarYear']
+        replacement_rows = [replacement_year + years_to_add - 1 for replacement_year in stack_replacement_years]
+        stack_replacement = np.isin(curves['capex_row'], replacement_rows)
 
         if not self.efficiency_degradation[0] == self.efficiency_degradation[-1]:
             raise Exception('Code does not handle degradation that varies with load factor!')
 
-        combined_stack_and_efficiencies_df['degradation'] = self.efficiency_degradation[-1]
-
-        combined_stack_and_efficiencies_df['final_relative_efficiency'] = 1.0
+        degradation = self.efficiency_degradation[-1]
 
         #todo: We should account for improvement rates between the capital cost year and first year of operation. Hydra seems to assume that these are zero, hoptimiser code currently matches Hydra
 
-        for i in range(0, len(combined_stack_and_efficiencies_df)):
-            if combined_stack_and_efficiencies_df.loc[i, 'Year'] > first_operational_year:
-                if not combined_stack_and_efficiencies_df.loc[i, 'stack_replacement']:
-                    combined_stack_and_efficiencies_df.loc[i, 'final_relative_efficiency'] = combined_stack_and_efficiencies_df.loc[i - 1, 'final_relative_efficiency'] * (1 + combined_stack_and_efficiencies_df.loc[i, 'degradation'])
-                else:
-                    combined_stack_and_efficiencies_df.loc[i, 'final_relative_efficiency'] = combined_stack_and_efficiencies_df.loc[i, 'cumulative_learning_curve']
-
-        combined_stack_and_efficiencies_df = combined_stack_and_efficiencies_df.rename(columns={'Year': 'CalendarYear'})
+        # the relative efficiency is reset to 1 up to the first operational year and to the learning curve on a stack
+        # replacement, then degrades each year until the next reset
+        reset = (year <= first_operational_year) | stack_replacement
+        reset_value = np.where(year <= first_operational_year, 1.0, curves['cumulative_learning_curve'])
+        reset_rows = np.flatnonzero(reset)
+        if len(reset_rows) == 0 or reset_rows[0] != 0:
+            raise Exception('Efficiency learning data does not start by the first operational year!')
+
+        final_relative_efficiency = np.empty(len(year))
+        segment_ends = np.append(reset_rows[1:], len(year))
+        for segment_start, segment_end in zip(reset_rows, segment_ends):
+            factors = np.full(segment_end - segment_start, 1 + degradation)
+            factors[0] = reset_value[segment_start]
+            final_relative_efficiency[segment_start:segment_end] = np.cumprod(factors)
+
+        combined_stack_and_efficiencies_df = pd.DataFrame({
+            'CalendarYear': year,
+            'efficiency_learning_curve': curves['efficiency_learning_curve'],
+            'stack_replacement_capex_curve': curves['stack_replacement_capex_curve'],
+            'stack_replacement': stack_replacement,
+            'cumulative_capex_curve': curves['cumulative_capex_curve'],
+            'stack_final_capex': curves['cumulative_capex_curve'] * self.start_stack_replacement_cost,
+            'cumulative_learning_curve': curves['cumulative_learning_curve'],
+            'degradation': degradation,
+            'final_relative_efficiency': final_relative_efficiency,
+        })
 
         return combined_stack_and_efficiencies_df
 
@@ -111,25 +181,14 @@ class CombinedElectrolyser():
             self.efficiency[1] = 0.794
             self.efficiency[2] = 0.792
 
-    def _reduce_efficiencies(self):
-        reduced_efficiency = []
-        reduced_efficiency.append(self.efficiency[0])
-        reduced_efficiency.append(self.efficiency[2])
-        reduced_efficiency.append(self.efficiency[4])
-        reduced_efficiency.append(self.efficiency[6])
-        reduced_efficiency.append(self.efficiency[8])
-        reduced_efficiency.append(self.efficiency[9])
-
-        reduced_load_factor = []
-        reduced_load_factor.append(self.efficiency_load_factor[0])
-        reduced_load_factor.append(self.efficiency_load_factor[2])
-        reduced_load_factor.append(self.efficiency_load_factor[4])
-        reduced_load_factor.append(self.efficiency_load_factor[6])
-        reduced_load_factor.append(self.efficiency_load_factor[8])
-        reduced_load_factor.append(self.efficiency_load_factor[9])
-
-        self.efficiency = reduced_efficiency
-        self.efficiency_load_factor = reduced_load_factor
+    def _reduce_efficiencies(self, n_breakpoints=None):
+        if n_breakpoints is None:
+            breakpoints = [0, 2, 4, 6, 8, 9]
+        else:
+            breakpoints = select_efficiency_breakpoints(self.efficiency_load_factor, self.efficiency, n_breakpoints)
+
+        self.efficiency = [self.efficiency[i] for i in breakpoints]
+        self.efficiency_load_factor = [self.efficiency_load_factor[i] for i in breakpoints]
 
 class CombinedTank():
     def __init__(self, selected_tank, n_tanks, min_storage_kwh=2000, start_half_full=True):
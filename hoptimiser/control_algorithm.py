@@ -1,8 +1,15 @@
 import numpy as np
-from pulp import pulp, LpProblem, LpMinimize, PULP_CBC_CMD, COIN
+import itertools
+from scipy import sparse
+from pulp import pulp, LpProblem, LpMinimize, PULP_CBC_CMD, COIN, LpConstraintGE, LpConstraintLE
 import datetime
 import pandas as pd
 
+try:
+    from hoptimiser.dispatch_model import daily_storage_lower_bounds, achievable_storage_lower_bounds, electrolyser_levels
+except:
+    from dispatch_model import daily_storage_lower_bounds, achievable_storage_lower_bounds, electrolyser_levels
+
 class MultiDimensionalLpVariable:
     def __init__(self, name, dimensions, low_bound, up_bound, cat):
         self.name = name
@@ -28,98 +35,135 @@ class MultiDimensionalLpVariable:
         return pulp.LpVariable(name, self.low_bound, self.up_bound, self.cat)
 
     def evaluate(self):
-        f = np.vectorize(lambda i: pulp.value(i))
-        self.values = f(self.variables)
+        # read the solved values straight off the variables, nan where the solver gave none
+        values = [np.nan if variable.varValue is None else variable.varValue for variable in self.variables.flat]
+        self.values = np.array(values, dtype=float).reshape(self.variables.shape)
 
-def LPcontrol5(data_day, day_start_h2_in_storage_kwh, line_losses_after_poi, lp_solver_time_limit_seconds, electrolyser, tank, efficiency_adjustment, end_of_day_storage_target, end_of_day_storage_increase_per_day, max_h2_production, failed_combination_flag, supplier_fee_per_mwh):
+class ResultsBuffer:
+    """
+    Preallocated columns for a year of half hourly results. Each solve writes its committed periods into the next rows
+    through next_rows, and the DataFrame is only built once at the end of the year by to_dataframe.
+    """
 
-    #todo decide whether we need to add a tank max charge rate
-    #todo decide whether we need to check the floor area
+    columns_before_levels = ['datetime', 'import_price', 'uos_price', 'h2_demand_kWh', 'electrolyser_kW']
+    columns_after_levels = ['h2_produced_kWh', 'h2_to_storage_kWh', 'h2_in_storage_kWh', 'h2_cost_total_solver', 'h2_cost_total', 'h2_cost_imports', 'h2_cost_uos', 'h2_cost_supplier_fee']
 
-    date_array = data_day.Time
-    price_array = data_day.combined_price
-    import_price_array = data_day.import_price
-    uos_price_array = data_day.uos_charge
-    demand_array = data_day.demand
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.n_used = 0
+        self.columns = {'datetime': np.empty(n_rows, dtype='datetime64[ns]')}
+        for column in self.columns_before_levels[1:] + self.columns_after_levels:
+            self.columns[column] = np.empty(n_rows)
+        self.level_columns = None
+        self.index = np.empty(n_rows, dtype=int)
 
-    day_complete = False
-    failure_counter = 0
-    day_start_h2_in_storage_kwh = min(day_start_h2_in_storage_kwh, tank.max_storage_kwh)
-    end_of_day_storage_target = min(end_of_day_storage_target, tank.min_storage_kwh)
-    total_min_storage_remaining = min(end_of_day_storage_target, day_start_h2_in_storage_kwh) - 1E-6
-    in_day_min_storage_remaining = total_min_storage_remaining
+    def next_rows(self, n_rows, n_levels):
+        # the electrolyser level columns are added on the first call, once the number of levels is known
+        if self.level_columns is None:
+            self.level_columns = ['electrolyser_kW_' + str(level + 1) for level in range(0, n_levels)]
+            for column in self.level_columns:
+                self.columns[column] = np.empty(self.n_rows)
 
-    while not day_complete:
+        if self.n_used + n_rows > self.n_rows:
+            raise Exception('Results buffer is full!')
 
-        cost = 0
+        rows = slice(self.n_used, self.n_used + n_rows)
+        self.index[rows] = np.arange(n_rows) #each solve's rows are numbered from zero, as when the days were concatenated
+        self.n_used += n_rows
 
-        electrolyser_kW_level_1 = MultiDimensionalLpVariable('electrolyser_kW_1', len(data_day), 0, electrolyser.efficiency_load_factor[1] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_2 = MultiDimensionalLpVariable('electrolyser_kW_2', len(data_day), 0, electrolyser.efficiency_load_factor[2] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_3 = MultiDimensionalLpVariable('electrolyser_kW_3', len(data_day), 0, electrolyser.efficiency_load_factor[3] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_4 = MultiDimensionalLpVariable('electrolyser_kW_4', len(data_day), 0, electrolyser.efficiency_load_factor[4] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_5 = MultiDimensionalLpVariable('electrolyser_kW_5', len(data_day), 0, electrolyser.efficiency_load_factor[5] * electrolyser.max_power, "Continuous")
+        return {column: values[rows] for column, values in self.columns.items()}
 
-        electrolyser_turned_on_level_1 = MultiDimensionalLpVariable('electrolyser_turned_on_1', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_2 = MultiDimensionalLpVariable('electrolyser_turned_on_2', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_3 = MultiDimensionalLpVariable('electrolyser_turned_on_3', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_4 = MultiDimensionalLpVariable('electrolyser_turned_on_4', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_5 = MultiDimensionalLpVariable('electrolyser_turned_on_5', len(data_day), 0, 1, cat = "Binary")
+    def to_dataframe(self):
+        column_order = self.columns_before_levels + (self.level_columns or []) + self.columns_after_levels
+        return pd.DataFrame({column: self.columns[column][0:self.n_used] for column in column_order}, index=self.index[0:self.n_used])
 
-        adjusted_efficiency_1 = np.min(electrolyser.efficiency[0:2]) * efficiency_adjustment
-        adjusted_efficiency_2 = np.min(electrolyser.efficiency[1:3]) * efficiency_adjustment
-        adjusted_efficiency_3 = np.min(electrolyser.efficiency[2:4]) * efficiency_adjustment
-        adjusted_efficiency_4 = np.min(electrolyser.efficiency[3:5]) * efficiency_adjustment
-        adjusted_efficiency_5 = np.min(electrolyser.efficiency[4:6]) * efficiency_adjustment
+def lp_constraints(variables, a_matrix, senses, rhs):
+    """One PuLP constraint per row of the sparse a_matrix: a_matrix[row] . variables (sense) rhs[row]."""
 
-        adjusted_full_efficiency_curve = [e * efficiency_adjustment for e in electrolyser.full_efficiency]
+    a_matrix = sparse.csr_matrix(a_matrix)
+    return [pulp.LpConstraint(pulp.LpAffineExpression(zip(variables[a_matrix.indices[start:end]], a_matrix.data[start:end])), sense, rhs=value) for start, end, sense, value in zip(a_matrix.indptr[:-1], a_matrix.indptr[1:], senses, rhs)]
 
-        h2_in_storage_kwh = day_start_h2_in_storage_kwh
 
-        problem = LpProblem("Minimize_energy_cost_while_meeting_demand", LpMinimize)
+def daily_lp_rows(n_periods, lower_kw, upper_kw, level_efficiency, day_start_h2_in_storage_kwh, demand_array, storage_lower_bounds, tank):
+    """
+    The rows of LPcontrol's problem over the kW then turned on variables, in the order it has always added them: for
+    each period the min and max storage, the upper and lower kW of each level, and at most one level on.
+    """
 
-        for i in range(0, len(price_array)):
-            electrolyser_kW = electrolyser_kW_level_1[i] + electrolyser_kW_level_2[i] + electrolyser_kW_level_3[i] + electrolyser_kW_level_4[i] + electrolyser_kW_level_5[i]
-            cost += (electrolyser_kW / line_losses_after_poi) * price_array[i] * 0.5 / 1000.
+    n_levels = len(upper_kw)
+    n_level_vars = n_periods * n_levels
+    rows_per_period = 3 + 2 * n_levels
+    period_rows = rows_per_period * np.arange(n_periods)
 
-        problem += cost
+    # the storage after period i holds the H2 made in period j, decayed by the i - j leakages since
+    decay = np.multiply.accumulate(np.vstack((0.5 * np.asarray(level_efficiency, dtype=float), np.full((n_periods - 1, n_levels), tank.remaining_fraction_after_half_hour))), axis=0)
+    offset = np.subtract.outer(np.arange(n_periods), np.arange(n_periods))
+    storage = sparse.coo_matrix(np.where(offset[:, :, None] >= 0, decay[np.maximum(offset, 0)], 0).reshape(n_periods, n_level_vars))
 
-        for i in range(0, len(price_array)):
+    kw_cols = np.arange(n_level_vars).reshape(n_periods, n_levels)
+    on_cols = kw_cols + n_level_vars
+    level_rows = period_rows[:, None] + 2 + 2 * np.arange(n_levels)
 
-            h2_produced_kWh = 0.5 * ((electrolyser_kW_level_1[i] * adjusted_efficiency_1) + (electrolyser_kW_level_2[i] * adjusted_efficiency_2) + (electrolyser_kW_level_3[i] * adjusted_efficiency_3) + (electrolyser_kW_level_4[i] * adjusted_efficiency_4) + (electrolyser_kW_level_5[i] * adjusted_efficiency_5))
+    rows = np.concatenate((period_rows[storage.row], period_rows[storage.row] + 1, level_rows.ravel(), level_rows.ravel(), level_rows.ravel() + 1, level_rows.ravel() + 1, np.repeat(period_rows + 2 + 2 * n_levels, n_levels)))
+    cols = np.concatenate((storage.col, storage.col, kw_cols.ravel(), on_cols.ravel(), kw_cols.ravel(), on_cols.ravel(), on_cols.ravel()))
+    data = np.concatenate((storage.data, storage.data, np.ones(n_level_vars), np.tile(-np.asarray(upper_kw, dtype=float), n_periods), np.ones(n_level_vars), np.tile(-np.asarray(lower_kw, dtype=float), n_periods), np.ones(n_level_vars)))
+    a_matrix = sparse.coo_matrix((data, (rows, cols)), shape=(rows_per_period * n_periods, 2 * n_level_vars))
 
-            h2_storage_space_available_kwh = tank.max_storage_kwh - h2_in_storage_kwh
+    # storage before each period's production with nothing made, chained as the expressions were so the rows match exactly
+    h2_in_storage_before = np.array(list(itertools.accumulate(demand_array[:-1], lambda h2_in_storage_kwh, demand: (h2_in_storage_kwh - demand) * tank.remaining_fraction_after_half_hour, initial=day_start_h2_in_storage_kwh)))
 
-            h2_to_storage = h2_produced_kWh - demand_array[i]
-            storage_remaining = h2_in_storage_kwh + h2_to_storage
-            storage_overfill = h2_to_storage - h2_storage_space_available_kwh
+    senses = np.tile(np.concatenate(([LpConstraintGE, LpConstraintLE], np.tile([LpConstraintLE, LpConstraintGE], n_levels), [LpConstraintLE])), n_periods)
+    rhs = np.zeros((n_periods, rows_per_period))
+    rhs[:, 0] = -((h2_in_storage_before - demand_array) - storage_lower_bounds)
+    rhs[:, 1] = -(-demand_array - (tank.max_storage_kwh - h2_in_storage_before))
+    rhs[:, -1] = 1
 
-            h2_in_storage_kwh = (h2_in_storage_kwh + h2_to_storage) * tank.remaining_fraction_after_half_hour
+    return a_matrix, senses, rhs.ravel()
 
-            if i == 47:
-                problem += storage_remaining >= end_of_day_storage_target
-            elif i < 47:
-                problem += storage_remaining >= in_day_min_storage_remaining
-            else:
-                problem += storage_remaining >= total_min_storage_remaining
 
-            problem += storage_overfill <= 0
+def LPcontrol(data_day, day_start_h2_in_storage_kwh, line_losses_after_poi, lp_solver_time_limit_seconds, electrolyser, tank, efficiency_adjustment, end_of_day_storage_target, end_of_day_storage_increase_per_day, max_h2_production, failed_combination_flag, supplier_fee_per_mwh, reduced_efficiencies, results=None):
 
-            problem += electrolyser_kW_level_1[i] <= electrolyser_turned_on_level_1[i] * electrolyser.efficiency_load_factor[1] * electrolyser.rated_power
-            problem += electrolyser_kW_level_1[i] >= electrolyser_turned_on_level_1[i] * electrolyser.min_power
+    #todo decide whether we need to add a tank max charge rate
+    #todo decide whether we need to check the floor area
 
-            problem += electrolyser_kW_level_2[i] <= electrolyser_turned_on_level_2[i] * electrolyser.efficiency_load_factor[2] * electrolyser.rated_power
-            problem += electrolyser_kW_level_2[i] >= electrolyser_turned_on_level_2[i] * electrolyser.efficiency_load_factor[1] * electrolyser.rated_power
+    # One operating level per segment of the efficiency curve, however many breakpoints it has (see electrolyser_levels)
 
-            problem += electrolyser_kW_level_3[i] <= electrolyser_turned_on_level_3[i] * electrolyser.efficiency_load_factor[3] * electrolyser.rated_power
-            problem += electrolyser_kW_level_3[i] >= electrolyser_turned_on_level_3[i] * electrolyser.efficiency_load_factor[2] * electrolyser.rated_power
+    date_array = data_day['Time']
+    price_array = data_day['combined_price']
+    import_price_array = data_day['import_price']
+    uos_price_array = data_day['uos_charge']
+    demand_array = data_day['demand']
 
-            problem += electrolyser_kW_level_4[i] <= electrolyser_turned_on_level_4[i] * electrolyser.efficiency_load_factor[4] * electrolyser.rated_power
-            problem += electrolyser_kW_level_4[i] >= electrolyser_turned_on_level_4[i] * electrolyser.efficiency_load_factor[3] * electrolyser.rated_power
+    lower_kw, upper_kw, level_efficiency = electrolyser_levels(electrolyser, efficiency_adjustment, reduced_efficiencies)
+    n_levels = len(upper_kw)
 
-            problem += electrolyser_kW_level_5[i] <= electrolyser_turned_on_level_5[i] * electrolyser.max_power
-            problem += electrolyser_kW_level_5[i] >= electrolyser_turned_on_level_5[i] * electrolyser.efficiency_load_factor[4] * electrolyser.rated_power
+    if reduced_efficiencies:
+        efficiency_load_factor = electrolyser.full_efficiency_load_factor
+        adjusted_full_efficiency_curve = [e * efficiency_adjustment for e in electrolyser.full_efficiency]
+    else:
+        efficiency_load_factor = electrolyser.efficiency_load_factor
+        adjusted_full_efficiency_curve = [e * efficiency_adjustment for e in electrolyser.efficiency]
 
-            problem += electrolyser_turned_on_level_1[i] + electrolyser_turned_on_level_2[i] + electrolyser_turned_on_level_3[i] + electrolyser_turned_on_level_4[i] + electrolyser_turned_on_level_5[i] <= 1
+    day_complete = False
+    failure_counter = 0
+    day_start_h2_in_storage_kwh = min(day_start_h2_in_storage_kwh, tank.max_storage_kwh)
+    end_of_day_storage_target = min(end_of_day_storage_target, tank.min_storage_kwh)
+    total_min_storage_remaining = min(end_of_day_storage_target, day_start_h2_in_storage_kwh) - 1E-6
+    in_day_min_storage_remaining = total_min_storage_remaining
+
+    while not day_complete:
+
+        electrolyser_kW = MultiDimensionalLpVariable('electrolyser_kW', (len(demand_array), n_levels), 0, None, "Continuous")
+        electrolyser_turned_on = MultiDimensionalLpVariable('electrolyser_turned_on', (len(demand_array), n_levels), 0, 1, cat = "Binary")
+        variables = np.concatenate((electrolyser_kW.variables.ravel(), electrolyser_turned_on.variables.ravel()))
+
+        problem = LpProblem("Minimize_energy_cost_while_meeting_demand", LpMinimize)
+
+        problem += pulp.LpAffineExpression(zip(electrolyser_kW.variables.ravel(), np.repeat(price_array * 0.5 / 1000. / line_losses_after_poi, n_levels)))
+
+        storage_lower_bounds = daily_storage_lower_bounds(len(demand_array), in_day_min_storage_remaining, end_of_day_storage_target, total_min_storage_remaining)
+        for constraint in lp_constraints(variables, *daily_lp_rows(len(demand_array), lower_kw, upper_kw, level_efficiency, day_start_h2_in_storage_kwh, demand_array, storage_lower_bounds, tank)):
+            problem += constraint
 
         start_solver_time = datetime.datetime.now()
 
@@ -158,80 +202,35 @@ def LPcontrol5(data_day, day_start_h2_in_storage_kwh, line_losses_after_poi, lp_
     end_solver_time = datetime.datetime.now()
 
     solver_time = end_solver_time - start_solver_time
-    day_results_df = pd.DataFrame()
+    day_results = None
 
     if not failed_combination_flag:
 
-        electrolyser_kW_level_1.evaluate()
-        electrolyser_kW_level_2.evaluate()
-        electrolyser_kW_level_3.evaluate()
-        electrolyser_kW_level_4.evaluate()
-        electrolyser_kW_level_5.evaluate()
-
-        electrolyser_kW_result = electrolyser_kW_level_1.values + electrolyser_kW_level_2.values + electrolyser_kW_level_3.values + electrolyser_kW_level_4.values + electrolyser_kW_level_5.values
-
-        h2_in_storage_tracker = day_start_h2_in_storage_kwh
-        h2_in_storage = np.zeros(48)
-        h2_to_storage = np.zeros(48)
-        cost_array = np.zeros(48)
-        corrected_cost_array = np.zeros(48)
-        imports_cost_array = np.zeros(48)
-        uos_cost_array = np.zeros(48)
-        supplier_fee_cost_array = np.zeros(48)
-
-        h2_produced_kWh_result = price_array.copy()
-
-        for i in range(0,48):
-
-            h2_produced_kWh_result[i] = 0.5 * ((electrolyser_kW_level_1.values[i] * adjusted_efficiency_1) + (electrolyser_kW_level_2.values[i] * adjusted_efficiency_2) + (electrolyser_kW_level_3.values[i] * adjusted_efficiency_3) + (electrolyser_kW_level_4.values[i] * adjusted_efficiency_4) + (electrolyser_kW_level_5.values[i] * adjusted_efficiency_5))
-            h2_to_storage[i] = h2_produced_kWh_result[i] - demand_array[i]
-            real_efficiency = np.interp(electrolyser_kW_result[i] / electrolyser.rated_power, electrolyser.full_efficiency_load_factor, adjusted_full_efficiency_curve)
-            cost_array[i] = (electrolyser_kW_result[i] / (1000 * line_losses_after_poi)) * price_array[i] * 0.5
-            corrected_cost_array[i] = (h2_produced_kWh_result[i] * price_array[i]) / (1000 * real_efficiency * line_losses_after_poi)
-            imports_cost_array[i] = (h2_produced_kWh_result[i] * import_price_array[i]) / (1000 * real_efficiency * line_losses_after_poi)
-            uos_cost_array[i] = (h2_produced_kWh_result[i] * uos_price_array[i]) / (1000 * real_efficiency * line_losses_after_poi)
-            supplier_fee_cost_array[i] = (h2_produced_kWh_result[i] * supplier_fee_per_mwh) / (1000 * real_efficiency * line_losses_after_poi)
-
-            h2_in_storage_tracker = (h2_in_storage_tracker + h2_to_storage[i]) * tank.remaining_fraction_after_half_hour
-            h2_in_storage[i] = h2_in_storage_tracker
-
-        mean_production_price = np.mean(import_price_array[0:48][h2_produced_kWh_result[0:48] > 0])
-
-        day_results_df['datetime'] = date_array[0:48]
-        day_results_df['import_price'] = import_price_array[0:48]
-        day_results_df['uos_price'] = uos_price_array[0:48]
-        day_results_df['h2_demand_kWh'] = demand_array[0:48]
-        day_results_df['electrolyser_kW'] = electrolyser_kW_result[0:48]
-        day_results_df['electrolyser_kW_1'] = electrolyser_kW_level_1.values[0:48]
-        day_results_df['electrolyser_kW_2'] = electrolyser_kW_level_2.values[0:48]
-        day_results_df['electrolyser_kW_3'] = electrolyser_kW_level_3.values[0:48]
-        day_results_df['electrolyser_kW_4'] = electrolyser_kW_level_4.values[0:48]
-        day_results_df['electrolyser_kW_5'] = electrolyser_kW_level_5.values[0:48]
-        day_results_df['h2_produced_kWh'] = h2_produced_kWh_result[0:48]
-        day_results_df['h2_to_storage_kWh'] = h2_to_storage[0:48]
-        day_results_df['h2_in_storage_kWh'] = h2_in_storage[0:48]
-        day_results_df['h2_cost_total_solver'] = cost_array[0:48]
-        day_results_df['h2_cost_total'] = corrected_cost_array[0:48]
-        day_results_df['h2_cost_imports'] = imports_cost_array[0:48]
-        day_results_df['h2_cost_uos'] = uos_cost_array[0:48]
-        day_results_df['h2_cost_supplier_fee'] = supplier_fee_cost_array[0:48]
+        electrolyser_kW.evaluate()
+
+        day_results, mean_production_price = _summarise_day(date_array, price_array, import_price_array, uos_price_array, demand_array, electrolyser_kW.values.astype(float), level_efficiency, efficiency_load_factor, adjusted_full_efficiency_curve, day_start_h2_in_storage_kwh, line_losses_after_poi, electrolyser, tank, supplier_fee_per_mwh, results=results)
 
     else:
         mean_production_price = 'NaN'
 
-    return(day_results_df, solver_time, end_of_day_storage_target, end_of_day_storage_increase_per_day, failed_combination_flag, mean_production_price)
+    return(day_results, solver_time, end_of_day_storage_target, end_of_day_storage_increase_per_day, failed_combination_flag, mean_production_price)
 
 
-def LPcontrol10(data_day, day_start_h2_in_storage_kwh, line_losses_after_poi, lp_solver_time_limit_seconds, electrolyser, tank, efficiency_adjustment, end_of_day_storage_target, end_of_day_storage_increase_per_day, max_h2_production, failed_combination_flag, supplier_fee_per_mwh):
+def LPcontrolMatrix(data_day, day_start_h2_in_storage_kwh, lp_solver_time_limit_seconds, dispatch_model, efficiency_adjustment, end_of_day_storage_target, end_of_day_storage_increase_per_day, max_h2_production, failed_combination_flag, supplier_fee_per_mwh, warm_start=False, results=None):
 
-    #todo decide whether we need to add a tank max charge rate
-    #todo decide whether we need to check the floor area
+    # Same problem as LPcontrol, held in a DailyDispatchModel that is reused from day to day
+    # With warm_start, the previous day's dispatch is given to the solver as a starting solution
+    # If the dispatch model has a convex_model, the day is first tried on the interpolated curve
+
+    electrolyser = dispatch_model.electrolyser
+    tank = dispatch_model.tank
+    line_losses_after_poi = dispatch_model.line_losses_after_poi
 
-    date_array = data_day.Time
-    price_array = data_day.combined_price
-    import_price_array = data_day.import_price
-    uos_price_array = data_day.uos_charge
-    demand_array = data_day.demand
+    date_array = data_day['Time']
+    price_array = data_day['combined_price']
+    import_price_array = data_day['import_price']
+    uos_price_array = data_day['uos_charge']
+    demand_array = data_day['demand']
 
     day_complete = False
     failure_counter = 0
@@ -242,113 +241,13 @@ def LPcontrol10(data_day, day_start_h2_in_storage_kwh, line_losses_after_poi, lp
 
     while not day_complete:
 
-        cost = 0
-
-        electrolyser_kW_level_1 = MultiDimensionalLpVariable('electrolyser_kW_1', len(data_day), 0, electrolyser.efficiency_load_factor[0] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_2 = MultiDimensionalLpVariable('electrolyser_kW_2', len(data_day), 0, electrolyser.efficiency_load_factor[1] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_3 = MultiDimensionalLpVariable('electrolyser_kW_3', len(data_day), 0, electrolyser.efficiency_load_factor[2] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_4 = MultiDimensionalLpVariable('electrolyser_kW_4', len(data_day), 0, electrolyser.efficiency_load_factor[3] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_5 = MultiDimensionalLpVariable('electrolyser_kW_5', len(data_day), 0, electrolyser.efficiency_load_factor[4] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_6 = MultiDimensionalLpVariable('electrolyser_kW_6', len(data_day), 0, electrolyser.efficiency_load_factor[5] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_7 = MultiDimensionalLpVariable('electrolyser_kW_7', len(data_day), 0, electrolyser.efficiency_load_factor[6] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_8 = MultiDimensionalLpVariable('electrolyser_kW_8', len(data_day), 0, electrolyser.efficiency_load_factor[7] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_9 = MultiDimensionalLpVariable('electrolyser_kW_9', len(data_day), 0, electrolyser.efficiency_load_factor[8] * electrolyser.rated_power, "Continuous")
-        electrolyser_kW_level_10 = MultiDimensionalLpVariable('electrolyser_kW_10', len(data_day), 0, electrolyser.efficiency_load_factor[9] * electrolyser.max_power, "Continuous")
-
-
-        electrolyser_turned_on_level_1 = MultiDimensionalLpVariable('electrolyser_turned_on_1', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_2 = MultiDimensionalLpVariable('electrolyser_turned_on_2', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_3 = MultiDimensionalLpVariable('electrolyser_turned_on_3', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_4 = MultiDimensionalLpVariable('electrolyser_turned_on_4', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_5 = MultiDimensionalLpVariable('electrolyser_turned_on_5', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_6 = MultiDimensionalLpVariable('electrolyser_turned_on_6', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_7 = MultiDimensionalLpVariable('electrolyser_turned_on_7', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_8 = MultiDimensionalLpVariable('electrolyser_turned_on_8', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_9 = MultiDimensionalLpVariable('electrolyser_turned_on_9', len(data_day), 0, 1, cat = "Binary")
-        electrolyser_turned_on_level_10 = MultiDimensionalLpVariable('electrolyser_turned_on_10', len(data_day), 0, 1, cat = "Binary")
-
-        adjusted_efficiency_1 = electrolyser.efficiency[0] * efficiency_adjustment
-        adjusted_efficiency_2 = np.min(electrolyser.efficiency[0:2]) * efficiency_adjustment
-        adjusted_efficiency_3 = np.min(electrolyser.efficiency[1:3]) * efficiency_adjustment
-        adjusted_efficiency_4 = np.min(electrolyser.efficiency[2:4]) * efficiency_adjustment
-        adjusted_efficiency_5 = np.min(electrolyser.efficiency[3:5]) * efficiency_adjustment
-        adjusted_efficiency_6 = np.min(electrolyser.efficiency[4:6]) * efficiency_adjustment
-        adjusted_efficiency_7 = np.min(electrolyser.efficiency[5:7]) * efficiency_adjustment
-        adjusted_efficiency_8 = np.min(electrolyser.efficiency[6:8]) * efficiency_adjustment
-        adjusted_efficiency_9 = np.min(electrolyser.efficiency[7:9]) * efficiency_adjustment
-        adjusted_efficiency_10 = np.min(electrolyser.efficiency[8:10]) * efficiency_adjustment
-
-        adjusted_full_efficiency_curve = [e * efficiency_adjustment for e in electrolyser.efficiency]
-
-        h2_in_storage_kwh = day_start_h2_in_storage_kwh
-
-        problem = LpProblem("Minimize_energy_cost_while_meeting_demand", LpMinimize)
-
-        for i in range(0, len(price_array)):
-            electrolyser_kW = electrolyser_kW_level_1[i] + electrolyser_kW_level_2[i] + electrolyser_kW_level_3[i] + electrolyser_kW_level_4[i] + electrolyser_kW_level_5[i] + electrolyser_kW_level_6[i] + electrolyser_kW_level_7[i] + electrolyser_kW_level_8[i] + electrolyser_kW_level_9[i] + electrolyser_kW_level_10[i]
-            cost += (electrolyser_kW / line_losses_after_poi) * price_array[i] * 0.5 / 1000.
-
-        problem += cost
-
-        for i in range(0, len(price_array)):
-
-            h2_produced_kWh = 0.5 * ((electrolyser_kW_level_1[i] * adjusted_efficiency_1) + (electrolyser_kW_level_2[i] * adjusted_efficiency_2) + (electrolyser_kW_level_3[i] * adjusted_efficiency_3) + (electrolyser_kW_level_4[i] * adjusted_efficiency_4) + (electrolyser_kW_level_5[i] * adjusted_efficiency_5) + (electrolyser_kW_level_6[i] * adjusted_efficiency_6) + (electrolyser_kW_level_7[i] * adjusted_efficiency_7) + (electrolyser_kW_level_8[i] * adjusted_efficiency_8) + (electrolyser_kW_level_9[i] * adjusted_efficiency_9) + (electrolyser_kW_level_10[i] * adjusted_efficiency_10))
-
-            h2_storage_space_available_kwh = tank.max_storage_kwh - h2_in_storage_kwh
-
-            h2_to_storage = h2_produced_kWh - demand_array[i]
-            storage_remaining = h2_in_storage_kwh + h2_to_storage
-            storage_overfill = h2_to_storage - h2_storage_space_available_kwh
-
-            h2_in_storage_kwh = (h2_in_storage_kwh + h2_to_storage) * tank.remaining_fraction_after_half_hour
-
-            if i == 47:
-                problem += storage_remaining >= end_of_day_storage_target
-            elif i < 47:
-                problem += storage_remaining >= in_day_min_storage_remaining
-            else:
-                problem += storage_remaining >= total_min_storage_remaining
-
-            problem += storage_overfill <= 0
-
-            problem += electrolyser_kW_level_1[i] <= electrolyser_turned_on_level_1[i] * electrolyser.efficiency_load_factor[0] * electrolyser.rated_power
-            problem += electrolyser_kW_level_1[i] >= electrolyser_turned_on_level_1[i] * electrolyser.min_power
-
-            problem += electrolyser_kW_level_2[i] <= electrolyser_turned_on_level_2[i] * electrolyser.efficiency_load_factor[1] * electrolyser.rated_power
-            problem += electrolyser_kW_level_2[i] >= electrolyser_turned_on_level_2[i] * electrolyser.efficiency_load_factor[0] * electrolyser.rated_power
-
-            problem += electrolyser_kW_level_3[i] <= electrolyser_turned_on_level_3[i] * electrolyser.efficiency_load_factor[2] * electrolyser.rated_power
-            problem += electrolyser_kW_level_3[i] >= electrolyser_turned_on_level_3[i] * electrolyser.efficiency_load_factor[1] * electrolyser.rated_power
-
-            problem += electrolyser_kW_level_4[i] <= electrolyser_turned_on_level_4[i] * electrolyser.efficiency_load_factor[3] * electrolyser.rated_power
-            problem += electrolyser_kW_level_4[i] >= electrolyser_turned_on_level_4[i] * electrolyser.efficiency_load_factor[2] * electrolyser.rated_power
-
-            problem += electrolyser_kW_level_5[i] <= electrolyser_turned_on_level_5[i] * electrolyser.efficiency_load_factor[4] * electrolyser.rated_power
-            problem += electrolyser_kW_level_5[i] >= electrolyser_turned_on_level_5[i] * electrolyser.efficiency_load_factor[3] * electrolyser.rated_power
-
-            problem += electrolyser_kW_level_6[i] <= electrolyser_turned_on_level_6[i] * electrolyser.efficiency_load_factor[5] * electrolyser.rated_power
-            problem += electrolyser_kW_level_6[i] >= electrolyser_turned_on_level_6[i] * electrolyser.efficiency_load_factor[4] * electrolyser.rated_power
-
-            problem += electrolyser_kW_level_7[i] <= electrolyser_turned_on_level_7[i] * electrolyser.efficiency_load_factor[6] * electrolyser.rated_power
-            problem += electrolyser_kW_level_7[i] >= electrolyser_turned_on_level_7[i] * electrolyser.efficiency_load_factor[5] * electrolyser.rated_power
-
-            problem += electrolyser_kW_level_8[i] <= electrolyser_turned_on_level_8[i] * electrolyser.efficiency_load_factor[7] * electrolyser.rated_power
-            problem += electrolyser_kW_level_8[i] >= electrolyser_turned_on_level_8[i] * electrolyser.efficiency_load_factor[6] * electrolyser.rated_power
-
-            problem += electrolyser_kW_level_9[i] <= electrolyser_turned_on_level_9[i] * electrolyser.efficiency_load_factor[8] * electrolyser.rated_power
-            problem += electrolyser_kW_level_9[i] >= electrolyser_turned_on_level_9[i] * electrolyser.efficiency_load_factor[7] * electrolyser.rated_power
-
-            problem += electrolyser_kW_level_10[i] <= electrolyser_turned_on_level_10[i] * electrolyser.max_power
-            problem += electrolyser_kW_level_10[i] >= electrolyser_turned_on_level_10[i] * electrolyser.efficiency_load_factor[8] * electrolyser.rated_power
-
-
-            problem += electrolyser_turned_on_level_1[i] + electrolyser_turned_on_level_2[i] + electrolyser_turned_on_level_3[i] + electrolyser_turned_on_level_4[i] + electrolyser_turned_on_level_5[i] + electrolyser_turned_on_level_6[i] + electrolyser_turned_on_level_7[i] + electrolyser_turned_on_level_8[i] + electrolyser_turned_on_level_9[i] + electrolyser_turned_on_level_10[i] <= 1
+        storage_lower_bounds = daily_storage_lower_bounds(len(demand_array), in_day_min_storage_remaining, end_of_day_storage_target, total_min_storage_remaining)
 
         start_solver_time = datetime.datetime.now()
 
-        problem.solve(PULP_CBC_CMD(msg=False, keepFiles=False, timeLimit=lp_solver_time_limit_seconds))
+        solved, electrolyser_kW_levels, level_efficiency = dispatch_model.dispatch(price_array, demand_array, day_start_h2_in_storage_kwh, storage_lower_bounds, efficiency_adjustment, lp_solver_time_limit_seconds, warm_start)
 
-        if problem.status == 1:
+        if solved:
             day_complete = True
         else:
             failure_counter += 1
@@ -381,77 +280,125 @@ def LPcontrol10(data_day, day_start_h2_in_storage_kwh, line_losses_after_poi, lp
     end_solver_time = datetime.datetime.now()
 
     solver_time = end_solver_time - start_solver_time
-    day_results_df = pd.DataFrame()
+    day_results = None
 
     if not failed_combination_flag:
 
-        electrolyser_kW_level_1.evaluate()
-        electrolyser_kW_level_2.evaluate()
-        electrolyser_kW_level_3.evaluate()
-        electrolyser_kW_level_4.evaluate()
-        electrolyser_kW_level_5.evaluate()
-        electrolyser_kW_level_6.evaluate()
-        electrolyser_kW_level_7.evaluate()
-        electrolyser_kW_level_8.evaluate()
-        electrolyser_kW_level_9.evaluate()
-        electrolyser_kW_level_10.evaluate()
-
-        electrolyser_kW_result = electrolyser_kW_level_1.values + electrolyser_kW_level_2.values + electrolyser_kW_level_3.values + electrolyser_kW_level_4.values + electrolyser_kW_level_5.values + electrolyser_kW_level_6.values + electrolyser_kW_level_7.values + electrolyser_kW_level_8.values + electrolyser_kW_level_9.values + electrolyser_kW_level_10.values
-
-        h2_in_storage_tracker = day_start_h2_in_storage_kwh
-        h2_in_storage = np.zeros(48)
-        h2_to_storage = np.zeros(48)
-        cost_array = np.zeros(48)
-        corrected_cost_array = np.zeros(48)
-        imports_cost_array = np.zeros(48)
-        uos_cost_array = np.zeros(48)
-        supplier_fee_cost_array = np.zeros(48)
-
-
-        h2_produced_kWh_result = price_array.copy()
-
-        for i in range(0,48):
-
-            h2_produced_kWh_result[i] = 0.5 * ((electrolyser_kW_level_1.values[i] * adjusted_efficiency_1) + (electrolyser_kW_level_2.values[i] * adjusted_efficiency_2) + (electrolyser_kW_level_3.values[i] * adjusted_efficiency_3) + (electrolyser_kW_level_4.values[i] * adjusted_efficiency_4) + (electrolyser_kW_level_5.values[i] * adjusted_efficiency_5) + (electrolyser_kW_level_6.values[i] * adjusted_efficiency_6) + (electrolyser_kW_level_7.values[i] * adjusted_efficiency_7) + (electrolyser_kW_level_8.values[i] * adjusted_efficiency_8) + (electrolyser_kW_level_9.values[i] * adjusted_efficiency_9) + (electrolyser_kW_level_10.values[i] * adjusted_efficiency_10))
-            h2_to_storage[i] = h2_produced_kWh_result[i] - demand_array[i]
-            real_efficiency = np.interp(electrolyser_kW_result[i] / electrolyser.rated_power, electrolyser.efficiency_load_factor, adjusted_full_efficiency_curve)
-            cost_array[i] = (electrolyser_kW_result[i] / (1000 * line_losses_after_poi)) * price_array[i] * 0.5
-            corrected_cost_array[i] = (h2_produced_kWh_result[i] * price_array[i]) / (1000 * real_efficiency * line_losses_after_poi)
-            imports_cost_array[i] = (h2_produced_kWh_result[i] * import_price_array[i]) / (1000 * real_efficiency * line_losses_after_poi)
-            uos_cost_array[i] = (h2_produced_kWh_result[i] * uos_price_array[i]) / (1000 * real_efficiency * line_losses_after_poi)
-            supplier_fee_cost_array[i] = (h2_produced_kWh_result[i] * supplier_fee_per_mwh) / (1000 * real_efficiency * line_losses_after_poi)
-
-            h2_in_storage_tracker = (h2_in_storage_tracker + h2_to_storage[i]) * tank.remaining_fraction_after_half_hour
-            h2_in_storage[i] = h2_in_storage_tracker
-
-        mean_production_price = np.mean(import_price_array[0:48][h2_produced_kWh_result[0:48] > 0])
-
-        day_results_df['datetime'] = date_array[0:48]
-        day_results_df['import_price'] = import_price_array[0:48]
-        day_results_df['uos_price'] = uos_price_array[0:48]
-        day_results_df['h2_demand_kWh'] = demand_array[0:48]
-        day_results_df['electrolyser_kW'] = electrolyser_kW_result[0:48]
-        day_results_df['electrolyser_kW_1'] = electrolyser_kW_level_1.values[0:48]
-        day_results_df['electrolyser_kW_2'] = electrolyser_kW_level_2.values[0:48]
-        day_results_df['electrolyser_kW_3'] = electrolyser_kW_level_3.values[0:48]
-        day_results_df['electrolyser_kW_4'] = electrolyser_kW_level_4.values[0:48]
-        day_results_df['electrolyser_kW_5'] = electrolyser_kW_level_5.values[0:48]
-        day_results_df['electrolyser_kW_6'] = electrolyser_kW_level_6.values[0:48]
-        day_results_df['electrolyser_kW_7'] = electrolyser_kW_level_7.values[0:48]
-        day_results_df['electrolyser_kW_8'] = electrolyser_kW_level_8.values[0:48]
-        day_results_df['electrolyser_kW_9'] = electrolyser_kW_level_9.values[0:48]
-        day_results_df['electrolyser_kW_10'] = electrolyser_kW_level_10.values[0:48]
-        day_results_df['h2_produced_kWh'] = h2_produced_kWh_result[0:48]
-        day_results_df['h2_to_storage_kWh'] = h2_to_storage[0:48]
-        day_results_df['h2_in_storage_kWh'] = h2_in_storage[0:48]
-        day_results_df['h2_cost_total_solver'] = cost_array[0:48]
-        day_results_df['h2_cost_total'] = corrected_cost_array[0:48]
-        day_results_df['h2_cost_imports'] = imports_cost_array[0:48]
-        day_results_df['h2_cost_uos'] = uos_cost_array[0:48]
-        day_results_df['h2_cost_supplier_fee'] = supplier_fee_cost_array[0:48]
-
-
-    return(day_results_df, solver_time, end_of_day_storage_target, end_of_day_storage_increase_per_day, failed_combination_flag, mean_production_price)
+        adjusted_full_efficiency_curve = [e * efficiency_adjustment for e in dispatch_model.curve_efficiency]
+
+        day_results, mean_production_price = _summarise_day(date_array, price_array, import_price_array, uos_price_array, demand_array, electrolyser_kW_levels, level_efficiency, dispatch_model.curve_load_factor, adjusted_full_efficiency_curve, day_start_h2_in_storage_kwh, line_losses_after_poi, electrolyser, tank, supplier_fee_per_mwh, results=results)
+
+    else:
+        mean_production_price = 'NaN'
+
+    return(day_results, solver_time, end_of_day_storage_target, end_of_day_storage_increase_per_day, failed_combination_flag, mean_production_price)
+
+
+def LPcontrolRollingWindow(data_window, n_commit_periods, day_start_h2_in_storage_kwh, lp_solver_time_limit_seconds, dispatch_model, efficiency_adjustment, failed_combination_flag, supplier_fee_per_mwh, warm_start=False, periods_since_last_solve=48, results=None):
+
+    # Optimise a window of several days of actual data and keep only the first n_commit_periods of the dispatch
+    # The storage limits are lowered up front to what the electrolyser can reach, so there is no infeasible day rerun
+
+    electrolyser = dispatch_model.electrolyser
+    tank = dispatch_model.tank
+    line_losses_after_poi = dispatch_model.line_losses_after_poi
+
+    date_array = data_window['Time']
+    price_array = data_window['combined_price']
+    import_price_array = data_window['import_price']
+    uos_price_array = data_window['uos_charge']
+    demand_array = data_window['demand']
+
+    day_start_h2_in_storage_kwh = min(day_start_h2_in_storage_kwh, tank.max_storage_kwh)
+    max_h2_production_kwh = 0.5 * np.max(dispatch_model.upper_kw * dispatch_model.base_level_efficiency) * efficiency_adjustment
+    storage_lower_bounds = achievable_storage_lower_bounds(demand_array, day_start_h2_in_storage_kwh, tank.min_storage_kwh, max_h2_production_kwh, tank)
+
+    start_solver_time = datetime.datetime.now()
+
+    solved, electrolyser_kW_levels, level_efficiency = dispatch_model.dispatch(price_array, demand_array, day_start_h2_in_storage_kwh, storage_lower_bounds, efficiency_adjustment, lp_solver_time_limit_seconds, warm_start, periods_since_last_solve)
+
+    solver_time = datetime.datetime.now() - start_solver_time
+    day_results = None
+
+    if solved:
+
+        adjusted_full_efficiency_curve = [e * efficiency_adjustment for e in dispatch_model.curve_efficiency]
+
+        day_results, mean_production_price = _summarise_day(date_array, price_array, import_price_array, uos_price_array, demand_array, electrolyser_kW_levels, level_efficiency, dispatch_model.curve_load_factor, adjusted_full_efficiency_curve, day_start_h2_in_storage_kwh, line_losses_after_poi, electrolyser, tank, supplier_fee_per_mwh, n_commit_periods, dispatch_model.relax_integrality, results)
+
+    else:
+        failed_combination_flag = True
+        mean_production_price = 'NaN'
+        print('Control failed to solve for at least one window with this input combination!')
+
+    return(day_results, solver_time, failed_combination_flag, mean_production_price)
+
+
+def _summarise_day(date_array, price_array, import_price_array, uos_price_array, demand_array, electrolyser_kW_levels, level_efficiency, efficiency_load_factor, adjusted_full_efficiency_curve, day_start_h2_in_storage_kwh, line_losses_after_poi, electrolyser, tank, supplier_fee_per_mwh, n_periods=48, cost_at_level_efficiency=False, results=None):
+
+    # Writes the first n_periods into the next rows of results (a new ResultsBuffer if none is given) and returns them
+    # With cost_at_level_efficiency the H2 is costed at the better of the solver's level efficiency and the full curve,
+    # which keeps the cost of a relaxed dispatch (possibly below min power) a lower bound
+
+    n_levels = electrolyser_kW_levels.shape[1]
+    if results is None:
+        results = ResultsBuffer(n_periods)
+    day_results = results.next_rows(n_periods, n_levels)
+
+    level_efficiency = np.broadcast_to(level_efficiency, electrolyser_kW_levels.shape)[0:n_periods] #may differ by period
+    electrolyser_kW_levels = electrolyser_kW_levels[0:n_periods]
+    electrolyser_kW_result = electrolyser_kW_levels.sum(axis=1)
+    price_array = np.asarray(price_array[0:n_periods], dtype=float)
+    import_price_array = np.asarray(import_price_array[0:n_periods], dtype=float)
+    uos_price_array = np.asarray(uos_price_array[0:n_periods], dtype=float)
+    demand_array = np.asarray(demand_array[0:n_periods], dtype=float)
+
+    h2_produced_kWh_result = day_results['h2_produced_kWh']
+    h2_produced_kWh_result[:] = 0.5 * (electrolyser_kW_levels * level_efficiency).sum(axis=1)
+    day_results['h2_to_storage_kWh'][:] = h2_produced_kWh_result - demand_array
+    day_results['h2_in_storage_kWh'][:] = storage_after_leakage(day_start_h2_in_storage_kwh, day_results['h2_to_storage_kWh'], tank.remaining_fraction_after_half_hour)
+
+    real_efficiency = np.interp(electrolyser_kW_result / electrolyser.rated_power, efficiency_load_factor, adjusted_full_efficiency_curve)
+    if cost_at_level_efficiency:
+        on = electrolyser_kW_result > 0
+        real_efficiency[on] = np.maximum(real_efficiency[on], h2_produced_kWh_result[on] / (0.5 * electrolyser_kW_result[on]))
+
+    day_results['h2_cost_total_solver'][:] = (electrolyser_kW_result / (1000 * line_losses_after_poi)) * price_array * 0.5
+    day_results['h2_cost_total'][:] = (h2_produced_kWh_result * price_array) / (1000 * real_efficiency * line_losses_after_poi)
+    day_results['h2_cost_imports'][:] = (h2_produced_kWh_result * import_price_array) / (1000 * real_efficiency * line_losses_after_poi)
+    day_results['h2_cost_uos'][:] = (h2_produced_kWh_result * uos_price_array) / (1000 * real_efficiency * line_losses_after_poi)
+    day_results['h2_cost_supplier_fee'][:] = (h2_produced_kWh_result * supplier_fee_per_mwh) / (1000 * real_efficiency * line_losses_after_poi)
+
+    mean_production_price = np.mean(import_price_array[h2_produced_kWh_result > 0])
+
+    day_results['datetime'][:] = date_array[0:n_periods]
+    day_results['import_price'][:] = import_price_array
+    day_results['uos_price'][:] = uos_price_array
+    day_results['h2_demand_kWh'][:] = demand_array
+    day_results['electrolyser_kW'][:] = electrolyser_kW_result
+    for level in range(0, n_levels):
+        day_results['electrolyser_kW_' + str(level + 1)][:] = electrolyser_kW_levels[:, level]
+
+    return day_results, mean_production_price
+
+
+def storage_after_leakage(start_kwh, h2_to_storage, remaining_fraction, block_periods=48):
+    """
+    H2 in storage after each period, where each period's H2 to storage is added and the leakage then applied. Each day
+    is a cumulative sum scaled by powers of the half hourly decay, kept to a day so the powers stay well scaled.
+    """
+
+    h2_to_storage = np.asarray(h2_to_storage, dtype=float)
+    decay = remaining_fraction ** np.arange(1, block_periods + 1)
+    h2_in_storage = np.empty(len(h2_to_storage))
+
+    for block_start in range(0, len(h2_to_storage), block_periods):
+        n = min(block_periods, len(h2_to_storage) - block_start)
+        block = slice(block_start, block_start + n)
+        h2_in_storage[block] = decay[0:n] * (start_kwh + np.cumsum(h2_to_storage[block] * remaining_fraction / decay[0:n]))
+        start_kwh = h2_in_storage[block_start + n - 1]
+
+    return h2_in_storage
 
 
 def NoStorageDay(date_array, price_array, h2_price_array, demand_array, day_results_df, day_start_h2_in_storage_kwh):
@@ -0,0 +1,431 @@
+import numpy as np
+from scipy import sparse
+from scipy.ndimage import minimum_filter1d
+
+try:
+    from hoptimiser.solvers import get_solver
+except:
+    from solvers import get_solver
+
+
+def piecewise_levels(load_factor, efficiency, rated_power, max_power, min_power):
+    """
+    Operating levels between consecutive breakpoints of an efficiency curve, any number of them. The first level
+    starts at min power, the last ends at the last load factor of max power, and each level takes the lower of the
+    efficiencies at its two ends. Returns the lower and upper power (kW) and efficiency of each level.
+    """
+
+    load_factor = np.asarray(load_factor, dtype=float)
+    efficiency = np.asarray(efficiency, dtype=float)
+
+    upper_kw = load_factor[1:] * rated_power
+    upper_kw[-1] = load_factor[-1] * max_power
+    lower_kw = np.concatenate(([min_power], load_factor[1:-1] * rated_power))
+    level_efficiency = np.minimum(efficiency[:-1], efficiency[1:])
+
+    return lower_kw, upper_kw, level_efficiency
+
+
+def electrolyser_levels(electrolyser, efficiency_adjustment, reduced_efficiencies):
+    """
+    Lower/upper power (kW) and efficiency of each piecewise operating level, as used by LPcontrol. A reduced curve is
+    split at its breakpoints, while a full curve also gets a level from min power up to its first load factor.
+    """
+
+    load_factor = np.asarray(electrolyser.efficiency_load_factor, dtype=float)
+    efficiency = np.asarray(electrolyser.efficiency, dtype=float)
+
+    if not reduced_efficiencies:
+        load_factor = np.concatenate((load_factor[0:1], load_factor))
+        efficiency = np.concatenate((efficiency[0:1], efficiency))
+
+    lower_kw, upper_kw, level_efficiency = piecewise_levels(load_factor, efficiency, electrolyser.rated_power, electrolyser.max_power, electrolyser.min_power)
+
+    return lower_kw, upper_kw, level_efficiency * efficiency_adjustment
+
+
+class DailyDispatchModel:
+    """
+    The LPcontrol MILP as arrays (min c.x, row_lower <= A.x <= row_upper, col_lower <= x <= col_upper), built once per
+    combination with update() rewriting the day's data. Columns are the kW and on binary of each (period, level), then
+    the storage at the end of each period.
+    """
+
+    def __init__(self, electrolyser, tank, line_losses_after_poi, reduced_efficiencies, n_periods=72, solver='CBC', convex_fast_path=False, relax_integrality=False):
+        self.electrolyser = electrolyser
+        self.tank = tank
+        self.line_losses_after_poi = line_losses_after_poi
+        self.reduced_efficiencies = reduced_efficiencies
+        self.n_periods = n_periods
+        self.solver = solver
+        self._solve_function = get_solver(solver)
+        self.relax_integrality = relax_integrality
+        self.previous_solution = None
+        self.warm_started = False
+
+        # the efficiency curve that the results are costed against
+        if reduced_efficiencies:
+            self.curve_load_factor = electrolyser.full_efficiency_load_factor
+            self.curve_efficiency = electrolyser.full_efficiency
+        else:
+            self.curve_load_factor = electrolyser.efficiency_load_factor
+            self.curve_efficiency = electrolyser.efficiency
+
+        self.convex_model = None
+        if convex_fast_path or relax_integrality:
+            segments = concave_h2_segments(electrolyser, self.curve_load_factor, self.curve_efficiency)
+            if segments is not None:
+                self.convex_model = ConvexDispatchModel(tank, line_losses_after_poi, segments[0], segments[1], n_periods, solver)
+
+        self.lower_kw, self.upper_kw, self.base_level_efficiency = electrolyser_levels(electrolyser, 1.0, reduced_efficiencies)
+        self.level_efficiency = self.base_level_efficiency.copy()
+        self.n_levels = len(self.upper_kw)
+        self.n_level_vars = n_periods * self.n_levels
+
+        self.kw_cols = np.arange(self.n_level_vars).reshape(n_periods, self.n_levels)
+        self.on_cols = self.kw_cols + self.n_level_vars
+        self.storage_cols = 2 * self.n_level_vars + np.arange(n_periods)
+        self.n_cols = 2 * self.n_level_vars + n_periods
+
+        self._build_structure()
+
+    def _build_structure(self):
+        n_periods = self.n_periods
+        n_level_vars = self.n_level_vars
+        periods = np.repeat(np.arange(n_periods), self.n_levels)
+
+        # storage recursion: s[i] - r * s[i-1] - 0.5 * sum_k(eff[k] * kW[i, k]) = -demand[i]
+        storage_rows = np.concatenate((np.arange(n_periods), np.arange(1, n_periods), periods))
+        storage_col_idx = np.concatenate((self.storage_cols, self.storage_cols[:-1], self.kw_cols.ravel()))
+        storage_data = np.concatenate((np.ones(n_periods),
+                                       np.full(n_periods - 1, -self.tank.remaining_fraction_after_half_hour),
+                                       np.tile(-0.5 * self.level_efficiency, n_periods)))
+
+        # kW[i, k] - upper[k] * on[i, k] <= 0 and kW[i, k] - lower[k] * on[i, k] >= 0
+        level_rows = np.arange(n_level_vars)
+        upper_rows = n_periods + np.concatenate((level_rows, level_rows))
+        lower_rows = upper_rows + n_level_vars
+        level_col_idx = np.concatenate((self.kw_cols.ravel(), self.on_cols.ravel()))
+        upper_data = np.concatenate((np.ones(n_level_vars), np.tile(-self.upper_kw, n_periods)))
+        lower_data = np.concatenate((np.ones(n_level_vars), np.tile(-self.lower_kw, n_periods)))
+
+        # sum_k on[i, k] <= 1
+        one_level_rows = n_periods + 2 * n_level_vars + periods
+
+        rows = np.concatenate((storage_rows, upper_rows, lower_rows, one_level_rows))
+        cols = np.concatenate((storage_col_idx, level_col_idx, level_col_idx, self.on_cols.ravel()))
+        data = np.concatenate((storage_data, upper_data, lower_data, np.ones(n_level_vars)))
+        n_rows = 2 * n_periods + 2 * n_level_vars
+
+        # build with entry numbers as values to find where each entry lands in the CSR data array
+        self.a_matrix = sparse.csr_matrix((np.arange(1, len(data) + 1, dtype=float), (rows, cols)), shape=(n_rows, self.n_cols))
+        entry_order = self.a_matrix.data.astype(int) - 1
+        self.a_matrix.data = data[entry_order]
+        entry_position = np.empty(len(data), dtype=int)
+        entry_position[entry_order] = np.arange(len(data))
+        efficiency_entries = 2 * n_periods - 1 + np.arange(n_level_vars)
+        self._efficiency_data_idx = entry_position[efficiency_entries]
+
+        self.c = np.zeros(self.n_cols)
+
+        self.row_lower = np.concatenate((np.zeros(n_periods), np.full(n_level_vars, -np.inf), np.zeros(n_level_vars), np.full(n_periods, -np.inf)))
+        self.row_upper = np.concatenate((np.zeros(n_periods), np.zeros(n_level_vars), np.full(n_level_vars, np.inf), np.ones(n_periods)))
+
+        self.col_lower = np.zeros(self.n_cols)
+        self.col_upper = np.concatenate((np.tile(self.upper_kw, n_periods), np.ones(n_level_vars), np.full(n_periods, self.tank.max_storage_kwh)))
+
+        self.integrality = np.concatenate((np.zeros(n_level_vars), np.ones(n_level_vars), np.zeros(n_periods))).astype(int)
+        if self.relax_integrality:
+            self.integrality[:] = 0
+
+    def update(self, price_array, demand_array, day_start_h2_in_storage_kwh, storage_lower_bounds, efficiency_adjustment):
+        price_array = np.asarray(price_array, dtype=float)
+
+        self.c[self.kw_cols] = (price_array[:, None] * 0.5 / 1000.) / self.line_losses_after_poi
+
+        storage_rhs = -np.asarray(demand_array, dtype=float)
+        storage_rhs[0] += day_start_h2_in_storage_kwh
+        self.row_lower[0:self.n_periods] = storage_rhs
+        self.row_upper[0:self.n_periods] = storage_rhs
+
+        self.col_lower[self.storage_cols] = storage_lower_bounds
+
+        self.level_efficiency = self.base_level_efficiency * efficiency_adjustment
+        self.a_matrix.data[self._efficiency_data_idx] = np.tile(-0.5 * self.level_efficiency, self.n_periods)
+
+    def dispatch(self, price_array, demand_array, day_start_h2_in_storage_kwh, storage_lower_bounds, efficiency_adjustment, time_limit, warm_start=False, periods_since_last_solve=48):
+        """Returns whether a dispatch was found, and the kW and efficiency of each (period, level)."""
+
+        if self.convex_model is not None:
+            self.convex_model.update(price_array, demand_array, day_start_h2_in_storage_kwh, storage_lower_bounds, efficiency_adjustment)
+            solved, kw, h2_produced_kwh = self.convex_model.solve(time_limit, enforce_min_power=not self.relax_integrality)
+            if solved:
+                # the next MIP would be started from this, which is not in its layout
+                self.previous_solution = None
+                self.warm_started = False
+                self.update(price_array, demand_array, day_start_h2_in_storage_kwh, storage_lower_bounds, efficiency_adjustment)
+                kw_levels, level_efficiency = self.level_dispatch(kw, h2_produced_kwh)
+                return True, kw_levels, level_efficiency
+
+        self.update(price_array, demand_array, day_start_h2_in_storage_kwh, storage_lower_bounds, efficiency_adjustment)
+        solved, x = self.solve(time_limit, warm_start, periods_since_last_solve)
+        if not solved:
+            return False, None, None
+
+        return True, self.electrolyser_kw(x), self.level_efficiency
+
+    def solve(self, time_limit, warm_start=False, periods_since_last_solve=48):
+        start = None
+        if warm_start and self.previous_solution is not None:
+            start = self._shifted_previous_solution(periods_since_last_solve)
+
+        solved, x = self._solve_function(self.c, self.a_matrix, self.row_lower, self.row_upper, self.col_lower, self.col_upper, self.integrality, time_limit, warm_start=start)
+
+        self.warm_started = start is not None
+        if start is not None and (not solved or self.c.dot(start) < self.c.dot(x)):
+            solved, x = True, start
+
+        self.previous_solution = x if solved else None
+
+        return solved, x
+
+    def _shifted_previous_solution(self, periods_since_last_solve):
+        # later periods repeat the last dispatch at the same time of day
+        shift = np.arange(self.n_periods) + periods_since_last_solve
+        shift -= 48 * np.ceil(np.maximum(shift - self.n_periods + 1, 0) / 48).astype(int)
+        target_h2 = 0.5 * self.electrolyser_kw(self.previous_solution).dot(self.level_efficiency)[shift]
+
+        # follow the shifted H2 production as closely as today's storage limits allow, as the start must be feasible
+        level_h2_lower = 0.5 * self.lower_kw * self.level_efficiency
+        level_h2_upper = 0.5 * self.upper_kw * self.level_efficiency
+        storage_lower = self.col_lower[self.storage_cols]
+        storage_upper = self.col_upper[self.storage_cols]
+
+        kw = np.zeros((self.n_periods, self.n_levels))
+        on = np.zeros((self.n_periods, self.n_levels))
+        storage = np.zeros(self.n_periods)
+        previous_storage = 0
+
+        for i in range(self.n_periods):
+            storage_without_h2 = previous_storage * self.tank.remaining_fraction_after_half_hour + self.row_lower[i]
+            h2_min = storage_lower[i] - storage_without_h2
+            h2_max = storage_upper[i] - storage_without_h2
+
+            level_h2 = np.clip(target_h2[i], level_h2_lower, level_h2_upper)
+            level_h2[(level_h2 < h2_min) | (level_h2 > h2_max)] = np.nan
+            off_h2 = 0 if h2_min <= 0 <= h2_max else np.nan
+            if np.isnan(level_h2).all() and np.isnan(off_h2):
+                return None
+
+            if np.isnan(level_h2).all() or abs(off_h2 - target_h2[i]) <= np.nanmin(abs(level_h2 - target_h2[i])):
+                h2 = 0
+            else:
+                level = np.nanargmin(abs(level_h2 - target_h2[i]))
+                h2 = level_h2[level]
+                kw[i, level] = h2 / (0.5 * self.level_efficiency[level])
+                on[i, level] = 1
+
+            storage[i] = storage_without_h2 + h2
+            previous_storage = storage[i]
+
+        return np.concatenate((kw.ravel(), on.ravel(), storage))
+
+    def electrolyser_kw(self, x):
+        return x[0:self.n_level_vars].reshape(self.n_periods, self.n_levels)
+
+    def level_dispatch(self, kw, h2_produced_kwh):
+        """Put a dispatch from the ConvexDispatchModel into the level layout, with the efficiency of each period's level set to match its H2 output."""
+
+        in_level = kw[:, None] <= self.upper_kw + 1E-6
+        level = np.where(in_level.any(axis=1), in_level.argmax(axis=1), self.n_levels - 1)
+        periods = np.arange(self.n_periods)
+
+        kw_levels = np.zeros((self.n_periods, self.n_levels))
+        kw_levels[periods, level] = kw
+
+        level_efficiency = np.tile(self.level_efficiency, (self.n_periods, 1))
+        on = kw > 0
+        level_efficiency[periods[on], level[on]] = h2_produced_kwh[on] / (0.5 * kw[on])
+
+        return kw_levels, level_efficiency
+
+
+def concave_h2_segments(electrolyser, load_factor, efficiency):
+    """Widths (kW) and H2 per kW of the segments of the concave hull of H2 output against power, or None if the curve is not concave beyond the first."""
+
+    load_factor = np.asarray(load_factor, dtype=float)
+    efficiency = np.asarray(efficiency, dtype=float)
+
+    max_kw = load_factor[-1] * electrolyser.max_power
+    curve_kw = load_factor * electrolyser.rated_power
+    curve_kw = curve_kw[(curve_kw > electrolyser.min_power) & (curve_kw < max_kw)]
+    kw_points = np.concatenate(([0, electrolyser.min_power], curve_kw, [max_kw]))
+    h2_points = kw_points * np.interp(kw_points / electrolyser.rated_power, load_factor, efficiency)
+
+    hull = [0]
+    for j in range(1, len(kw_points)):
+        while len(hull) >= 2:
+            a, b = hull[-2], hull[-1]
+            if (h2_points[b] - h2_points[a]) * (kw_points[j] - kw_points[a]) > (h2_points[j] - h2_points[a]) * (kw_points[b] - kw_points[a]):
+                break
+            hull.pop()
+        hull.append(j)
+
+    hull_h2 = np.interp(kw_points, kw_points[hull], h2_points[hull])
+    beyond_first_segment = kw_points > kw_points[hull[1]]
+    if np.any(h2_points[beyond_first_segment] < hull_h2[beyond_first_segment] - 1E-9 * h2_points[-1]):
+        return None
+
+    return np.diff(kw_points[hull]), np.diff(h2_points[hull]) / np.diff(kw_points[hull])
+
+
+class ConvexDispatchModel:
+    """
+    The daily dispatch over the segments of concave_h2_segments, with the H2 interpolated along the curve rather than
+    taken at each level's efficiency as in the MILP. The on column of each period is only made binary on days the
+    LP leaves one part way on.
+    """
+
+    def __init__(self, tank, line_losses_after_poi, segment_kw, segment_efficiency, n_periods=72, solver='CBC'):
+        self.tank = tank
+        self.line_losses_after_poi = line_losses_after_poi
+        self.segment_kw = segment_kw
+        self.base_segment_efficiency = segment_efficiency
+        self.segment_efficiency = segment_efficiency.copy()
+        self.n_periods = n_periods
+        self.n_segments = len(segment_kw)
+        self.n_segment_vars = n_periods * self.n_segments
+        self._solve_function = get_solver(solver)
+        self.solved = False
+
+        self.kw_cols = np.arange(self.n_segment_vars).reshape(n_periods, self.n_segments)
+        self.storage_cols = self.n_segment_vars + np.arange(n_periods)
+        self.on_cols = self.n_segment_vars + n_periods + np.arange(n_periods)
+        self.n_cols = self.n_segment_vars + 2 * n_periods
+
+        self._build_structure()
+
+    def _build_structure(self):
+        n_periods = self.n_periods
+        n_segments = self.n_segments
+
+        # storage recursion as in DailyDispatchModel, one row per period with its segments then s[i-1] then s[i]
+        row_length = np.full(n_periods, n_segments + 2)
+        row_length[0] = n_segments + 1
+        indptr = np.concatenate(([0], np.cumsum(row_length)))
+
+        indices = np.zeros(indptr[-1], dtype=int)
+        data = np.zeros(indptr[-1])
+        self._efficiency_data_idx = np.zeros((n_periods, n_segments), dtype=int)
+        for i in range(n_periods):
+            row_indices = list(self.kw_cols[i]) + ([self.storage_cols[i - 1]] if i > 0 else []) + [self.storage_cols[i]]
+            indices[indptr[i]:indptr[i + 1]] = row_indices
+            data[indptr[i + 1] - 1] = 1
+            if i > 0:
+                data[indptr[i + 1] - 2] = -self.tank.remaining_fraction_after_half_hour
+            self._efficiency_data_idx[i] = indptr[i] + np.arange(n_segments)
+
+        storage_matrix = sparse.csr_matrix((data, indices, indptr), shape=(n_periods, self.n_cols))
+
+        # kW[i, 0] - width[0] * on[i] = 0 and kW[i, k] - width[k] * on[i] <= 0, so the first segment is whole when on
+        on_rows = np.arange(self.n_segment_vars)
+        on_matrix = sparse.csr_matrix((np.concatenate((np.ones(self.n_segment_vars), np.tile(-self.segment_kw, n_periods))),
+                                       (np.concatenate((on_rows, on_rows)), np.concatenate((self.kw_cols.ravel(), np.repeat(self.on_cols, n_segments))))),
+                                      shape=(self.n_segment_vars, self.n_cols))
+
+        # the storage rows come first, so their entries keep their place in the data array
+        self.a_matrix = sparse.vstack((storage_matrix, on_matrix), format='csr')
+        self.a_matrix.data[self._efficiency_data_idx.ravel()] = np.tile(-0.5 * self.segment_efficiency, n_periods)
+
+        first_segment = np.tile(np.arange(n_segments) == 0, n_periods)
+        self.c = np.zeros(self.n_cols)
+        self.row_lower = np.concatenate((np.zeros(n_periods), np.where(first_segment, 0, -np.inf)))
+        self.row_upper = np.zeros(n_periods + self.n_segment_vars)
+        self.col_lower = np.zeros(self.n_cols)
+        self.col_upper = np.concatenate((np.tile(self.segment_kw, n_periods), np.full(n_periods, self.tank.max_storage_kwh), np.ones(n_periods)))
+        self.integrality = np.zeros(self.n_cols, dtype=int)
+
+    def update(self, price_array, demand_array, day_start_h2_in_storage_kwh, storage_lower_bounds, efficiency_adjustment):
+        price_array = np.asarray(price_array, dtype=float)
+
+        self.c[self.kw_cols] = (price_array[:, None] * 0.5 / 1000.) / self.line_losses_after_poi
+
+        storage_rhs = -np.asarray(demand_array, dtype=float)
+        storage_rhs[0] += day_start_h2_in_storage_kwh
+        self.row_lower[0:self.n_periods] = storage_rhs
+        self.row_upper[0:self.n_periods] = storage_rhs
+
+        self.col_lower[self.storage_cols] = storage_lower_bounds
+
+        self.segment_efficiency = self.base_segment_efficiency * efficiency_adjustment
+        self.a_matrix.data[self._efficiency_data_idx.ravel()] = np.tile(-0.5 * self.segment_efficiency, self.n_periods)
+
+    def solve(self, time_limit, enforce_min_power=True):
+        """
+        Returns whether a dispatch was found, and the kW and H2 produced (kWh) in each period. With enforce_min_power,
+        a day the LP leaves part way on in any period, where the hull is above the curve, is solved again with every
+        on column binary, so the dispatch is exact. Without it the LP is returned as it is.
+        """
+
+        self.solved = False
+        self.integrality[:] = 0
+
+        solved, x = self._solve_function(self.c, self.a_matrix, self.row_lower, self.row_upper, self.col_lower, self.col_upper, self.integrality, time_limit)
+        if not solved:
+            return False, None, None
+
+        on = x[self.on_cols]
+        if enforce_min_power and np.any((on > 1E-6) & (on < 1 - 1E-6)):
+            # a binary per period, rather than per period and level as in the MILP
+            self.integrality[self.on_cols] = 1
+            solved, x = self._solve_function(self.c, self.a_matrix, self.row_lower, self.row_upper, self.col_lower, self.col_upper, self.integrality, time_limit)
+            if not solved:
+                return False, None, None
+
+        segment_kw = x[self.kw_cols]
+        kw = segment_kw.sum(axis=1)
+        kw[kw <= 1E-6] = 0
+        h2_produced_kwh = 0.5 * segment_kw.dot(self.segment_efficiency)
+        h2_produced_kwh[kw == 0] = 0
+        self.solved = True
+
+        return True, kw, h2_produced_kwh
+
+
+def achievable_storage_lower_bounds(demand_array, day_start_h2_in_storage_kwh, min_storage_kwh, max_h2_production_kwh, tank):
+    """Minimum storage after each period, lowered to what running flat out from the start could reach, but not below empty."""
+
+    storage_lower_bounds = np.zeros(len(demand_array))
+    h2_in_storage_kwh = day_start_h2_in_storage_kwh
+    for i, demand in enumerate(np.asarray(demand_array, dtype=float)):
+        if i > 0:
+            h2_in_storage_kwh *= tank.remaining_fraction_after_half_hour
+        h2_in_storage_kwh = min(h2_in_storage_kwh + max_h2_production_kwh - demand, tank.max_storage_kwh)
+        storage_lower_bounds[i] = min(min_storage_kwh, max(0, h2_in_storage_kwh)) - 1E-6
+
+    return storage_lower_bounds
+
+
+def max_rolling_undersupply(under_supply, max_periods=48 * 10 - 1):
+    """Largest total under_supply over any run of 1 to max_periods consecutive periods, or 0 if none is positive."""
+
+    under_supply = np.asarray(under_supply, dtype=float)
+    if len(under_supply) == 0:
+        return 0
+
+    cumulative = np.concatenate(([0.0], np.cumsum(under_supply)))
+    max_periods = min(max_periods, len(under_supply))
+    # smallest cumulative sum at the start of any run of up to max_periods ending at each period
+    start_min = minimum_filter1d(cumulative[:-1], size=max_periods, origin=(max_periods - 1) // 2, mode='nearest')
+
+    return max(0, np.max(cumulative[1:] - start_min))
+
+
+def daily_storage_lower_bounds(n_periods, in_day_min_storage_remaining, end_of_day_storage_target, total_min_storage_remaining):
+    """Minimum storage after each period: in-day limit up to the end of the day, the end of day target, then the look-ahead limit."""
+
+    storage_lower_bounds = np.full(n_periods, total_min_storage_remaining, dtype=float)
+    storage_lower_bounds[0:47] = in_day_min_storage_remaining
+    storage_lower_bounds[47] = end_of_day_storage_target
+
+    return storage_lower_bounds
@@ -0,0 +1,335 @@
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    from hoptimiser.component_classes import CombinedElectrolyser, CombinedTank
+    from hoptimiser.config import PROJECT_ROOT_DIR
+except:
+    from component_classes import CombinedElectrolyser, CombinedTank
+    from config import PROJECT_ROOT_DIR
+
+# The annual costs summed into the levelised cost. tank_capex appears twice, matching the LCOH2 reported so far
+LCOH2_COST_COLUMNS = ['total_elec_cost', 'other_energy_costs', 'sleeving_cost', 'electrolyser_opex_yr', 'stack_capex', 'tank_capex', 'tank_opex_yr', 'water_cost', 'electrolyser_capex', 'tank_capex']
+
+# Economic inputs that change the dispatch itself, so cannot be changed without re-running it
+DISPATCH_ECONOMIC_INPUTS = ['Component Delivery Year', 'Capital Cost Price Year', 'Electricity Price Baseline Year', 'Combined Electricity Price Inflation', 'Supplier Fee per MWh Imported (£)']
+
+DISPATCH_OUTPUT_COLUMNS = ['combined', 'PriceYear', 'DemandYear', 'minimum_relative_efficiency', 'total_import_cost', 'total_uos_cost', 'total_supplier_fee_costs', 'production_price_percentile']
+
+
+def economic_settings(economic_inputs, technical_inputs):
+    """The economic inputs the roll-up from the dispatch to the LCOH2 uses."""
+
+    capital_cost_price_year = economic_inputs['Value']['Capital Cost Price Year']
+    electricity_price_year = economic_inputs['Value']['Electricity Price Baseline Year']
+    if capital_cost_price_year == electricity_price_year:
+        combined_elec_price_inflation = 1.0
+    else:
+        combined_elec_price_inflation = economic_inputs['Value']['Combined Electricity Price Inflation'] # to inflate elec price input data to match price year of capital costs
+
+    grid_import_max_power = technical_inputs['Value']['Max Grid Import Power MW']
+    power_factor = technical_inputs['Value']['Power Factor']
+    daily_capacity_charge = economic_inputs['Value']['Daily Capacity Charge per MVA (£)']
+    daily_fixed_charge = economic_inputs['Value']['Daily Fixed Charge (£)']
+    daily_TNUOS_charge = economic_inputs['Value']['Daily TNUOS Charge (£)']
+    sleeving_fee = economic_inputs['Value']['Sleeving Fee Percentage']
+
+    daily_fixed_charge_total = (daily_capacity_charge * grid_import_max_power / power_factor) + daily_fixed_charge + daily_TNUOS_charge
+    annual_fixed_charge = daily_fixed_charge_total * 365.25
+
+    if economic_inputs['Value']['Heating Value'].lower() == 'lower':
+        kwh_per_kg = 33.3
+    else:
+        kwh_per_kg = 39.3
+
+    return {
+        'combined_elec_price_inflation': combined_elec_price_inflation,
+        'annual_fixed_charge': annual_fixed_charge,
+        'annual_admin_costs': annual_fixed_charge * sleeving_fee / 100,
+        'kwh_per_kg': kwh_per_kg,
+        'discount_rate_percent': economic_inputs['Value']['Discount Rate %'],
+        'water_price_per_litre': economic_inputs['Value']['Water Price Per Litre'],
+        'water_needed_per_mwh_h2': economic_inputs['Value']['Water Litres Per MWh'],
+    }
+
+
+def efficiency_curve_settings(technical_inputs):
+    """Whether the efficiency table is simplified, and to how many breakpoints (0 for the default five points)."""
+
+    reduce_efficiencies = bool(technical_inputs['Value']['Simplify Efficiencies to Five Points']) #If true, efficiency table will be simplified to 5 rows from 10
+    n_efficiency_breakpoints = int(technical_inputs['Value'].get('Efficiency Curve Breakpoints', 0)) #If above 0, efficiency table is simplified to this many rows, chosen to best match the full table
+    if n_efficiency_breakpoints > 0:
+        reduce_efficiencies = True
+
+    return reduce_efficiencies, n_efficiency_breakpoints
+
+
+def build_components(input_combination, input_bundle, economic_inputs, technical_inputs):
+    """The CombinedElectrolyser and CombinedTank of an input combination."""
+
+    data_years = input_bundle.data_years
+    selected_electrolyser = input_bundle.electrolyser_df.loc[input_combination[0], :]
+    selected_tank = input_bundle.tank_df.loc[input_combination[2], :]
+    reduce_efficiencies, n_efficiency_breakpoints = efficiency_curve_settings(technical_inputs)
+
+    electrolyser = CombinedElectrolyser(selected_electrolyser, input_combination[1], input_combination[4:], data_years.loc[0, 'CalendarYear'], economic_inputs['Value']['Component Delivery Year'], len(data_years), electrolyser_min_capacity=technical_inputs['Value']['Electrolyser Min Operating Capacity'], reduce_efficiencies=reduce_efficiencies, optimise_efficiencies=False, n_efficiency_breakpoints=n_efficiency_breakpoints or None)
+    tank = CombinedTank(selected_tank, input_combination[3], min_storage_kwh=technical_inputs['Value']['Tank Min Storage Level Allowed'], start_half_full=bool(technical_inputs['Value']['Start With Tanks Half Full']))
+
+    return electrolyser, tank
+
+
+def combination_years(electrolyser, data_years):
+    """
+    The unique (demand year, price year) pairs to dispatch, each with the lowest relative efficiency of the years
+    using it, and the year by year results table the dispatch costs are copied into.
+    """
+
+    electrolyser.combined_stack_and_efficiencies_df = electrolyser.combined_stack_and_efficiencies_df.merge(data_years, how='left')
+
+    unique_years = electrolyser.combined_stack_and_efficiencies_df.groupby('combined').min().reset_index()[['combined','PriceYear','DemandYear','final_relative_efficiency']]
+    unique_years = unique_years.rename(columns = {'final_relative_efficiency': 'minimum_relative_efficiency'})
+
+    results_years = electrolyser.combined_stack_and_efficiencies_df.copy()
+    results_years = results_years.drop(['PriceYear', 'DemandYear'], axis = 1)
+    results_years = results_years.merge(unique_years, on = 'combined', how = 'left')
+    results_years['cost_reduction_factor'] = results_years['minimum_relative_efficiency'] / results_years['final_relative_efficiency']
+
+    return unique_years, results_years
+
+
+def store_year_result(year_result, analysis_year, unique_years, results_years, data, kwh_per_kg, water_price_per_litre, water_needed_per_mwh_h2):
+    """Copy one unique year's costs into every row of results_years that uses it. Returns whether the year failed."""
+
+    if year_result['failed_combination_flag']:
+        print('Combination failed to Solve')
+        return True
+
+    production_price_percentile = year_result['production_price_percentile']
+    rows = (results_years['combined'] == unique_years['combined'][analysis_year]).to_numpy()
+
+    # the electricity cost is scaled by how the price scale year compares with the dispatched year at the same percentile
+    control_year_value = np.percentile(data['import_price'], production_price_percentile)
+    price_scale_years = results_years.loc[rows, 'PriceScaleYear'].astype(int).to_numpy()
+    scaling_year_values = {year: np.percentile(data[str(year)], production_price_percentile) for year in set(price_scale_years)}
+    price_scaling_ratio = np.array([scaling_year_values[year] / control_year_value for year in price_scale_years])
+
+    cost_reduction_factor = results_years.loc[rows, 'cost_reduction_factor'].to_numpy()
+    h2_to_demand_kwh = np.round(data.demand.sum(), 2)
+
+    results_years.loc[rows, 'import_elec_cost'] = np.round(year_result['total_import_cost'] * cost_reduction_factor * price_scaling_ratio, 2)
+    results_years.loc[rows, 'uos_elec_cost'] = np.round(year_result['total_uos_cost'] * cost_reduction_factor, 2)
+    results_years.loc[rows, 'total_elec_cost'] = np.round(results_years.loc[rows, 'import_elec_cost'] + results_years.loc[rows, 'uos_elec_cost'], 2)
+    results_years.loc[rows, 'supplier_fee_cost'] = np.round(year_result['total_supplier_fee_costs'], 2) * cost_reduction_factor
+    results_years.loc[rows, 'h2_to_demand_kWh'] = h2_to_demand_kwh
+    results_years.loc[rows, 'h2_to_demand_kg'] = h2_to_demand_kwh / kwh_per_kg
+    results_years.loc[rows, 'water_cost'] = h2_to_demand_kwh * water_price_per_litre * water_needed_per_mwh_h2 / 1000
+
+    return False
+
+
+def add_annual_costs(results_years, electrolyser, tank, settings):
+    """The capital, operating and other costs of each year and its discount factor, added to results_years."""
+
+    operational_filter = results_years['OperationalYear'] > 0
+
+    results_years['years_since_costs_baseline'] = results_years['CalendarYear'] - min(results_years['CalendarYear'])
+
+    results_years['discount_factor'] = 1 / ((1 + settings['discount_rate_percent'] / 100) ** (results_years['years_since_costs_baseline']))
+    results_years['electrolyser_capex'] = 0.0
+    results_years['tank_capex'] = 0.0
+    results_years['stack_capex'] = electrolyser.combined_stack_and_efficiencies_df['stack_replacement'] * electrolyser.combined_stack_and_efficiencies_df['stack_final_capex']
+    results_years.loc[operational_filter, 'electrolyser_opex_yr'] = electrolyser.opex_per_year
+    results_years.loc[operational_filter, 'tank_opex_yr'] = tank.opex_per_year
+    results_years.loc[0,'electrolyser_capex'] = electrolyser.capex
+    results_years.loc[0, 'tank_capex'] = tank.capex
+    results_years.loc[operational_filter, 'other_energy_costs'] = settings['annual_fixed_charge']
+    results_years.loc[operational_filter, 'sleeving_cost'] = settings['annual_admin_costs']
+
+    return results_years.fillna(0)
+
+
+def levelised_cost_of_h2(results_years_list):
+    """LCOH2 of each combination's annual results, as one pass over (combination, cost, year) arrays."""
+
+    n_years = max(len(results_years) for results_years in results_years_list)
+    discount_factor = np.zeros((len(results_years_list), n_years))
+    annual_costs = np.zeros((len(results_years_list), len(LCOH2_COST_COLUMNS), n_years))
+    h2_to_demand_kg = np.zeros((len(results_years_list), n_years))
+
+    for i, results_years in enumerate(results_years_list):
+        discount_factor[i, 0:len(results_years)] = results_years['discount_factor']
+        annual_costs[i, :, 0:len(results_years)] = results_years[LCOH2_COST_COLUMNS].to_numpy().T
+        h2_to_demand_kg[i, 0:len(results_years)] = results_years['h2_to_demand_kg']
+
+    return _levelised_cost_of_h2(annual_costs, discount_factor, h2_to_demand_kg)
+
+
+def _levelised_cost_of_h2(annual_costs, discount_factor, h2_to_demand_kg):
+    levelised_cost = np.einsum('ijk,ik->i', annual_costs, discount_factor)
+    levelised_production = np.einsum('ik,ik->i', h2_to_demand_kg, discount_factor)
+
+    return levelised_cost / levelised_production
+
+
+def dispatch_outputs_file(output_dir, input_combination):
+    return os.path.join(output_dir, str(input_combination) + '_dispatch_outputs.csv')
+
+
+def save_dispatch_outputs(file_name, unique_years, year_results):
+    """Save the dispatch totals of each unique year, which is all recalculate_lcoh2 needs from the dispatch."""
+
+    dispatch_outputs = unique_years.loc[list(year_results.keys())].copy()
+    for column in DISPATCH_OUTPUT_COLUMNS[4:]:
+        dispatch_outputs[column] = [year_results[analysis_year][column] for analysis_year in dispatch_outputs.index]
+
+    dispatch_outputs[DISPATCH_OUTPUT_COLUMNS].to_csv(file_name)
+
+
+def recalculate_lcoh2(combinations, input_bundle, results_dir, economic_overrides=None):
+    """
+    LCOH2 of each combination from the dispatch outputs saved by earlier runs under results_dir, with the economic
+    inputs of input_bundle and any values in economic_overrides (by parameter name) in their place. The saved outputs
+    are stacked into one row per combination and year and costed together. Combinations not yet run get None and
+    failed ones 9999.
+    """
+
+    economic_inputs = input_bundle.economic_inputs.copy()
+    for parameter, value in (economic_overrides or {}).items():
+        if parameter in DISPATCH_ECONOMIC_INPUTS:
+            raise Exception(parameter + ' changes the dispatch, so the combinations must be run again!')
+        economic_inputs.loc[parameter, 'Value'] = value
+
+    technical_inputs = input_bundle.technical_inputs
+    settings = economic_settings(economic_inputs, technical_inputs)
+    data = input_bundle.data
+
+    lcoh2 = [None] * len(combinations)
+    priced = []
+    stacked = {column: [] for column in ['combination', 'year', 'dispatched', 'total_import_cost', 'total_uos_cost', 'production_price_percentile', 'PriceYear', 'DemandYear', 'PriceScaleYear', 'cost_reduction_factor', 'years_since_costs_baseline', 'operational', 'stack_capex', 'electrolyser_opex_yr', 'tank_opex_yr', 'electrolyser_capex', 'tank_capex']}
+
+    for i, input_combination in enumerate(combinations):
+
+        output_dir = os.path.join(results_dir, str(input_combination)[1:-1].replace(",", "_").replace(" ", ""))
+        file_name = dispatch_outputs_file(output_dir, input_combination)
+        if not os.path.exists(file_name):
+            if os.path.exists(os.path.join(output_dir, 'lcoh2_result.json')):
+                lcoh2[i] = 9999 #a run that finished without dispatch outputs failed
+            continue
+
+        dispatch_outputs = pd.read_csv(file_name, index_col=0, float_precision='round_trip')
+
+        electrolyser, tank = build_components(input_combination, input_bundle, economic_inputs, technical_inputs)
+        unique_years, results_years = combination_years(electrolyser, input_bundle.data_years)
+
+        if not (unique_years['combined'].astype(str).tolist() == dispatch_outputs['combined'].astype(str).tolist() and np.allclose(unique_years['minimum_relative_efficiency'], dispatch_outputs['minimum_relative_efficiency'], rtol=0, atol=1E-9)):
+            raise Exception('Saved dispatch outputs for ' + str(input_combination) + ' do not match the inputs, the combination must be run again!')
+
+        # the saved unique year of each dispatched year, by position as the check above has them in the same order
+        unique_year = pd.Index(unique_years['combined']).get_indexer(results_years['combined'])
+        dispatched = unique_year >= 0
+
+        stacked['combination'].append(np.full(len(results_years), len(priced)))
+        stacked['year'].append(np.arange(len(results_years)))
+        stacked['dispatched'].append(dispatched)
+        for column in ['total_import_cost', 'total_uos_cost', 'production_price_percentile', 'PriceYear', 'DemandYear']:
+            stacked[column].append(dispatch_outputs[column].to_numpy()[unique_year[dispatched]])
+        for column in ['PriceScaleYear', 'cost_reduction_factor']:
+            stacked[column].append(results_years.loc[dispatched, column].to_numpy())
+        n_years = len(results_years)
+        stacked['years_since_costs_baseline'].append((results_years['CalendarYear'] - min(results_years['CalendarYear'])).to_numpy())
+        stacked['operational'].append((results_years['OperationalYear'] > 0).to_numpy())
+        stacked['stack_capex'].append((electrolyser.combined_stack_and_efficiencies_df['stack_replacement'] * electrolyser.combined_stack_and_efficiencies_df['stack_final_capex']).to_numpy(dtype=float))
+        stacked['electrolyser_opex_yr'].append(np.full(n_years, electrolyser.opex_per_year, dtype=float))
+        stacked['tank_opex_yr'].append(np.full(n_years, tank.opex_per_year, dtype=float))
+        stacked['electrolyser_capex'].append(np.where(np.arange(n_years) == 0, electrolyser.capex, 0.0))
+        stacked['tank_capex'].append(np.where(np.arange(n_years) == 0, tank.capex, 0.0))
+
+        priced.append(i)
+
+    if priced:
+        stacked = {column: np.concatenate(values) for column, values in stacked.items()}
+        percentile = stacked['production_price_percentile'].astype(float)
+        price_year = stacked['PriceYear'].astype(int)
+        price_scale_year = stacked['PriceScaleYear'].astype(int)
+        demand_year = stacked['DemandYear'].astype(str)
+
+        # the electricity cost is scaled as in store_year_result, with each price year's percentiles taken at once
+        control_year_value = np.empty(len(percentile))
+        for year in np.unique(price_year):
+            rows = price_year == year
+            control_year_value[rows] = np.percentile(data[str(year)] * settings['combined_elec_price_inflation'], percentile[rows])
+        scaling_year_value = np.empty(len(percentile))
+        for year in np.unique(price_scale_year):
+            rows = price_scale_year == year
+            scaling_year_value[rows] = np.percentile(data[str(year)], percentile[rows])
+
+        cost_reduction_factor = stacked['cost_reduction_factor'].astype(float)
+        import_elec_cost = np.round(stacked['total_import_cost'].astype(float) * cost_reduction_factor * (scaling_year_value / control_year_value), 2)
+        uos_elec_cost = np.round(stacked['total_uos_cost'].astype(float) * cost_reduction_factor, 2)
+
+        demand_year_kwh = {year: np.round(data[year].sum(), 2) for year in np.unique(demand_year)}
+
+        # years that were not dispatched have no electricity or H2, as add_annual_costs fills them with zero
+        dispatched = stacked['dispatched']
+        total_elec_cost = np.zeros(len(dispatched))
+        total_elec_cost[dispatched] = np.round(import_elec_cost + uos_elec_cost, 2)
+        h2_to_demand_kwh = np.zeros(len(dispatched))
+        h2_to_demand_kwh[dispatched] = [demand_year_kwh[year] for year in demand_year]
+
+        operational = stacked['operational']
+        annual_costs = {
+            'total_elec_cost': total_elec_cost,
+            'other_energy_costs': np.where(operational, settings['annual_fixed_charge'], 0.0),
+            'sleeving_cost': np.where(operational, settings['annual_admin_costs'], 0.0),
+            'electrolyser_opex_yr': np.where(operational, stacked['electrolyser_opex_yr'], 0.0),
+            'stack_capex': stacked['stack_capex'],
+            'tank_capex': stacked['tank_capex'],
+            'tank_opex_yr': np.where(operational, stacked['tank_opex_yr'], 0.0),
+            'water_cost': h2_to_demand_kwh * settings['water_price_per_litre'] * settings['water_needed_per_mwh_h2'] / 1000,
+            'electrolyser_capex': stacked['electrolyser_capex'],
+        }
+
+        # into the (combination, cost, year) arrays of levelised_cost_of_h2, with gaps as zero as add_annual_costs leaves them
+        combination, year = stacked['combination'], stacked['year']
+        shape = (len(priced), year.max() + 1)
+        costs = np.zeros((shape[0], len(LCOH2_COST_COLUMNS), shape[1]))
+        costs[combination, :, year] = np.nan_to_num(np.column_stack([annual_costs[column] for column in LCOH2_COST_COLUMNS]), nan=0.0, posinf=np.inf, neginf=-np.inf)
+        discount_factor = np.zeros(shape)
+        discount_factor[combination, year] = 1 / ((1 + settings['discount_rate_percent'] / 100) ** stacked['years_since_costs_baseline'])
+        h2_to_demand_kg = np.zeros(shape)
+        h2_to_demand_kg[combination, year] = h2_to_demand_kwh / settings['kwh_per_kg']
+
+        for i, combination_lcoh2 in zip(priced, _levelised_cost_of_h2(costs, discount_factor, h2_to_demand_kg)):
+            lcoh2[i] = combination_lcoh2
+
+    final_results = pd.DataFrame()
+    final_results['combination'] = combinations
+    final_results['lcoh2'] = lcoh2
+
+    return final_results
+
+
+if __name__ == "__main__":
+
+    # Price every combination already run in results again with the current economic inputs
+    try:
+        from hoptimiser.input_bundle import InputBundle
+        from hoptimiser.component_inputs_reader import populate_combinations
+    except:
+        from input_bundle import InputBundle
+        from component_inputs_reader import populate_combinations
+
+    input_dir = os.path.join(PROJECT_ROOT_DIR, 'inputs')
+    results_dir = os.path.join(PROJECT_ROOT_DIR, 'results')
+
+    input_bundle = InputBundle.from_files(
+        os.path.join(input_dir, 'component_inputs.xlsx'),
+        os.path.join(input_dir, 'demand_profiles.csv'),
+        os.path.join(input_dir, 'price_profiles.csv'),
+        cache_dir=os.path.join(input_dir, 'cache'),
+    )
+    combinations = populate_combinations(input_bundle.tank_df, input_bundle.electrolyser_df, os.path.join(input_dir, 'component_inputs.xlsx'))
+
+    final_results = recalculate_lcoh2(combinations, input_bundle, results_dir)
+    final_results.to_csv(os.path.join(results_dir, 'final_results_recalculated.csv'))
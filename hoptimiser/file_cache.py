@@ -0,0 +1,67 @@
+import os
+import json
+import shutil
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+
+
+def files_hash(file_names, version):
+    """Hash of the contents of the files and a format version, used as a cache key."""
+
+    file_hash = hashlib.sha256(str(version).encode())
+    for file_name in file_names:
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def save_columns(df, directory):
+    """
+    Save a DataFrame as one .npy file per column, which unlike a pickle loads with any pandas version. Columns of
+    datetime.date are stored as datetime64[D] and other object columns as strings.
+    """
+
+    temp_directory = directory + '.' + str(os.getpid()) + '.tmp'
+    os.makedirs(temp_directory, exist_ok=True)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        values = df[name].to_numpy()
+        kind = 'array'
+        if values.dtype == object:
+            if len(values) and all(type(v) is datetime.date for v in values):
+                values = values.astype('datetime64[D]')
+                kind = 'date'
+            else:
+                values = values.astype(str)
+        np.save(os.path.join(temp_directory, 'column_' + str(i) + '.npy'), values, allow_pickle=False)
+        columns.append([name, kind])
+
+    with open(os.path.join(temp_directory, 'columns.json'), 'w', encoding='utf-8') as f:
+        json.dump(columns, f)
+
+    # move into place in one step, so processes starting together never see a half written cache
+    try:
+        os.replace(temp_directory, directory)
+    except OSError:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+
+def load_columns(directory):
+    """Load a DataFrame saved by save_columns."""
+
+    with open(os.path.join(directory, 'columns.json'), encoding='utf-8') as f:
+        columns = json.load(f)
+
+    data = {}
+    for i, (name, kind) in enumerate(columns):
+        values = np.load(os.path.join(directory, 'column_' + str(i) + '.npy'), allow_pickle=False)
+        if kind == 'date':
+            values = values.astype(object)
+        data[name] = values
+
+    return pd.DataFrame(data)
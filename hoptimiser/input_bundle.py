@@ -0,0 +1,79 @@
+import os
+import pickle
+import pandas as pd
+
+try:
+    from hoptimiser.component_inputs_reader import read_component_data
+    from hoptimiser.read_time_series_data import read_ts_data
+    from hoptimiser.file_cache import files_hash
+except:
+    from component_inputs_reader import read_component_data
+    from read_time_series_data import read_ts_data
+    from file_cache import files_hash
+
+# Bump when the parsed layout changes, so old cache files are not picked up
+INPUT_BUNDLE_CACHE_VERSION = 1
+
+
+class InputBundle:
+    """
+    Everything a run reads from component_inputs.xlsx, demand_profiles.csv and price_profiles.csv, parsed once so a
+    sweep does not re-read the workbook for every combination. Analysis takes a copy of the time series, so one
+    bundle can be shared by many runs.
+    """
+
+    def __init__(self, tank_df, electrolyser_df, data_years, economic_inputs, technical_inputs, data, files_hash=None):
+        self.tank_df = tank_df
+        self.electrolyser_df = electrolyser_df
+        self.data_years = data_years
+        self.economic_inputs = economic_inputs
+        self.technical_inputs = technical_inputs
+        self.data = data
+        self.files_hash = files_hash
+
+    @classmethod
+    def from_files(cls, input_file_name_components, input_demand_profiles, input_price_profiles, cache_dir=None):
+        """Parse the input files, or load them from cache_dir if they have been parsed before with the same contents."""
+
+        input_files_hash = files_hash([input_file_name_components, input_demand_profiles, input_price_profiles], INPUT_BUNDLE_CACHE_VERSION)
+
+        if cache_dir is not None:
+            cache_file = os.path.join(cache_dir, 'input_bundle_' + input_files_hash + '.pkl')
+            if os.path.exists(cache_file):
+                try:
+                    return cls.load(cache_file)
+                except Exception:
+                    print('Could not load the cached inputs from ' + cache_file + ', reading the input files instead')
+
+        tank_df, electrolyser_df, data_years = read_component_data(input_file_name_components)
+
+        economic_inputs = pd.read_excel(input_file_name_components, sheet_name='Economic Inputs')
+        economic_inputs.set_index('Parameter', inplace=True)
+
+        technical_inputs = pd.read_excel(input_file_name_components, sheet_name='Technical Inputs')
+        technical_inputs.set_index('Parameter', inplace=True)
+
+        data = read_ts_data(input_demand_profiles, input_price_profiles, input_file_name_components, cache_dir=cache_dir)
+
+        input_bundle = cls(tank_df, electrolyser_df, data_years, economic_inputs, technical_inputs, data, input_files_hash)
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            input_bundle.save(cache_file)
+
+        return input_bundle
+
+    def save(self, file_name):
+        # write then rename, so workers started together never read a half written file
+        temp_file_name = file_name + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_file_name, 'wb') as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, 'rb') as f:
+            input_bundle = cls.__new__(cls)
+            input_bundle.__dict__.update(pickle.load(f))
+
+        return input_bundle
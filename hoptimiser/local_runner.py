@@ -1,7 +1,259 @@
-from hoptimiser.variable_price_orchestrator import Analysis
-from hoptimiser.component_inputs_reader import read_component_data, populate_combinations
 import os
-from hoptimiser.config import PROJECT_ROOT_DIR
+import sys
+import json
+import time
+import datetime
+import traceback
+import contextlib
+import multiprocessing
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    from hoptimiser.variable_price_orchestrator import Analysis
+    from hoptimiser.component_inputs_reader import read_component_data, populate_combinations
+    from hoptimiser.solvers import set_solver_threads
+    from hoptimiser.input_bundle import InputBundle
+    from hoptimiser.screening import screen_combinations
+    from hoptimiser.sweep_pruning import SweepScheduler, lcoh2_lower_bounds
+    from hoptimiser.surrogate import SurrogateSearch, combination_features
+    from hoptimiser.multi_fidelity import full_fidelity_selection, validation_sample, fidelity_rank_correlation
+    from hoptimiser.config import PROJECT_ROOT_DIR
+except:
+    from variable_price_orchestrator import Analysis
+    from component_inputs_reader import read_component_data, populate_combinations
+    from solvers import set_solver_threads
+    from input_bundle import InputBundle
+    from screening import screen_combinations
+    from sweep_pruning import SweepScheduler, lcoh2_lower_bounds
+    from surrogate import SurrogateSearch, combination_features
+    from multi_fidelity import full_fidelity_selection, validation_sample, fidelity_rank_correlation
+    from config import PROJECT_ROOT_DIR
+
+
+# inputs parsed once in the parent and handed to each worker when it starts
+_worker_input_bundle = None
+
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+
+@contextlib.contextmanager
+def _thread_limits(n_threads):
+    """Limit the numerical libraries of processes started inside to n_threads, as they only read these when loaded."""
+
+    previous = {variable: os.environ.get(variable) for variable in THREAD_VARIABLES}
+    os.environ.update({variable: str(n_threads) for variable in THREAD_VARIABLES})
+    try:
+        yield
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+
+def _init_worker(solver_threads, input_bundle):
+    global _worker_input_bundle
+    _worker_input_bundle = input_bundle
+
+    set_solver_threads(solver_threads)
+
+
+def _run_combination(combination, log_file, representative_days=None, results_dir=None):
+    """Run one combination with its printout sent to log_file, as on Azure Batch. Returns the LCOH2, or None if it raised."""
+
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    with open(log_file, 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            return Analysis(input_combination=str(combination), run_in_azure=False, input_bundle=_worker_input_bundle, representative_days=representative_days, results_dir=results_dir).run()
+        except Exception:
+            traceback.print_exc(file=log)
+            return None
+
+
+class HoptimiserLocalRunner:
+    """
+    Run a sweep of combinations in parallel processes on this machine. Each combination's outputs and log are written
+    to results/<combination> as for a single run, and a combination already holding an lcoh2_result.json is not run
+    again when resume is set, so a stopped sweep can be restarted. With screen set, combinations that would fail before
+    any LP is solved are given the failed LCOH2 of 9999 without being run. With prune set, the combinations are run in
+    the order of SweepScheduler, and those its bounds rule out of the n_best (by default the 'Number of Batch Setups to
+    Download') are skipped, so have no LCOH2 in the final results but the lower bound that ruled them out. With
+    line_heuristic also set, SweepScheduler skips more on bounds that are not guaranteed. With surrogate set instead,
+    the combinations are picked by SurrogateSearch until it stops or max_evaluations have been run. Either way the
+    n_best found are kept in best_results, with the search_mode that found them.
+
+    With representative_days above 0 and full_fidelity_fraction below 1 (by default the 'Representative Days' and
+    'Full Fidelity Fraction' inputs), every combination is first run on that many representative days a year, with
+    the outputs under results/low_fidelity, and only the best full_fidelity_fraction of them are then run in full,
+    with n_validation of the rest picked at random (by default the 'Fidelity Validation Combinations' input). The
+    rank correlation between the two fidelities over those is kept in rank_correlation.
+    """
+
+    def __init__(self, combinations: list, n_workers: int = None, solver_threads: int = 1, resume: bool = True, screen: bool = True, prune: bool = False, line_heuristic: bool = False, n_best: int = None, surrogate: bool = False, max_evaluations: int = None, representative_days: int = None, full_fidelity_fraction: float = None, n_validation: int = None):
+        self.combinations = combinations
+        self.n_workers = n_workers or os.cpu_count()
+        self.solver_threads = solver_threads
+        self.resume = resume
+        self.screen = screen
+        self.prune = prune
+        self.line_heuristic = line_heuristic
+        self.n_best = n_best
+        self.surrogate = surrogate
+        self.max_evaluations = max_evaluations
+        self.representative_days = representative_days
+        self.full_fidelity_fraction = full_fidelity_fraction
+        self.n_validation = n_validation
+        self.best_results = None
+        self.rank_correlation = None
+
+        self.input_dir = os.path.join(PROJECT_ROOT_DIR, 'inputs')
+        self.results_dir = os.path.join(PROJECT_ROOT_DIR, 'results')
+
+    def _output_dir(self, combination, results_dir=None) -> str:
+        return os.path.join(results_dir or self.results_dir, str(combination)[1:-1].replace(",", "_").replace(" ", ""))
+
+    def _previous_result(self, combination, results_dir=None):
+        result_file = os.path.join(self._output_dir(combination, results_dir), 'lcoh2_result.json')
+        if not os.path.exists(result_file):
+            return None
+
+        with open(result_file, encoding='utf-8') as f:
+            return json.load(f)['lcoh2']
+
+    def run(self) -> pd.DataFrame:
+
+        lcoh2 = [None] * len(self.combinations)
+        to_run = []
+        for i, combination in enumerate(self.combinations):
+            if self.resume:
+                lcoh2[i] = self._previous_result(combination)
+            if lcoh2[i] is None:
+                to_run.append(i)
+
+        print('Number of combinations = ', len(self.combinations))
+        print('Already complete = ', len(self.combinations) - len(to_run))
+
+        input_bundle = InputBundle.from_files(
+            os.path.join(self.input_dir, 'component_inputs.xlsx'),
+            os.path.join(self.input_dir, 'demand_profiles.csv'),
+            os.path.join(self.input_dir, 'price_profiles.csv'),
+            cache_dir=os.path.join(self.input_dir, 'cache'),
+        )
+
+        if self.screen and to_run:
+            feasible = screen_combinations([self.combinations[i] for i in to_run], input_bundle)
+            for i in [i for i, ok in zip(to_run, feasible) if not ok]:
+                lcoh2[i] = 9999
+            to_run = [i for i, ok in zip(to_run, feasible) if ok]
+
+        technical_inputs = input_bundle.technical_inputs
+        representative_days = self.representative_days if self.representative_days is not None else int(technical_inputs['Value'].get('Representative Days', 0))
+        full_fidelity_fraction = self.full_fidelity_fraction if self.full_fidelity_fraction is not None else float(technical_inputs['Value'].get('Full Fidelity Fraction', 1))
+        n_validation = self.n_validation if self.n_validation is not None else int(technical_inputs['Value'].get('Fidelity Validation Combinations', 10))
+
+        low_fidelity_lcoh2 = None
+        checked = None
+        if representative_days > 0 and full_fidelity_fraction < 1:
+            # every combination worth running gets a quick estimate, and only the best of those are run in full
+            low_fidelity_dir = os.path.join(self.results_dir, 'low_fidelity')
+            low_fidelity_lcoh2 = [9999 if result == 9999 else None for result in lcoh2]
+            low_fidelity_to_run = []
+            for i in range(len(self.combinations)):
+                if self.resume and low_fidelity_lcoh2[i] is None:
+                    low_fidelity_lcoh2[i] = self._previous_result(self.combinations[i], low_fidelity_dir)
+                if low_fidelity_lcoh2[i] is None and i in to_run:
+                    low_fidelity_to_run.append(i)
+
+            print('Running ' + str(len(low_fidelity_to_run)) + ' combinations on ' + str(representative_days) + ' representative days a year...')
+            self._run_scheduled(SweepScheduler(self.combinations, low_fidelity_to_run, low_fidelity_lcoh2, prune=False), low_fidelity_lcoh2, input_bundle, representative_days, low_fidelity_dir)
+
+            selected = set(full_fidelity_selection(low_fidelity_lcoh2, full_fidelity_fraction))
+            print('Combinations in the best ' + str(full_fidelity_fraction) + ' to run in full = ', len(selected))
+
+            # a random few of the rest are run in full regardless, so the rank correlation covers more than the best
+            validation = validation_sample(low_fidelity_lcoh2, selected, n_validation)
+            print('Combinations not selected run in full to check the ranking = ', len(validation))
+            self._run_scheduled(SweepScheduler(self.combinations, [i for i in validation if i in to_run], lcoh2, prune=False), lcoh2, input_bundle, 0)
+
+            checked = selected | set(validation)
+            to_run = [i for i in to_run if i in selected]
+            representative_days = 0
+
+        n_best = self.n_best or int(technical_inputs['Value']['Number of Batch Setups to Download'])
+        if self.surrogate:
+            scheduler = SurrogateSearch(self.combinations, to_run, lcoh2, *lcoh2_lower_bounds(self.combinations, input_bundle), combination_features(self.combinations, input_bundle), n_best=n_best, max_evaluations=self.max_evaluations, n_initial=max(10, self.n_workers))
+        elif self.prune:
+            scheduler = SweepScheduler(self.combinations, to_run, lcoh2, *lcoh2_lower_bounds(self.combinations, input_bundle), n_best=n_best, line_heuristic=self.line_heuristic)
+        else:
+            scheduler = SweepScheduler(self.combinations, to_run, lcoh2, prune=False)
+
+        print('Running up to ' + str(len(to_run)) + ' combinations on ' + str(self.n_workers) + ' workers with ' + str(self.solver_threads) + ' solver threads each...')
+
+        self._run_scheduled(scheduler, lcoh2, input_bundle, representative_days)
+
+        for i in scheduler.failed:
+            lcoh2[i] = 9999
+
+        if self.prune or self.surrogate:
+            print('Combinations skipped as unable to make the best ' + str(n_best) + ' = ', len(scheduler.pruned), ', failed as a larger one did = ', len(scheduler.failed))
+
+        final_results = pd.DataFrame()
+        final_results['combination'] = self.combinations
+        final_results['lcoh2'] = lcoh2
+        if self.prune or self.surrogate:
+            pruned = set(scheduler.pruned)
+            final_results['lcoh2_lower_bound'] = [scheduler.lower_bound(i) if i in pruned else None for i in range(len(self.combinations))]
+
+            self.best_results = final_results.loc[scheduler.best_combinations(), ['combination', 'lcoh2']]
+            # whether the n_best are the best of the sweep (lower bound) or may not be (line heuristic, surrogate)
+            self.best_results['search_mode'] = 'surrogate' if self.surrogate else 'line heuristic' if self.line_heuristic else 'lower bound'
+            self.best_results.to_csv(os.path.join(self.results_dir, 'best_results.csv'))
+
+        if low_fidelity_lcoh2 is not None:
+            final_results['lcoh2_low_fidelity'] = low_fidelity_lcoh2
+            self.rank_correlation = fidelity_rank_correlation(low_fidelity_lcoh2, [result if i in checked else None for i, result in enumerate(lcoh2)])
+            print('Rank correlation between the low and full fidelity LCOH2 = ', self.rank_correlation)
+
+        final_results.to_csv(os.path.join(self.results_dir, 'final_results.csv'))
+
+        return final_results
+
+    def _run_scheduled(self, scheduler, lcoh2, input_bundle, representative_days=None, results_dir=None):
+        """Run the combinations scheduler gives out across the workers, filling in lcoh2 as they finish."""
+
+        start_time = time.time()
+        n_complete = 0
+
+        # workers are spawned rather than forked, so they load numpy and the like afresh under the thread limits
+        with _thread_limits(self.solver_threads), ProcessPoolExecutor(max_workers=self.n_workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker, initargs=(self.solver_threads, input_bundle)) as executor:
+            futures = {}
+            while True:
+                # keep every worker busy with the next combination still worth running
+                while len(futures) < self.n_workers:
+                    i = scheduler.next_combination()
+                    if i is None:
+                        break
+                    futures[executor.submit(_run_combination, self.combinations[i], os.path.join(self._output_dir(self.combinations[i], results_dir), 'log.txt'), representative_days, results_dir)] = i
+
+                if not futures:
+                    break
+
+                for future in wait(futures, return_when=FIRST_COMPLETED)[0]:
+                    i = futures.pop(future)
+                    lcoh2[i] = future.result()
+                    scheduler.record(i, lcoh2[i])
+                    n_complete += 1
+
+                    elapsed = time.time() - start_time
+                    eta = elapsed / n_complete * (len(futures) + scheduler.n_remaining())
+                    if lcoh2[i] is None:
+                        print('Combination ' + str(self.combinations[i]) + ' raised an error, see its log.txt')
+                    print(str(n_complete) + ' complete, at most ' + str(len(futures) + scheduler.n_remaining()) + ' to go, elapsed ' + str(datetime.timedelta(seconds=round(elapsed))) + ', ETA ' + str(datetime.timedelta(seconds=round(eta))))
+                    sys.stdout.flush()
 
 
 if __name__ == "__main__":
@@ -11,10 +263,11 @@ if __name__ == "__main__":
     tank_df, electrolyser_df, data_years = read_component_data(os.path.join(PROJECT_ROOT_DIR, 'inputs', input_file_name_components))
     combinations = populate_combinations(tank_df, electrolyser_df, os.path.join(PROJECT_ROOT_DIR, 'inputs', input_file_name_components))
 
-    for combination in combinations:
-        analysis = Analysis(
-            input_combination=str(combination), run_in_azure=False
-        )
-
-        analysis.run()
+    local_runner = HoptimiserLocalRunner(
+        combinations=combinations,
+        n_workers=os.cpu_count(),
+        solver_threads=1,
+        resume=True,
+    )
 
+    local_runner.run()
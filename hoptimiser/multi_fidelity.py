@@ -0,0 +1,96 @@
+import math
+import numpy as np
+from scipy.stats import spearmanr
+
+
+def _kmeans(points, n_clusters, n_iterations=100, seed=0):
+    """Cluster label of each point, by k-means from a k-means++ start. The seed is fixed so the days picked repeat."""
+
+    rng = np.random.default_rng(seed)
+
+    centres = [points[rng.integers(len(points))]]
+    for k in range(1, n_clusters):
+        distance = np.min(np.sum((points[:, None, :] - np.array(centres)[None, :, :]) ** 2, axis=2), axis=1)
+        if distance.sum() == 0:
+            break
+        centres.append(points[rng.choice(len(points), p=distance / distance.sum())])
+    centres = np.array(centres)
+
+    labels = None
+    for iteration in range(n_iterations):
+        new_labels = np.argmin(np.sum((points[:, None, :] - centres[None, :, :]) ** 2, axis=2), axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        centres = np.array([points[labels == k].mean(axis=0) if np.any(labels == k) else centres[k] for k in range(len(centres))])
+
+    return labels, centres
+
+
+def representative_days(data, n_days):
+    """
+    The days standing in for the year, as (day index, weight) in date order: the day nearest the centre of each
+    k-means cluster of the days' import price and demand, weighted by the days in its cluster.
+    """
+
+    n_year_days = len(data) // 48
+    price = data['import_price'].to_numpy(dtype=float)[0:48 * n_year_days].reshape(n_year_days, 48)
+    demand = data['demand'].to_numpy(dtype=float)[0:48 * n_year_days].reshape(n_year_days, 48)
+    points = np.hstack((price / (price.std() or 1.), demand / (demand.std() or 1.)))
+
+    labels, centres = _kmeans(points, n_days)
+
+    days = []
+    for k in range(len(centres)):
+        members = np.flatnonzero(labels == k)
+        if len(members):
+            nearest = members[np.argmin(np.sum((points[members] - centres[k]) ** 2, axis=1))]
+            days.append((int(nearest), len(members)))
+
+    return sorted(days)
+
+
+def representative_day_data(data, n_days):
+    """The periods of data on its representative days and their weights, or data as it is and None for a full year."""
+
+    n_year_days = len(data) // 48
+    if n_days <= 0 or n_days >= n_year_days:
+        return data, None
+
+    days = representative_days(data, n_days)
+    rows = np.concatenate([np.arange(48 * day, 48 * (day + 1)) for day, weight in days])
+    period_weights = np.repeat([float(weight) for day, weight in days], 48)
+
+    return data.iloc[rows].reset_index(drop=True), period_weights
+
+
+def full_fidelity_selection(lcoh2, fraction):
+    """The indices of the lowest fraction (at least one) of the successful low fidelity LCOH2s, best first."""
+
+    successful = [i for i, result in enumerate(lcoh2) if result is not None and result < 9999]
+    n_selected = min(len(successful), max(1, math.ceil(fraction * len(successful))))
+
+    return sorted(successful, key=lambda i: lcoh2[i])[0:n_selected]
+
+
+def validation_sample(lcoh2, selected, n_sample, seed=0):
+    """
+    A random n_sample of the successful low fidelity LCOH2s not selected, to run in full as well so the rank
+    correlation is not taken over the best alone. The seed is fixed so a resumed run picks the same ones.
+    """
+
+    not_selected = [i for i, result in enumerate(lcoh2) if result is not None and result < 9999 and i not in selected]
+    if n_sample <= 0 or not not_selected:
+        return []
+
+    return sorted(np.random.default_rng(seed).choice(not_selected, size=min(n_sample, len(not_selected)), replace=False).tolist())
+
+
+def fidelity_rank_correlation(low_fidelity_lcoh2, full_fidelity_lcoh2):
+    """Spearman rank correlation between the two fidelities over the combinations both ran successfully."""
+
+    pairs = [(low, full) for low, full in zip(low_fidelity_lcoh2, full_fidelity_lcoh2) if low is not None and full is not None and low < 9999 and full < 9999]
+    if len(pairs) < 3:
+        return np.nan
+
+    return spearmanr([low for low, full in pairs], [full for low, full in pairs])[0]
@@ -1,32 +1,94 @@
+import os
+import datetime
 import pandas as pd
 import numpy as np
 
-def read_ts_data(input_demand_profiles, input_price_profiles, input_file_name_components):
+try:
+    from hoptimiser.file_cache import files_hash, save_columns, load_columns
+except:
+    from file_cache import files_hash, save_columns, load_columns
+
+# Bump when the merged layout changes, so old cache files are not picked up
+TS_CACHE_VERSION = 2
+
+
+def read_ts_data(input_demand_profiles, input_price_profiles, input_file_name_components, cache_dir=None):
+
+    # With cache_dir, the merged data is kept there per column, keyed on the input file contents
+    if cache_dir is not None:
+        cache_directory = os.path.join(cache_dir, 'ts_data_' + files_hash([input_demand_profiles, input_price_profiles, input_file_name_components], TS_CACHE_VERSION))
+        if os.path.exists(cache_directory):
+            return load_columns(cache_directory)
+
+    data = _merge_ts_data(input_demand_profiles, input_price_profiles, input_file_name_components)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_columns(data, cache_directory)
+
+    return data
+
+
+def set_year_data(data, demand_year, price_year, combined_elec_price_inflation):
+
+    data['demand'] = data[demand_year]
+    data['import_price'] = data[str(price_year)] * combined_elec_price_inflation
+    data['combined_price'] = data['import_price'] + data['uos_charge']
+
+
+def use_of_system_array(use_of_system_table):
+    """
+    The use of system charge table (a row per month and weekday, a column per half hour) as a dense array indexed by
+    [month - 1, weekday, half hour], and a matching array of which entries the table has.
+    """
+
+    use_of_system = np.zeros((12, 7, 48))
+    in_table = np.zeros((12, 7, 48), dtype=bool)
+
+    if use_of_system_table.duplicated(['month', 'weekday']).any():
+        raise Exception('UseOfSystemTotal has more than one row for the same month and weekday!')
+
+    months = use_of_system_table['month'].to_numpy(dtype=int) - 1
+    weekdays = use_of_system_table['weekday'].to_numpy(dtype=int)
+
+    for column in use_of_system_table.columns:
+        # only time of day headers on the half hour can match a period
+        if not isinstance(column, datetime.time) or column.minute % 30 or column.second or column.microsecond:
+            continue
+        half_hour = 2 * column.hour + column.minute // 30
+        use_of_system[months, weekdays, half_hour] = use_of_system_table[column].to_numpy(dtype=float)
+        in_table[months, weekdays, half_hour] = True
+
+    return use_of_system, in_table
+
+
+def _merge_ts_data(input_demand_profiles, input_price_profiles, input_file_name_components):
 
     demand_data = pd.read_csv(input_demand_profiles)
     demand_data.Time = pd.to_datetime(demand_data.Time, dayfirst=True)
-    demand_data['Hour'] = demand_data.Time.dt.hour
     demand_data['Day'] = demand_data.Time.dt.date
 
+    # the price profiles take the demand profile's times, so the two are lined up by position
     price_data = pd.read_csv(input_price_profiles)
-    price_data.Time = pd.to_datetime(demand_data.Time, dayfirst=True)
-    price_data['Hour'] = demand_data.Time.dt.hour
-    price_data['Day'] = demand_data.Time.dt.date
-
-    data = demand_data.merge(price_data)
-
-    use_of_system_table = pd.read_excel(input_file_name_components, sheet_name='UseOfSystemTotal')
-
-    use_of_system_table = pd.melt(use_of_system_table, id_vars=['month', 'weekday'])
+    price_columns = [column for column in price_data.columns if column not in demand_data.columns]
+    n_periods = min(len(demand_data), len(price_data))
 
-    data['month'] = data.Time.dt.month
-    data['weekday'] = data.Time.dt.dayofweek
-    data['variable'] = data.Time.dt.time
+    data = pd.concat([demand_data.iloc[:n_periods], price_data[price_columns].iloc[:n_periods]], axis=1)
 
-    data = pd.DataFrame.merge(data, use_of_system_table).sort_values('Time').reset_index()
+    use_of_system, in_table = use_of_system_array(pd.read_excel(input_file_name_components, sheet_name='UseOfSystemTotal'))
 
+    time = data.Time.dt
+    on_half_hour = ((time.minute % 30 == 0) & (time.second == 0) & (time.microsecond == 0) & (time.nanosecond == 0)).to_numpy()
+    month = time.month.to_numpy(dtype=int) - 1
+    weekday = time.dayofweek.to_numpy(dtype=int)
+    half_hour = (2 * time.hour + time.minute // 30).to_numpy(dtype=int)
 
-    data = data.rename(columns={"value": "uos_charge"}).drop(columns=['variable', 'month', 'weekday', 'Hour'])
+    # periods without an entry in the table are left out, as the table join used to do
+    has_charge = on_half_hour & in_table[month, weekday, half_hour]
+    data = data.loc[has_charge, :]
+    data['uos_charge'] = use_of_system[month[has_charge], weekday[has_charge], half_hour[has_charge]]
 
+    data = data.sort_values('Time', kind='stable').reset_index(drop=True)
+    data.insert(0, 'index', np.arange(len(data)))
 
-    return data
\ No newline at end of file
+    return data
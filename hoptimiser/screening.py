@@ -0,0 +1,93 @@
+import numpy as np
+
+try:
+    from hoptimiser.economics import build_components, combination_years
+    from hoptimiser.dispatch_model import max_rolling_undersupply
+except:
+    from economics import build_components, combination_years
+    from dispatch_model import max_rolling_undersupply
+
+
+def _electrolyser_screen(input_combination, input_bundle, p80_demand, undersupply):
+    """
+    Whether the electrolyser setup of input_combination meets the P80 demand in every unique year, and if so the
+    storage its tank needs to cover the worst 10 day run of undersupply.
+    """
+
+    technical_inputs = input_bundle.technical_inputs
+    data = input_bundle.data
+
+    electrolyser, tank = build_components(input_combination, input_bundle, input_bundle.economic_inputs, technical_inputs)
+    unique_years = combination_years(electrolyser, input_bundle.data_years)[0]
+    max_power = min(technical_inputs['Value']['Max Grid Import Power MW'] * 1000 * technical_inputs['Value']['Line Efficiency after POI'], electrolyser.rated_power)
+
+    storage_needed_kwh = 0
+    for demand_year, efficiency_adjustment in zip(unique_years['DemandYear'], unique_years['minimum_relative_efficiency']):
+        max_h2_production = max_power * electrolyser.efficiency[-1] * 0.5 * efficiency_adjustment
+
+        if demand_year not in p80_demand:
+            p80_demand[demand_year] = np.percentile(data[demand_year], 80)
+        if not p80_demand[demand_year] < max_h2_production:
+            return False, 0
+
+        if (demand_year, max_h2_production) not in undersupply:
+            undersupply[demand_year, max_h2_production] = max_rolling_undersupply(data[demand_year].to_numpy() - max_h2_production, 48 * 10 - 1)
+        storage_needed_kwh = max(storage_needed_kwh, undersupply[demand_year, max_h2_production])
+
+    return True, storage_needed_kwh
+
+
+def screen_combinations(combinations, input_bundle):
+    """
+    Whether each combination is worth running, False where Analysis.run would fail it before solving anything: where
+    the electrolysers cannot make the P80 demand in a unique year, or the tank cannot hold the storage needed to cover
+    the worst 10 day run of undersupply. Meeting the P80 demand only gets easier with more electrolysers, so the
+    smallest count that does is found by bisection for each electrolyser model and stack replacement years, and only
+    the counts from there up are worked out in full and checked against the tanks of all their combinations at once.
+    """
+
+    tank_min_storage_kwh = max(input_bundle.technical_inputs['Value']['Tank Min Storage Level Allowed'], 1E-4)
+
+    # the combinations sharing each electrolyser model and replacement years, by electrolyser count
+    setups = {}
+    for i, input_combination in enumerate(combinations):
+        setups.setdefault((input_combination[0], tuple(input_combination[4:])), {}).setdefault(input_combination[1], []).append(i)
+
+    p80_demand = {}
+    undersupply = {}
+    electrolyser_feasible = np.ones(len(combinations), dtype=bool)
+    storage_needed_kwh = np.zeros(len(combinations))
+
+    for counts in setups.values():
+        n_electrolysers = sorted(counts)
+        screened = {}
+
+        low, high = 0, len(n_electrolysers)
+        while low < high:
+            middle = (low + high) // 2
+            screened[middle] = _electrolyser_screen(combinations[counts[n_electrolysers[middle]][0]], input_bundle, p80_demand, undersupply)
+            if screened[middle][0]:
+                high = middle
+            else:
+                low = middle + 1
+
+        for k, n in enumerate(n_electrolysers):
+            rows = counts[n]
+            if k < low:
+                electrolyser_feasible[rows] = False
+                continue
+            if k not in screened:
+                screened[k] = _electrolyser_screen(combinations[rows[0]], input_bundle, p80_demand, undersupply)
+            storage_needed_kwh[rows] = screened[k][1]
+
+    tank_model = np.array([input_combination[2] for input_combination in combinations], dtype=int)
+    n_tanks = np.array([input_combination[3] for input_combination in combinations])
+    max_storage_kwh = input_bundle.tank_df['H2 MWh Capacity'].to_numpy()[tank_model] * n_tanks * 1000
+
+    # the min storage is only raised, and then checked against the tank size, when the undersupply needs more than the limit
+    tank_feasible = ~((storage_needed_kwh > tank_min_storage_kwh) & (storage_needed_kwh >= max_storage_kwh))
+    feasible = electrolyser_feasible & tank_feasible
+
+    print('Combinations screened out as infeasible = ', int(np.sum(~feasible)), ' of ', len(combinations), ' (', int(np.sum(~electrolyser_feasible)), ' below the P80 demand, ', int(np.sum(electrolyser_feasible & ~tank_feasible)), ' with too small a tank)')
+
+    return feasible
@@ -0,0 +1,216 @@
+import os
+import subprocess
+import tempfile
+import numpy as np
+from pulp import PULP_CBC_CMD
+from scipy.optimize import milp, Bounds, LinearConstraint
+
+# Threads each solve may use, None for the solver's default. Set per process when several run side by side.
+solver_threads = None
+
+
+# Options a backend could not apply that the user has already been told about, so each is only reported once
+_ignored_options_reported = set()
+
+
+def set_solver_threads(n_threads):
+    global solver_threads
+    solver_threads = n_threads
+
+
+def _report_ignored_option(message):
+    if message not in _ignored_options_reported:
+        _ignored_options_reported.add(message)
+        print('Warning: ' + message)
+
+
+def write_mps(file_name, c, a_matrix, row_lower, row_upper, col_lower, col_upper, integrality):
+    """Write a minimisation problem held as arrays to an MPS file. Rows are named R<i> and columns C<j>."""
+
+    row_names = ['R' + str(i) for i in range(a_matrix.shape[0])]
+    col_names = ['C' + str(j) for j in range(a_matrix.shape[1])]
+
+    lines = ['NAME          MODEL', 'ROWS', ' N  OBJ']
+    for name, lower, upper in zip(row_names, row_lower, row_upper):
+        if lower == upper:
+            lines.append(' E  ' + name)
+        elif np.isinf(lower):
+            lines.append(' L  ' + name)
+        elif np.isinf(upper):
+            lines.append(' G  ' + name)
+        else:
+            raise Exception('Rows bounded on both sides are not supported in the MPS writer!')
+
+    lines.append('COLUMNS')
+    a_csc = a_matrix.tocsc()
+    in_integer_block = False
+    for j, name in enumerate(col_names):
+        if integrality[j] and not in_integer_block:
+            lines.append("    MARKER                 'MARKER'                 'INTORG'")
+            in_integer_block = True
+        elif not integrality[j] and in_integer_block:
+            lines.append("    MARKER                 'MARKER'                 'INTEND'")
+            in_integer_block = False
+        if c[j] != 0:
+            lines.append('    %-8s  %-8s  % .12e' % (name, 'OBJ', c[j]))
+        for k in range(a_csc.indptr[j], a_csc.indptr[j + 1]):
+            lines.append('    %-8s  %-8s  % .12e' % (name, row_names[a_csc.indices[k]], a_csc.data[k]))
+    if in_integer_block:
+        lines.append("    MARKER                 'MARKER'                 'INTEND'")
+
+    lines.append('RHS')
+    for name, lower, upper in zip(row_names, row_lower, row_upper):
+        rhs = upper if np.isinf(lower) else lower
+        if rhs != 0:
+            lines.append('    RHS       %-8s  % .12e' % (name, rhs))
+
+    lines.append('BOUNDS')
+    for j, name in enumerate(col_names):
+        if integrality[j] and col_lower[j] == 0 and col_upper[j] == 1:
+            lines.append(' BV BND       %-8s' % name)
+            continue
+        if col_lower[j] == col_upper[j]:
+            lines.append(' FX BND       %-8s  % .12e' % (name, col_lower[j]))
+            continue
+        if np.isinf(col_lower[j]):
+            lines.append(' MI BND       %-8s' % name)
+        elif col_lower[j] != 0:
+            lines.append(' LO BND       %-8s  % .12e' % (name, col_lower[j]))
+        if not np.isinf(col_upper[j]):
+            lines.append(' UP BND       %-8s  % .12e' % (name, col_upper[j]))
+    lines.append('ENDATA')
+
+    with open(file_name, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def read_cbc_solution(file_name, n_cols):
+    """Read a CBC solution file. Returns whether a feasible solution was found (optimal or stopped on time) and the column values."""
+
+    x = np.zeros(n_cols)
+
+    with open(file_name) as f:
+        status_line = f.readline().split()
+        for line in f:
+            if len(line) <= 2:
+                break
+            line = line.split()
+            if line[0] == '**':
+                line = line[1:]
+            if line[1][0] == 'C':
+                x[int(line[1][1:])] = float(line[2])
+
+    solved = status_line[0] == 'Optimal' or (status_line[0] == 'Stopped' and len(status_line) >= 5 and status_line[4] == 'objective')
+
+    return solved, x
+
+
+def write_cbc_mip_start(file_name, x):
+    """Write column values as a CBC MIP start file, in the solution file layout PuLP uses for its warm starts."""
+
+    lines = ['Stopped on iterations - objective value 0']
+    lines += ['%7d C%d %.17g 0' % (j, j, value) for j, value in enumerate(x)]
+
+    with open(file_name, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def solve_cbc(c, a_matrix, row_lower, row_upper, col_lower, col_upper, integrality, time_limit, warm_start=None):
+    """Solve the problem with the CBC binary shipped with PuLP, reading and writing the model files directly.
+    warm_start is given to CBC as its starting incumbent."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mps_file = os.path.join(tmp_dir, 'model.mps')
+        sol_file = os.path.join(tmp_dir, 'model.sol')
+
+        write_mps(mps_file, c, a_matrix, row_lower, row_upper, col_lower, col_upper, integrality)
+
+        args = [PULP_CBC_CMD().path, mps_file]
+        if warm_start is not None:
+            mip_start_file = os.path.join(tmp_dir, 'model.mst')
+            write_cbc_mip_start(mip_start_file, warm_start)
+            args += ['-mips', mip_start_file]
+        if solver_threads is not None:
+            args += ['-threads', str(solver_threads)]
+        args += ['-sec', str(time_limit), '-timeMode', 'elapsed', '-solve', '-printingOptions', 'all', '-solution', sol_file]
+        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL, check=True)
+
+        if not os.path.exists(sol_file):
+            return False, None
+
+        return read_cbc_solution(sol_file, len(c))
+
+
+def solve_highs(c, a_matrix, row_lower, row_upper, col_lower, col_upper, integrality, time_limit, warm_start=None):
+    """Solve the problem in-process with the HiGHS build that ships with SciPy. SciPy has no MIP start or thread option,
+    so a warm start or thread count goes to solve_highspy if highspy is installed, and is otherwise reported and ignored."""
+
+    if warm_start is not None or solver_threads is not None:
+        try:
+            import highspy
+            return solve_highspy(c, a_matrix, row_lower, row_upper, col_lower, col_upper, integrality, time_limit, warm_start)
+        except ImportError:
+            if warm_start is not None:
+                _report_ignored_option('the HiGHS solver in SciPy takes no warm start, so MIP solves start cold. Install highspy to use one.')
+            if solver_threads is not None:
+                _report_ignored_option('the HiGHS solver in SciPy takes no thread count, so ' + str(solver_threads) + ' solver threads is not applied. Install highspy to set it.')
+
+    result = milp(c, integrality=integrality, bounds=Bounds(col_lower, col_upper),
+                  constraints=LinearConstraint(a_matrix, row_lower, row_upper),
+                  options={'time_limit': float(time_limit), 'disp': False})
+
+    # status 1 means the time limit was hit, in which case x holds the best solution found (or None)
+    return result.x is not None, result.x
+
+
+def solve_highspy(c, a_matrix, row_lower, row_upper, col_lower, col_upper, integrality, time_limit, warm_start=None):
+    """Solve the problem in-process through the highspy bindings, which expose more HiGHS options than SciPy."""
+
+    import highspy
+
+    a_csc = a_matrix.tocsc()
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = len(c)
+    lp.num_row_ = a_csc.shape[0]
+    lp.col_cost_ = c
+    lp.col_lower_ = col_lower
+    lp.col_upper_ = col_upper
+    lp.row_lower_ = row_lower
+    lp.row_upper_ = row_upper
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = a_csc.indptr
+    lp.a_matrix_.index_ = a_csc.indices
+    lp.a_matrix_.value_ = a_csc.data
+    lp.integrality_ = [highspy.HighsVarType.kInteger if i else highspy.HighsVarType.kContinuous for i in integrality]
+
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', False)
+    h.setOptionValue('time_limit', float(time_limit))
+    if solver_threads is not None:
+        h.setOptionValue('threads', int(solver_threads))
+    h.passModel(lp)
+    if warm_start is not None:
+        start = highspy.HighsSolution()
+        start.col_value = list(warm_start)
+        h.setSolution(start)
+    h.run()
+
+    if h.getInfo().primal_solution_status != 2:
+        return False, None
+
+    return True, np.array(h.getSolution().col_value)
+
+
+SOLVERS = {
+    'CBC': solve_cbc,
+    'HiGHS': solve_highs,
+    'highspy': solve_highspy,
+}
+
+
+def get_solver(name):
+    if name not in SOLVERS:
+        raise Exception('Unknown linear solver ' + str(name) + ', must be one of: ' + ', '.join(SOLVERS))
+
+    return SOLVERS[name]
@@ -0,0 +1,191 @@
+import numpy as np
+from scipy.stats import norm
+
+
+def combination_features(combinations, input_bundle):
+    """Standardised numeric features of each combination, dropping any that never vary."""
+
+    electrolyser_capacity = input_bundle.electrolyser_df['Capacity (MW)'].to_numpy(dtype=float)
+    tank_capacity = input_bundle.tank_df['H2 MWh Capacity'].to_numpy(dtype=float)
+
+    features = []
+    for input_combination in combinations:
+        replacement_years = input_combination[4:]
+        row = [
+            input_combination[1],
+            input_combination[1] * electrolyser_capacity[input_combination[0]],
+            input_combination[3],
+            input_combination[3] * tank_capacity[input_combination[2]],
+            len(replacement_years),
+            np.mean(replacement_years) if replacement_years else 0,
+        ]
+        row += list(np.arange(len(electrolyser_capacity)) == input_combination[0])
+        row += list(np.arange(len(tank_capacity)) == input_combination[2])
+        features.append(row)
+
+    features = np.array(features, dtype=float)
+    std = features.std(axis=0)
+    features = features[:, std > 0]
+
+    return (features - features.mean(axis=0)) / std[std > 0]
+
+
+class GaussianProcess:
+    """Matern 5/2 Gaussian process regression, its length scale picked from LENGTH_SCALES by marginal likelihood."""
+
+    LENGTH_SCALES = [0.25, 0.5, 1., 2., 4., 8.]
+
+    def __init__(self, noise=1E-6):
+        self.noise = noise
+        self.length_scale = None
+
+    def _kernel(self, x1, x2, length_scale):
+        distance = np.sqrt(np.maximum(np.sum(x1 ** 2, axis=1)[:, None] + np.sum(x2 ** 2, axis=1)[None, :] - 2 * x1 @ x2.T, 0)) * np.sqrt(5) / length_scale
+        return (1 + distance + distance ** 2 / 3) * np.exp(-distance)
+
+    def _factorise(self, length_scale):
+        covariance = self._kernel(self.x, self.x, length_scale) + self.noise * np.eye(len(self.x))
+        cholesky = np.linalg.cholesky(covariance)
+        alpha = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, self.y))
+        log_likelihood = -0.5 * self.y @ alpha - np.sum(np.log(np.diag(cholesky)))
+
+        return cholesky, alpha, log_likelihood
+
+    def fit(self, x, y, length_scale=None):
+        self.x = np.asarray(x, dtype=float)
+        self.y_mean = np.mean(y)
+        self.y_std = np.std(y) if np.std(y) > 0 else 1.
+        self.y = (np.asarray(y, dtype=float) - self.y_mean) / self.y_std
+
+        if length_scale is None:
+            length_scale = max(self.LENGTH_SCALES, key=lambda length_scale: self._factorise(length_scale)[2])
+        self.length_scale = length_scale
+        self.cholesky, self.alpha = self._factorise(length_scale)[0:2]
+
+        return self
+
+    def predict(self, x):
+        """Mean and standard deviation of the prediction at each row of x."""
+
+        covariance = self._kernel(np.asarray(x, dtype=float), self.x, self.length_scale)
+        mean = covariance @ self.alpha
+        v = np.linalg.solve(self.cholesky, covariance.T)
+        variance = np.maximum(1 - np.sum(v ** 2, axis=0), 0)
+
+        return self.y_mean + mean * self.y_std, np.sqrt(variance) * self.y_std
+
+
+class SurrogateSearch:
+    """
+    Bayesian optimisation over a sweep: after n_initial spread out runs, the next combination is the one with the
+    greatest expected improvement, from a Gaussian process fitted to each LCOH2 less its lower bound. Runs still going
+    count at their predicted LCOH2. Stops after max_evaluations runs, when no expected improvement reaches
+    min_expected_improvement of the best, or when no bound left is below the n_best-th best.
+    """
+
+    def __init__(self, combinations, to_run, lcoh2, capex_lcoh2, electricity_lcoh2, features, n_best=1, max_evaluations=None, n_initial=10, min_expected_improvement=1E-4):
+        self.combinations = combinations
+        self.bound = capex_lcoh2 + electricity_lcoh2
+        self.features = features
+        self.n_best = n_best
+        self.max_evaluations = max_evaluations if max_evaluations is not None else len(to_run)
+        self.n_initial = n_initial
+        self.min_expected_improvement = min_expected_improvement
+
+        # the surrogate predicts the LCOH2 above the bound, or above the capex where the electricity cannot be bounded
+        self.prior = capex_lcoh2 + np.where(np.isfinite(electricity_lcoh2), electricity_lcoh2, 0)
+
+        self.pending = list(to_run)
+        self.failed = []
+        self.results = {}
+        self.running = []
+        self.n_submitted = 0
+
+        for i, result in enumerate(lcoh2):
+            if result is not None:
+                self.record(i, result)
+
+    @property
+    def pruned(self):
+        # whatever has not been run when the search stops is skipped
+        return self.pending
+
+    def lower_bound(self, i):
+        return self.bound[i]
+
+    def threshold(self):
+        if len(self.results) < self.n_best:
+            return np.inf
+        return sorted(self.results.values())[self.n_best - 1]
+
+    def _candidates(self):
+        threshold = self.threshold()
+        return [i for i in self.pending if self.bound[i] < threshold]
+
+    def n_remaining(self):
+        return min(len(self._candidates()), self.max_evaluations - self.n_submitted)
+
+    def _spread_out(self, candidates):
+        """The candidate furthest from every combination run or running, or the one with the lowest bound at first."""
+
+        chosen = list(self.results) + self.running
+        if not chosen:
+            return min(candidates, key=lambda i: self.bound[i])
+
+        distance = np.min(np.linalg.norm(self.features[candidates][:, None, :] - self.features[chosen][None, :, :], axis=2), axis=1)
+        return candidates[int(np.argmax(distance))]
+
+    def _expected_improvement(self, candidates):
+        evaluated = list(self.results)
+        residual = np.array([self.results[i] - self.prior[i] for i in evaluated])
+        gaussian_process = GaussianProcess().fit(self.features[evaluated], residual)
+
+        # the runs still going are taken to come out as predicted, keeping the same length scale
+        if self.running:
+            running_residual = gaussian_process.predict(self.features[self.running])[0]
+            gaussian_process.fit(self.features[evaluated + self.running], np.concatenate((residual, running_residual)), gaussian_process.length_scale)
+
+        mean, std = gaussian_process.predict(self.features[candidates])
+        mean += self.prior[candidates]
+        best = min(self.results.values())
+
+        improvement = best - mean
+        z = np.divide(improvement, std, out=np.zeros_like(std), where=std > 0)
+        expected_improvement = np.where(std > 0, improvement * norm.cdf(z) + std * norm.pdf(z), np.maximum(improvement, 0))
+
+        return expected_improvement, best
+
+    def next_combination(self):
+        """The next combination to run, or None when the search has stopped."""
+
+        candidates = self._candidates()
+        if not candidates or self.n_submitted >= self.max_evaluations:
+            return None
+
+        if len(self.results) + len(self.running) < self.n_initial or len(self.results) < 2:
+            i = self._spread_out(candidates)
+        else:
+            expected_improvement, best = self._expected_improvement(candidates)
+            if np.max(expected_improvement) < self.min_expected_improvement * abs(best):
+                return None
+            i = candidates[int(np.argmax(expected_improvement))]
+
+        self.pending.remove(i)
+        self.running.append(i)
+        self.n_submitted += 1
+
+        return i
+
+    def best_combinations(self):
+        return sorted(self.results, key=self.results.get)[0:self.n_best]
+
+    def record(self, i, result):
+        """Take the LCOH2 of a finished run (None if it raised) into the surrogate."""
+
+        if i in self.running:
+            self.running.remove(i)
+        if i in self.pending:
+            self.pending.remove(i)
+
+        if result is not None and result < 9999:
+            self.results[i] = result
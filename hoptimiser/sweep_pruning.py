@@ -0,0 +1,234 @@
+import numpy as np
+
+try:
+    from hoptimiser.economics import economic_settings, build_components, combination_years, add_annual_costs, levelised_cost_of_h2
+    from hoptimiser.dispatch_model import piecewise_levels
+except:
+    from economics import economic_settings, build_components, combination_years, add_annual_costs, levelised_cost_of_h2
+    from dispatch_model import piecewise_levels
+
+
+def _sorted_prices(prices):
+    """Prices in ascending order, their running totals and how many are negative."""
+
+    sorted_prices = np.sort(np.asarray(prices, dtype=float))
+    return sorted_prices, np.concatenate(([0.], np.cumsum(sorted_prices))), int(np.searchsorted(sorted_prices, 0))
+
+
+def _cheapest_h2_cost(sorted_prices, cumulative_prices, n_negative, required_kwh, max_kwh_per_period, max_efficiency):
+    """
+    The least price x kWh of electricity for at least required_kwh of H2, with up to max_kwh_per_period a period made
+    into H2 at no more than max_efficiency: flat out in every negative period, then the cheapest of the rest.
+    """
+
+    negative_cost = max_kwh_per_period * cumulative_prices[n_negative]
+
+    remaining_kwh = max(required_kwh / max_efficiency - n_negative * max_kwh_per_period, 0)
+    n_full = min(int(remaining_kwh // max_kwh_per_period), len(sorted_prices) - n_negative)
+    last = n_negative + n_full
+    positive_cost = max_kwh_per_period * (cumulative_prices[last] - cumulative_prices[n_negative])
+    if last < len(sorted_prices):
+        positive_cost += (remaining_kwh - n_full * max_kwh_per_period) * sorted_prices[last]
+
+    return negative_cost + positive_cost
+
+
+def _price_scaling_range(sorted_import_prices, sorted_scaling_prices):
+    """
+    The lowest and highest ratio store_year_result can scale the import cost by. Both percentiles are linear between
+    the same breakpoints, so the ratio is at its extremes at one, unless the import price is zero or changes sign.
+    """
+
+    if not (np.all(sorted_import_prices > 0) or np.all(sorted_import_prices < 0)):
+        return -np.inf, np.inf
+
+    ratio = sorted_scaling_prices / sorted_import_prices
+    return ratio.min(), ratio.max()
+
+
+def lcoh2_lower_bounds(combinations, input_bundle):
+    """
+    A lower bound on each combination's LCOH2 without dispatching it, in two parts: capex_lcoh2, every cost but the
+    electricity, and electricity_lcoh2, the least the electricity can add (-inf where it cannot be bounded).
+    """
+
+    economic_inputs = input_bundle.economic_inputs
+    technical_inputs = input_bundle.technical_inputs
+    settings = economic_settings(economic_inputs, technical_inputs)
+    data = input_bundle.data
+
+    grid_import_max_power = technical_inputs['Value']['Max Grid Import Power MW']
+    line_efficiency_after_poi = technical_inputs['Value']['Line Efficiency after POI']
+
+    demand_kwh = {}
+    prices = {}
+    scaling_range = {}
+    results_years_list = []
+    electricity_cost_list = []
+
+    uos_prices = _sorted_prices(data['uos_charge'])
+
+    for input_combination in combinations:
+        electrolyser, tank = build_components(input_combination, input_bundle, economic_inputs, technical_inputs)
+        unique_years, results_years = combination_years(electrolyser, input_bundle.data_years)
+        max_power = min(grid_import_max_power * 1000 * line_efficiency_after_poi, electrolyser.rated_power)
+        curve_efficiency = list(electrolyser.full_efficiency) + list(electrolyser.efficiency)
+        # the most power any level of either curve allows in a period
+        max_kw = max(max(piecewise_levels(load_factor, efficiency, electrolyser.rated_power, max_power, electrolyser.min_power)[1]) for load_factor, efficiency in [(electrolyser.full_efficiency_load_factor, electrolyser.full_efficiency), (electrolyser.efficiency_load_factor, electrolyser.efficiency)])
+
+        for demand_year in unique_years['DemandYear']:
+            if demand_year not in demand_kwh:
+                demand_kwh[demand_year] = np.round(data[demand_year].sum(), 2)
+
+        h2_to_demand_kwh = results_years['DemandYear'].map(demand_kwh)
+        results_years['total_elec_cost'] = 0.0
+        results_years['h2_to_demand_kWh'] = h2_to_demand_kwh
+        results_years['h2_to_demand_kg'] = h2_to_demand_kwh / settings['kwh_per_kg']
+        results_years['water_cost'] = h2_to_demand_kwh * settings['water_price_per_litre'] * settings['water_needed_per_mwh_h2'] / 1000
+
+        # the least import and use of system cost of each unique year, before the scaling applied to each calendar year
+        import_cost = {}
+        uos_cost = {}
+        for combined, demand_year, price_year, efficiency_adjustment in unique_years[['combined', 'DemandYear', 'PriceYear', 'minimum_relative_efficiency']].itertuples(index=False):
+            price_year = int(price_year)
+            if price_year not in prices:
+                prices[price_year] = _sorted_prices(data[str(price_year)] * settings['combined_elec_price_inflation'])
+
+            max_efficiency = max(curve_efficiency) * efficiency_adjustment
+            # the year can start with at most a full tank, as the starting storage may be raised to the minimum storage
+            required_kwh = max(data[demand_year].sum() - tank.max_storage_kwh, 0)
+
+            import_cost[combined] = _cheapest_h2_cost(*prices[price_year], required_kwh, max_kw * 0.5, max_efficiency) / (1000 * line_efficiency_after_poi)
+            uos_cost[combined] = _cheapest_h2_cost(*uos_prices, required_kwh, max_kw * 0.5, max_efficiency) / (1000 * line_efficiency_after_poi)
+
+        electricity_cost = np.zeros(len(results_years))
+        for row, (combined, price_year, price_scale_year, cost_reduction_factor) in enumerate(results_years[['combined', 'PriceYear', 'PriceScaleYear', 'cost_reduction_factor']].itertuples(index=False)):
+            if combined not in import_cost:
+                continue
+
+            if int(price_scale_year) == int(price_year):
+                scaling = (1 / settings['combined_elec_price_inflation'],) * 2
+            else:
+                if (price_year, price_scale_year) not in scaling_range:
+                    scaling_range[price_year, price_scale_year] = _price_scaling_range(prices[int(price_year)][0], np.sort(data[str(int(price_scale_year))].to_numpy(dtype=float)))
+                scaling = scaling_range[price_year, price_scale_year]
+
+            # a negative ratio would scale an import cost with no upper bound down without limit
+            if scaling[0] < 0:
+                import_elec_cost = -np.inf
+            else:
+                import_elec_cost = min(import_cost[combined] * scaling[0], import_cost[combined] * scaling[1]) * cost_reduction_factor
+            uos_elec_cost = uos_cost[combined] * cost_reduction_factor
+            # down to the penny, as store_year_result rounds
+            electricity_cost[row] = np.floor(import_elec_cost * 100) / 100 + np.floor(uos_elec_cost * 100) / 100
+
+        electricity_cost[np.isnan(electricity_cost)] = -np.inf
+
+        results_years = add_annual_costs(results_years, electrolyser, tank, settings)
+        results_years_list.append(results_years)
+        electricity_cost_list.append(electricity_cost * results_years['discount_factor'].to_numpy() / np.sum(results_years['h2_to_demand_kg'] * results_years['discount_factor']))
+
+    capex_lcoh2 = levelised_cost_of_h2(results_years_list)
+    electricity_lcoh2 = np.array([np.sum(electricity_cost) for electricity_cost in electricity_cost_list])
+
+    return capex_lcoh2, electricity_lcoh2
+
+
+class SweepScheduler:
+    """
+    Branch and bound over a sweep: combinations are run in order of their lower bound on the LCOH2 and skipped once
+    the n_best-th best LCOH2 found is below every bound left.
+
+    A bound is capex_lcoh2 plus electricity_lcoh2, so nothing skipped could have made the n_best. With line_heuristic
+    set, the electricity part is raised to the electricity share of any run with as many tanks or more on the same line
+    (electrolyser setup and tank model), taking that share not to rise as tanks are added. The daily dispatch does not
+    guarantee this, so more is skipped but the n_best found may not be the best of the sweep. A failed run fails every
+    combination with no more electrolysers or tanks of the same models. With prune False the combinations are given
+    in order and nothing is skipped.
+    """
+
+    def __init__(self, combinations, to_run, lcoh2, capex_lcoh2=None, electricity_lcoh2=None, n_best=1, prune=True, line_heuristic=False):
+        self.combinations = combinations
+        self.capex_lcoh2 = capex_lcoh2
+        self.electricity_lcoh2 = electricity_lcoh2
+        self.n_best = n_best
+        self.prune = prune
+        self.line_heuristic = line_heuristic
+
+        self.pending = list(to_run)
+        self.pruned = []
+        self.failed = []
+        self.results = {}
+
+        # the electricity share of the LCOH2 of each run, by line and tank count
+        self._electricity_lcoh2 = {}
+
+        for i, result in enumerate(lcoh2):
+            if result is not None:
+                self.record(i, result)
+
+    def _line(self, i):
+        input_combination = self.combinations[i]
+        return (input_combination[0], input_combination[1], input_combination[2], tuple(input_combination[4:]))
+
+    def lower_bound(self, i):
+        n_tanks = self.combinations[i][3]
+        electricity_lcoh2 = [share for n, share in self._electricity_lcoh2.get(self._line(i), []) if n >= n_tanks]
+
+        return self.capex_lcoh2[i] + max([self.electricity_lcoh2[i]] + electricity_lcoh2)
+
+    def threshold(self):
+        """The n_best-th best LCOH2 found, which a combination's bound must be below for it to be worth running."""
+
+        if len(self.results) < self.n_best:
+            return np.inf
+        return sorted(self.results.values())[self.n_best - 1]
+
+    def n_remaining(self):
+        return len(self.pending)
+
+    def next_combination(self):
+        """The next combination to run, or None when there are none left worth running."""
+
+        if not self.pending:
+            return None
+
+        if not self.prune:
+            return self.pending.pop(0)
+
+        # bounds only go up and the threshold only comes down, so nothing left can make it once the lowest bound cannot
+        bounds = [self.lower_bound(i) for i in self.pending]
+        i = self.pending[int(np.argmin(bounds))]
+        if min(bounds) >= self.threshold():
+            self.pruned += self.pending
+            self.pending = []
+            return None
+
+        self.pending.remove(i)
+        return i
+
+    def best_combinations(self):
+        """The n_best combinations with the lowest LCOH2 found, best first."""
+
+        return sorted(self.results, key=self.results.get)[0:self.n_best]
+
+    def record(self, i, result):
+        """Take the LCOH2 of a finished run (None if it raised) into account for the combinations still to run."""
+
+        if result is None:
+            return
+
+        if result >= 9999:
+            if not self.prune:
+                return
+            input_combination = self.combinations[i]
+            for j in list(self.pending):
+                other = self.combinations[j]
+                if (other[0], other[2], other[4:]) == (input_combination[0], input_combination[2], input_combination[4:]) and other[1] <= input_combination[1] and other[3] <= input_combination[3]:
+                    self.pending.remove(j)
+                    self.failed.append(j)
+            return
+
+        self.results[i] = result
+        if self.prune and self.line_heuristic:
+            self._electricity_lcoh2.setdefault(self._line(i), []).append((self.combinations[i][3], result - self.capex_lcoh2[i]))
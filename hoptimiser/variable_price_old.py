@@ -7,6 +7,7 @@ from control_algorithm import LPcontrol, BasicControlDay, NoStorageDay
 from component_inputs_reader import read_component_data, populate_combinations
 from component_classes import CombinedElectrolyser, CombinedTank
 from read_time_series_data import read_ts_data
+from dispatch_model import max_rolling_undersupply
 
 def variable_price_runner(tank_df, electrolyser_df, data_years, input_combination):
 
@@ -93,13 +94,7 @@ def variable_price_runner(tank_df, electrolyser_df, data_years, input_combinatio
 
             #calculate the max culmulative undersupply of h2 over any rolling time period:
             data['under_supply'] = data['demand'] - max_h2_production
-            max_cumulative_undersupply = 0
-            for i in range(1, 48 * 10):
-                #i = 48
-                test = max(data['under_supply'].rolling(i).sum().shift(-(i - 1)))
-                max_cumulative_undersupply = max(test, max_cumulative_undersupply)
-                #if test >  0:
-                #    print(i, test)
+            max_cumulative_undersupply = max_rolling_undersupply(data['under_supply'].to_numpy(), 48 * 10 - 1)
             if tank.min_storage_kwh < max_cumulative_undersupply:
                 print('Minimum storage remaining set to cover worst day of over-demand: ', round(max_cumulative_undersupply, 1), ' kWh')
                 tank.min_storage_kwh = max_cumulative_undersupply
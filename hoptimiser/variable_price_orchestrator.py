@@ -1,33 +1,293 @@
 import numpy as np
-import pandas as pd
 import datetime
 import os
 import sys
 import json
+import copy
+import shutil
+import glob
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from scipy.stats import percentileofscore
 
 try:
-    from hoptimiser.control_algorithm import LPcontrol5, LPcontrol10
-    from hoptimiser.component_inputs_reader import read_component_data, populate_combinations
-    from hoptimiser.component_classes import CombinedElectrolyser, CombinedTank
-    from hoptimiser.read_time_series_data import read_ts_data
+    from hoptimiser.control_algorithm import LPcontrol, LPcontrolMatrix, LPcontrolRollingWindow, ResultsBuffer
+    from hoptimiser.read_time_series_data import set_year_data
+    from hoptimiser.economics import economic_settings, efficiency_curve_settings, build_components, combination_years, store_year_result, add_annual_costs, levelised_cost_of_h2, dispatch_outputs_file, save_dispatch_outputs
+    from hoptimiser.dispatch_model import DailyDispatchModel, max_rolling_undersupply
+    from hoptimiser.input_bundle import InputBundle
+    from hoptimiser.multi_fidelity import representative_day_data
+    from hoptimiser.file_cache import files_hash
     from hoptimiser.config import PROJECT_ROOT_DIR
 except:
-    from control_algorithm import LPcontrol5, LPcontrol10
-    from component_inputs_reader import read_component_data, populate_combinations
-    from component_classes import CombinedElectrolyser, CombinedTank
-    from read_time_series_data import read_ts_data
+    from control_algorithm import LPcontrol, LPcontrolMatrix, LPcontrolRollingWindow, ResultsBuffer
+    from read_time_series_data import set_year_data
+    from economics import economic_settings, efficiency_curve_settings, build_components, combination_years, store_year_result, add_annual_costs, levelised_cost_of_h2, dispatch_outputs_file, save_dispatch_outputs
+    from dispatch_model import DailyDispatchModel, max_rolling_undersupply
+    from input_bundle import InputBundle
+    from multi_fidelity import representative_day_data
+    from file_cache import files_hash
     from config import PROJECT_ROOT_DIR
 
 
+def time_series_arrays(data, n_days):
+    """The columns the controllers use as arrays over the year, checking every day has 48 half hours so days can be sliced by position."""
+
+    arrays = {column: data[column].to_numpy() for column in ['Time', 'Day', 'combined_price', 'import_price', 'uos_charge', 'demand']}
+
+    if len(data) != 48 * n_days or not (arrays['Day'].reshape(n_days, 48) == arrays['Day'][::48, None]).all():
+        raise Exception('Every day of the time series must have 48 half hours!')
+
+    return arrays
+
+
+def daily_look_ahead_arrays(year_arrays, n_days, look_ahead_periods):
+    """(n_days, 48 + look_ahead_periods) arrays with each day followed by its own first look_ahead_periods, so each day's problem is one row."""
+
+    day_arrays = {}
+    for column, values in year_arrays.items():
+        values = values.reshape(n_days, 48)
+        day_arrays[column] = np.ascontiguousarray(np.hstack((values, values[:, :look_ahead_periods])))
+
+    return day_arrays
+
+
+# Bump when what the dispatch returns changes, so old cached years are not picked up
+DISPATCH_CACHE_VERSION = 3
+
+# Any change to the package's code also misses the cache, as it may change the dispatch
+DISPATCH_CODE_HASH = files_hash(sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))), DISPATCH_CACHE_VERSION)
+
+
+def dispatch_cache_key(input_files_hash, components, demand_year, price_year, efficiency_adjustment, tank, control_settings):
+    """
+    Cache key for one unique year's dispatch. The stack replacement years only reach the dispatch through the
+    efficiency adjustment, so combinations that differ only in them share keys where their adjustments match.
+    """
+
+    key = [
+        DISPATCH_CODE_HASH,
+        input_files_hash,
+        [int(component) for component in components], #electrolyser model and count, tank model and count
+        str(demand_year),
+        int(price_year),
+        round(float(efficiency_adjustment), 9),
+        float(tank.min_storage_kwh), #raised to cover the worst undersupply, and carried over from earlier years, it is also the first end of day target
+        float(tank.starting_storage_kwh), #the storage each year starts from
+        sorted((setting, str(value)) for setting, value in control_settings.items()),
+    ]
+
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+def load_dispatch_result(cache_dir, key, time_series_file):
+    """The cached result of dispatch_year for key, with its time series copied to time_series_file, or None if there is none."""
+
+    result_file = os.path.join(cache_dir, 'dispatch_' + key + '.json')
+    cached_time_series_file = os.path.join(cache_dir, 'dispatch_' + key + '.csv')
+    if not os.path.exists(result_file):
+        return None
+
+    try:
+        with open(result_file, encoding='utf-8') as f:
+            year_result = json.load(f)
+        shutil.copyfile(cached_time_series_file, time_series_file)
+    except Exception:
+        print('Could not load the cached dispatch from ' + result_file + ', optimising the year instead')
+        return None
+
+    return year_result
+
+
+def save_dispatch_result(cache_dir, key, year_result, time_series_file):
+    # the time series goes in first and the result last, each by rename, so a result found is always complete
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_suffix = '.' + str(os.getpid()) + '.tmp'
+
+    cached_time_series_file = os.path.join(cache_dir, 'dispatch_' + key + '.csv')
+    shutil.copyfile(time_series_file, cached_time_series_file + temp_suffix)
+    os.replace(cached_time_series_file + temp_suffix, cached_time_series_file)
+
+    result_file = os.path.join(cache_dir, 'dispatch_' + key + '.json')
+    with open(result_file + temp_suffix, 'w', encoding='utf-8') as f:
+        json.dump(year_result, f, indent=2)
+    os.replace(result_file + temp_suffix, result_file)
+
+
+def dispatch_year(data, efficiency_adjustment, max_h2_production, electrolyser, tank, dispatch_models, control_settings, time_series_file):
+    """
+    Optimise the control over one unique (demand year, price year) pair, with data holding that year's demand and
+    prices. Kept at module level so the unique years can be run in separate processes. Returns the year's totals.
+
+    With representative days set, only those days are dispatched, one after another, and each period's costs count
+    as many times as its day's weight, so the totals stand in for the whole year's.
+    """
+
+    build_lp_matrices_directly = control_settings['build_lp_matrices_directly']
+    linear_solver = control_settings['linear_solver']
+    warm_start_mip_solves = control_settings['warm_start_mip_solves']
+    use_convex_lp = control_settings['use_convex_lp']
+    full_year_lp_bound = control_settings['full_year_lp_bound']
+    rolling_horizon_days = control_settings['rolling_horizon_days']
+    rolling_horizon_stride_days = control_settings['rolling_horizon_stride_days']
+    lp_solver_time_limit_seconds = control_settings['lp_solver_time_limit_seconds']
+    line_efficiency_after_poi = control_settings['line_efficiency_after_poi']
+    reduce_efficiencies = control_settings['reduce_efficiencies']
+    supplier_fee = control_settings['supplier_fee']
+
+    year_data = data
+    data, period_weights = representative_day_data(year_data, control_settings['representative_days'])
+
+    failed_combination_flag = False
+    production_price_percentile = np.nan
+
+    total_cost = 0
+    total_import_cost = 0
+    total_uos_cost = 0
+    total_supplier_fee_costs = 0
+    total_h2_produced = 0
+    h2_price_sum_product = 0
+
+    day_start_h2_in_storage_kwh = tank.starting_storage_kwh
+
+    # no warm start is carried in from the year before, so the year only depends on what dispatch_cache_key holds
+    for dispatch_model in dispatch_models.values():
+        dispatch_model.previous_solution = None
+
+    # each solve writes its committed periods straight into the year's preallocated result columns
+    results = ResultsBuffer(len(data))
+
+    days_with_solver_time_curtailed = 0
+    days_curtailed_with_warm_start = 0
+    days_solved_convex = 0
+
+    end_of_day_storage_target = tank.min_storage_kwh
+    end_of_day_storage_increase_per_day = 0
+
+    month = 1
+
+    days = data['Day'].unique()
+
+    if full_year_lp_bound:
+        solve_window_days = len(days)
+        solve_stride_days = len(days)
+        print('\nNow optimising the control for all 12 months as a single LP... ')
+    elif rolling_horizon_days > 0:
+        solve_window_days = rolling_horizon_days
+        solve_stride_days = rolling_horizon_stride_days
+        print('\nNow optimising the control ' + str(rolling_horizon_days) + ' days at a time, moving on ' + str(solve_stride_days) + ' days each time, for 12 months... ')
+    else:
+        solve_window_days = 0
+        solve_stride_days = 1
+        print('\nNow optimising the control one day at a time for 12 months... ')
+
+    # the columns the controllers need, as arrays a solve's periods can be sliced from without copying
+    year_arrays = time_series_arrays(data, len(days))
+    if solve_window_days == 0:
+        #Guess that first 12 hours of following day will have the same price and demand as this day:
+        day_arrays = daily_look_ahead_arrays(year_arrays, len(days), 24)
+
+    for day_number in range(0, len(days), solve_stride_days):
+
+        day = days[day_number]
+
+        if not day.month == month:
+            print('Month '+str(day.month - 1)+' complete...')
+            month = day.month
+
+        if not failed_combination_flag:
+
+            if solve_window_days > 0:
+
+                n_window_days = min(solve_window_days, len(days) - day_number)
+                data_day = {column: values[48 * day_number:48 * (day_number + n_window_days)] for column, values in year_arrays.items()}
+                n_commit_periods = 48 * min(solve_stride_days, n_window_days)
+
+            else:
+
+                data_day = {column: values[day_number] for column, values in day_arrays.items()}
+
+            n_periods = len(data_day['demand'])
+
+            if build_lp_matrices_directly:
+                if n_periods not in dispatch_models:
+                    dispatch_models[n_periods] = DailyDispatchModel(electrolyser, tank, line_efficiency_after_poi, reduce_efficiencies, n_periods=n_periods, solver=linear_solver, convex_fast_path=use_convex_lp, relax_integrality=full_year_lp_bound)
+                    if len(dispatch_models) == 1 and dispatch_models[n_periods].convex_model is not None:
+                        print('Electrolyser H2 output is concave in power, days will be solved on the interpolated curve')
+                dispatch_model = dispatch_models[n_periods]
+
+            if solve_window_days > 0:
+                day_results, solver_time, failed_combination_flag, mean_production_price = LPcontrolRollingWindow(data_day, n_commit_periods, day_start_h2_in_storage_kwh, lp_solver_time_limit_seconds, dispatch_model, efficiency_adjustment, failed_combination_flag, supplier_fee, warm_start_mip_solves, 48 * solve_stride_days, results)
+            elif build_lp_matrices_directly:
+                day_results, solver_time, end_of_day_storage_target, end_of_day_storage_increase_per_day, failed_combination_flag, mean_production_price = LPcontrolMatrix(data_day, day_start_h2_in_storage_kwh, lp_solver_time_limit_seconds, dispatch_model, efficiency_adjustment, end_of_day_storage_target, end_of_day_storage_increase_per_day, max_h2_production, failed_combination_flag, supplier_fee, warm_start_mip_solves, results)
+            else:
+                day_results, solver_time, end_of_day_storage_target, end_of_day_storage_increase_per_day, failed_combination_flag, mean_production_price = LPcontrol(data_day, day_start_h2_in_storage_kwh, line_efficiency_after_poi, lp_solver_time_limit_seconds, electrolyser, tank, efficiency_adjustment, end_of_day_storage_target, end_of_day_storage_increase_per_day, max_h2_production, failed_combination_flag, supplier_fee, reduce_efficiencies, results)
+
+
+        if not failed_combination_flag:
+
+            weights = 1 if period_weights is None else period_weights[48 * day_number:48 * day_number + len(day_results['h2_produced_kWh'])]
+
+            day_start_h2_in_storage_kwh = day_results['h2_in_storage_kWh'][-1]
+            total_cost += np.sum(day_results['h2_cost_total'] * weights)
+            total_import_cost += np.sum(day_results['h2_cost_imports'] * weights)
+            total_uos_cost += np.sum(day_results['h2_cost_uos'] * weights)
+            total_supplier_fee_costs += np.sum(day_results['h2_cost_supplier_fee'] * weights)
+
+            day_h2_produced = np.sum(day_results['h2_produced_kWh'] * weights)
+
+            if not np.isnan(mean_production_price):
+                h2_price_sum_product += day_h2_produced * mean_production_price
+
+            total_h2_produced += day_h2_produced
+
+            if solver_time >= datetime.timedelta(seconds = lp_solver_time_limit_seconds) * 0.999:
+                days_with_solver_time_curtailed += 1
+                if build_lp_matrices_directly and dispatch_model.warm_started:
+                    days_curtailed_with_warm_start += 1
+
+            if build_lp_matrices_directly and dispatch_model.convex_model is not None and dispatch_model.convex_model.solved:
+                days_solved_convex += 1
+
+            if end_of_day_storage_target < tank.min_storage_kwh:
+                end_of_day_storage_target += end_of_day_storage_increase_per_day
+
+    if not failed_combination_flag:
+        print('Month 12 complete!')
+        print('\nDays curtailed due to solver time limit = ', days_with_solver_time_curtailed)
+        if warm_start_mip_solves and build_lp_matrices_directly:
+            print('Of which solved with a warm start from the previous day = ', days_curtailed_with_warm_start, ', without = ', days_with_solver_time_curtailed - days_curtailed_with_warm_start)
+        if build_lp_matrices_directly and dispatch_model.convex_model is not None:
+            print('Days solved on the concave H2 curve rather than as the MILP = ', days_solved_convex)
+        weighted_mean_price_when_producing = h2_price_sum_product / total_h2_produced
+
+        production_price_percentile = percentileofscore(year_data['import_price'], weighted_mean_price_when_producing)
+
+        results.to_dataframe().to_csv(time_series_file)
+
+    return {
+        'failed_combination_flag': failed_combination_flag,
+        'total_import_cost': total_import_cost,
+        'total_uos_cost': total_uos_cost,
+        'total_supplier_fee_costs': total_supplier_fee_costs,
+        'production_price_percentile': production_price_percentile,
+        'days_with_solver_time_curtailed': days_with_solver_time_curtailed,
+        'days_curtailed_with_warm_start': days_curtailed_with_warm_start,
+        'days_solved_convex': days_solved_convex,
+    }
+
+
 class Analysis():
 
-    def __init__(self, input_combination: list, run_in_azure: bool):
+    def __init__(self, input_combination: list, run_in_azure: bool, input_bundle: InputBundle = None, representative_days: int = None, results_dir: str = None):
 
         input_combination_list = [int(el) for el in input_combination[1:-1].split(',')]
 
         self.input_combination = input_combination_list
         self.run_in_azure = run_in_azure
+        self.input_bundle = input_bundle
+        self.representative_days = representative_days
+        self.results_dir = results_dir
 
     def run(self):
 
@@ -37,6 +297,8 @@ class Analysis():
         else:
             input_dir = os.path.join(PROJECT_ROOT_DIR, 'inputs')
             output_dir_high_level = os.path.join(PROJECT_ROOT_DIR, 'results')
+        if self.results_dir is not None:
+            output_dir_high_level = self.results_dir
 
         input_file_name_components = os.path.join(
             input_dir,
@@ -51,56 +313,74 @@ class Analysis():
             'price_profiles.csv',
         )
 
-        tank_df, electrolyser_df, data_years = read_component_data(input_file_name_components)
+        if self.input_bundle is None:
+            cache_dir = input_dir if self.run_in_azure else os.path.join(input_dir, 'cache')
+            self.input_bundle = InputBundle.from_files(input_file_name_components, input_demand_profiles, input_price_profiles, cache_dir=cache_dir)
 
-        start_time = datetime.datetime.now()
+        tank_df = self.input_bundle.tank_df
+        electrolyser_df = self.input_bundle.electrolyser_df
+        data_years = self.input_bundle.data_years
 
-        economic_inputs = pd.read_excel(input_file_name_components, sheet_name='Economic Inputs')
-        economic_inputs.set_index('Parameter', inplace=True)
+        start_time = datetime.datetime.now()
 
-        technical_inputs = pd.read_excel(input_file_name_components, sheet_name='Technical Inputs')
-        technical_inputs.set_index('Parameter', inplace=True)
+        economic_inputs = self.input_bundle.economic_inputs
+        technical_inputs = self.input_bundle.technical_inputs
 
-        component_delivery_year = economic_inputs['Value']['Component Delivery Year']
-        capital_cost_price_year = economic_inputs['Value']['Capital Cost Price Year']
-        electricity_price_year = economic_inputs['Value']['Electricity Price Baseline Year']
-        if capital_cost_price_year == electricity_price_year:
-            combined_elec_price_inflation = 1.0
-        else:
-            combined_elec_price_inflation = economic_inputs['Value']['Combined Electricity Price Inflation'] # to inflate elec price input data to match price year of capital costs
+        settings = economic_settings(economic_inputs, technical_inputs)
+        combined_elec_price_inflation = settings['combined_elec_price_inflation']
+        kwh_per_kg = settings['kwh_per_kg']
+        water_price_per_litre = settings['water_price_per_litre']
+        water_needed_per_mwh_h2 = settings['water_needed_per_mwh_h2']
 
         grid_import_max_power = technical_inputs['Value']['Max Grid Import Power MW']
-        power_factor = technical_inputs['Value']['Power Factor']
         line_efficiency_after_poi = technical_inputs['Value']['Line Efficiency after POI']
-        start_half_full = bool(technical_inputs['Value']['Start With Tanks Half Full'])
-        tank_min_storage_limit = technical_inputs['Value']['Tank Min Storage Level Allowed']
-        h2_heating_value = economic_inputs['Value']['Heating Value'].lower()
-        discount_rate_percent = economic_inputs['Value']['Discount Rate %']
-        water_price_per_litre = economic_inputs['Value']['Water Price Per Litre']
-        water_needed_per_mwh_h2 = economic_inputs['Value']['Water Litres Per MWh']
-        electrolyser_min_capacity = technical_inputs['Value']['Electrolyser Min Operating Capacity']
-        daily_capacity_charge = economic_inputs['Value']['Daily Capacity Charge per MVA (£)']
-        daily_fixed_charge = economic_inputs['Value']['Daily Fixed Charge (£)']
-        daily_TNUOS_charge = economic_inputs['Value']['Daily TNUOS Charge (£)']
-        sleeving_fee = economic_inputs['Value']['Sleeving Fee Percentage']
         supplier_fee = economic_inputs['Value']['Supplier Fee per MWh Imported (£)']
-        reduce_efficiencies = bool(technical_inputs['Value']['Simplify Efficiencies to Five Points']) #If true, efficiency table will be simplified to 5 rows from 10
+        reduce_efficiencies = efficiency_curve_settings(technical_inputs)[0]
         lp_solver_time_limit_seconds = technical_inputs['Value']['Linear Solver Per Day Time Limit (s)']
+        build_lp_matrices_directly = bool(technical_inputs['Value'].get('Build LP Matrices Directly', False)) #If true, the daily problem is passed to the solver as a sparse matrix rather than through PuLP
+        linear_solver = technical_inputs['Value'].get('Linear Solver', 'CBC') #CBC (separate process), HiGHS (in-process via scipy, handing warm starts and thread counts to highspy where installed) or highspy (in-process)
+        warm_start_mip_solves = bool(technical_inputs['Value'].get('Warm Start MIP Solves', False)) #If true, the previous day's dispatch is used as the starting incumbent for each day's solve
+        use_convex_lp = bool(technical_inputs['Value'].get('Use Convex LP Where Possible', False)) #If true and the H2 output is concave in power beyond the first hull point, days are solved on the interpolated curve with one on/off binary a period, as an LP on days that need none, instead of as the MILP
+        rolling_horizon_days = int(technical_inputs['Value'].get('Rolling Horizon Window (days)', 0)) #If above 0, each solve covers this many days of actual data instead of one day plus a copied look-ahead
+        rolling_horizon_stride_days = int(technical_inputs['Value'].get('Rolling Horizon Stride (days)', 1)) #Days of each rolling horizon window that are kept before the window moves on
+        full_year_lp_bound = bool(technical_inputs['Value'].get('Full Year LP Bound', False)) #If true, each year is solved as one LP with perfect foresight and the min power limit relaxed, giving a lower bound on the electricity cost for screening
+        full_year_lp_time_limit_seconds = technical_inputs['Value'].get('Full Year LP Time Limit (s)', 3600)
+        unique_year_worker_processes = int(technical_inputs['Value'].get('Unique Year Worker Processes', 1)) #If above 1, the unique demand/price years are optimised in parallel in up to this many processes, 0 uses every core
+        if unique_year_worker_processes == 0:
+            unique_year_worker_processes = os.cpu_count()
+        representative_days = int(technical_inputs['Value'].get('Representative Days', 0)) #If above 0, each year is dispatched on only this many representative days, weighted to stand in for the year, as a quick low fidelity estimate
+        if self.representative_days is not None:
+            representative_days = self.representative_days
+        cache_dispatch_results = bool(technical_inputs['Value'].get('Cache Dispatch Results', False)) #If true, each unique year's dispatch is saved under inputs/cache/dispatch, which is never cleared, and reused by later local runs of the same code that differ only in stack replacement years
         allow_for_offline_electrolyser = False
 
-        daily_fixed_charge_total = (daily_capacity_charge * grid_import_max_power / power_factor) + daily_fixed_charge + daily_TNUOS_charge
-        annual_fixed_charge = daily_fixed_charge_total * 365.25
-        annual_admin_costs = annual_fixed_charge * sleeving_fee/100
+        if not build_lp_matrices_directly and not linear_solver == 'CBC':
+            raise Exception('Only the CBC solver can be used when the LP is built with PuLP!')
 
-        if h2_heating_value == 'lower':
-            kwh_per_kg = 33.3
-        else:
-            kwh_per_kg = 39.3
+        if rolling_horizon_days > 0 and not build_lp_matrices_directly:
+            raise Exception('Rolling horizon optimisation needs the LP matrices to be built directly!')
 
-        data = read_ts_data(input_demand_profiles, input_price_profiles, input_file_name_components)
+        if full_year_lp_bound and not build_lp_matrices_directly:
+            raise Exception('The full year LP bound needs the LP matrices to be built directly!')
 
-        first_operational_year = data_years.loc[0,'CalendarYear']
-        n_years = len(data_years)
+        if full_year_lp_bound:
+            #The year is too large to write out for the CBC process, so it is always solved in memory
+            if linear_solver == 'CBC':
+                linear_solver = 'HiGHS'
+            use_convex_lp = False
+            warm_start_mip_solves = False
+            lp_solver_time_limit_seconds = full_year_lp_time_limit_seconds
+
+        if rolling_horizon_days > 0 and not (1 <= rolling_horizon_stride_days <= rolling_horizon_days):
+            raise Exception('Rolling horizon stride must be between 1 and the window length!')
+
+        data = self.input_bundle.data.copy()
+
+        # on Azure Batch each combination runs in its own task directory, so there is nothing to share the dispatch with
+        if cache_dispatch_results and not self.run_in_azure and self.input_bundle.files_hash is not None:
+            dispatch_cache_dir = os.path.join(input_dir, 'cache', 'dispatch')
+        else:
+            dispatch_cache_dir = None
 
         print(self.input_combination)
         selected_electrolyser = electrolyser_df.loc[self.input_combination[0], :]
@@ -112,20 +392,10 @@ class Analysis():
         n_tanks = self.input_combination[3]
         print('\nRunning with ' + str(n_tanks) + ' tanks of the following model:')
         print(selected_tank)
-        stack_replacement_years = self.input_combination[4:]
-
-        electrolyser = CombinedElectrolyser(selected_electrolyser, n_electrolysers, stack_replacement_years, first_operational_year, component_delivery_year, n_years, electrolyser_min_capacity=electrolyser_min_capacity, reduce_efficiencies=reduce_efficiencies, optimise_efficiencies=False)
-        tank = CombinedTank(selected_tank, n_tanks, min_storage_kwh = tank_min_storage_limit, start_half_full=start_half_full)
 
-        electrolyser.combined_stack_and_efficiencies_df = electrolyser.combined_stack_and_efficiencies_df.merge(data_years, how='left')
+        electrolyser, tank = build_components(self.input_combination, self.input_bundle, economic_inputs, technical_inputs)
 
-        unique_years = electrolyser.combined_stack_and_efficiencies_df.groupby('combined').min().reset_index()[['combined','PriceYear','DemandYear','final_relative_efficiency']]
-        unique_years = unique_years.rename(columns = {'final_relative_efficiency': 'minimum_relative_efficiency'})
-
-        results_years = electrolyser.combined_stack_and_efficiencies_df.copy()
-        results_years = results_years.drop(['PriceYear', 'DemandYear'], axis = 1)
-        results_years = results_years.merge(unique_years, on = 'combined', how = 'left')
-        results_years['cost_reduction_factor'] = results_years['minimum_relative_efficiency'] / results_years['final_relative_efficiency']
+        unique_years, results_years = combination_years(electrolyser, data_years)
 
         failed_combination_flag = False
         output_dir = str(self.input_combination)[1:-1].replace(",", "_").replace(" ", "")
@@ -139,15 +409,35 @@ class Analysis():
                 os.mkdir(dir_to_create)
 
         total_curtailed_days = 0
+        total_warm_start_curtailed_days = 0
+        total_convex_days = 0
+        dispatch_models = {}
+        year_jobs = {}
+        year_cache_keys = {}
+        year_results = {}
+        total_cached_years = 0
+
+        control_settings = {
+            'build_lp_matrices_directly': build_lp_matrices_directly,
+            'linear_solver': linear_solver,
+            'warm_start_mip_solves': warm_start_mip_solves,
+            'use_convex_lp': use_convex_lp,
+            'full_year_lp_bound': full_year_lp_bound,
+            'rolling_horizon_days': rolling_horizon_days,
+            'rolling_horizon_stride_days': rolling_horizon_stride_days,
+            'lp_solver_time_limit_seconds': lp_solver_time_limit_seconds,
+            'line_efficiency_after_poi': line_efficiency_after_poi,
+            'reduce_efficiencies': reduce_efficiencies,
+            'supplier_fee': supplier_fee,
+            'representative_days': representative_days,
+        }
 
         for analysis_year in range(0, len(unique_years)):
 
             price_year = int(unique_years.loc[analysis_year, 'PriceYear'])
             demand_year = unique_years.loc[analysis_year, 'DemandYear']
             efficiency_adjustment = unique_years.loc[analysis_year, 'minimum_relative_efficiency']
-            data['demand'] = data[demand_year]
-            data['import_price'] = data[str(price_year)] * combined_elec_price_inflation
-            data['combined_price'] = data['import_price'] + data['uos_charge']
+            set_year_data(data, demand_year, price_year, combined_elec_price_inflation)
 
             electrolyser.max_power = min(grid_import_max_power * 1000 * line_efficiency_after_poi, electrolyser.rated_power)
 
@@ -167,10 +457,7 @@ class Analysis():
                 else:
                     data['under_supply'] = data['demand'] - max_h2_production
 
-                max_cumulative_undersupply = 0
-                for i in range(1, 48 * 10):
-                    test = max(data['under_supply'].rolling(i).sum().shift(-(i - 1)))
-                    max_cumulative_undersupply = max(test, max_cumulative_undersupply)
+                max_cumulative_undersupply = max_rolling_undersupply(data['under_supply'].to_numpy(), 48 * 10 - 1)
 
                 if tank.min_storage_kwh < max_cumulative_undersupply:
                     print('Minimum storage remaining set to cover worst day of over-demand: ', round(max_cumulative_undersupply, 1), ' kWh')
@@ -190,109 +477,31 @@ class Analysis():
 
                 #todo lookup floor area of electrolysers and tanks and ensure it doesn't exceed the max floor area
 
-                total_cost = 0
-                total_import_cost = 0
-                total_uos_cost = 0
-                total_supplier_fee_costs = 0
-                total_h2_produced = 0
-                h2_price_sum_product = 0
-
-                day_start_h2_in_storage_kwh = tank.starting_storage_kwh
-
-                results_df = pd.DataFrame()
-
-                i = 0
-                days_with_solver_time_curtailed = 0
-                day_start_storage_remaining = pd.DataFrame(columns=['remaining'])
-
-                end_of_day_storage_target = tank.min_storage_kwh
-                end_of_day_storage_increase_per_day = 0
-
-                month = 1
-
-                print('\nNow optimising the control one day at a time for 12 months... ')
-
-                for day in data['Day'].unique()[0:len(data['Day'].unique())]:
-
-                    if not day.month == month:
-                        print('Month '+str(day.month - 1)+' complete...')
-                        month = day.month
-
-                    if not failed_combination_flag:
-
-                        data_day = data.loc[(data['Day'] == day), :]
-
-                        #Guess that first 12 hours of following day will have the same price and demand as this day:
-
-                        data_day = data_day.reset_index()
-                        data_day = data_day.drop(columns=['level_0', 'index'])
-                        data_day = pd.concat([data_day, data_day.loc[0:23, :]])
-                        data_day = data_day.reset_index()
-
-
-                        if reduce_efficiencies:
-                            day_results_df, solver_time, end_of_day_storage_target, end_of_day_storage_increase_per_day, failed_combination_flag, mean_production_price = LPcontrol5(data_day, day_start_h2_in_storage_kwh, line_efficiency_after_poi, lp_solver_time_limit_seconds, electrolyser, tank, efficiency_adjustment, end_of_day_storage_target, end_of_day_storage_increase_per_day, max_h2_production, failed_combination_flag, supplier_fee)
-                        else:
-
-                            day_results_df, solver_time, end_of_day_storage_target, end_of_day_storage_increase_per_day, failed_combination_flag, mean_production_price = LPcontrol10(data_day, day_start_h2_in_storage_kwh, line_efficiency_after_poi, lp_solver_time_limit_seconds, electrolyser, tank, efficiency_adjustment, end_of_day_storage_target, end_of_day_storage_increase_per_day, max_h2_production, failed_combination_flag, supplier_fee)
-
-
-                    if not failed_combination_flag:
-
-                        day_start_h2_in_storage_kwh = day_results_df['h2_in_storage_kWh'][47]
-                        day_start_storage_remaining.loc[i, 'date'] = day_results_df['datetime'][47]
-                        day_start_storage_remaining.loc[i,'remaining'] = day_start_h2_in_storage_kwh
-                        i += 1
-                        total_cost += day_results_df['h2_cost_total'].sum()
-                        total_import_cost += day_results_df['h2_cost_imports'].sum()
-                        total_uos_cost += day_results_df['h2_cost_uos'].sum()
-                        total_supplier_fee_costs += day_results_df['h2_cost_supplier_fee'].sum()
-
-                        day_h2_produced = day_results_df['h2_produced_kWh'].sum()
-
-                        if not np.isnan(mean_production_price):
-                            h2_price_sum_product += day_h2_produced * mean_production_price
-
-                        total_h2_produced += day_h2_produced
-
-                        results_df = pd.concat([results_df, day_results_df])
-
-                        if solver_time >= datetime.timedelta(seconds = lp_solver_time_limit_seconds) * 0.999:
-                            days_with_solver_time_curtailed += 1
-
-                        if end_of_day_storage_target < tank.min_storage_kwh:
-                            end_of_day_storage_target += end_of_day_storage_increase_per_day
-
                 if not failed_combination_flag:
-                    print('Month 12 complete!')
-                    print('\nDays curtailed due to solver time limit = ', days_with_solver_time_curtailed)
-                    total_curtailed_days += days_with_solver_time_curtailed
-                    weighted_mean_price_when_producing = h2_price_sum_product / total_h2_produced
-
-                    production_price_percentile = percentileofscore(data['import_price'], weighted_mean_price_when_producing)
-
-                    results_df.to_csv(os.path.join(
-                        output_dir_high_level,
-                        output_dir,
-                        str(analysis_year)+'_'+str(self.input_combination)+'_output_time_series.csv',
-                    ))
-
-                    combined_lookup = unique_years['combined'][analysis_year]
-
-                    for j in range(0,len(results_years)):
-                        if results_years.loc[j,'combined'] == combined_lookup:
-                            scaling_prices = data[str(int(results_years.loc[j, 'PriceScaleYear']))]
-                            scaling_year_value = np.percentile(scaling_prices, production_price_percentile)
-                            control_year_value = np.percentile(data['import_price'], production_price_percentile)
-                            price_scaling_ratio = scaling_year_value / control_year_value
-
-                            results_years.loc[j, 'import_elec_cost'] = round(total_import_cost * results_years.loc[j, 'cost_reduction_factor'] * price_scaling_ratio, 2)
-                            results_years.loc[j, 'uos_elec_cost'] = round(total_uos_cost * results_years.loc[j, 'cost_reduction_factor'], 2)
-                            results_years.loc[j, 'total_elec_cost'] = round(results_years.loc[j, 'import_elec_cost'] + results_years.loc[j, 'uos_elec_cost'], 2)
-                            results_years.loc[j, 'supplier_fee_cost'] = round(total_supplier_fee_costs, 2) * results_years.loc[j, 'cost_reduction_factor']
-                            results_years.loc[j, 'h2_to_demand_kWh'] = round(data.demand.sum(),2)
-                            results_years.loc[j, 'h2_to_demand_kg'] = round(data.demand.sum(),2) / kwh_per_kg
-                            results_years.loc[j, 'water_cost'] = round(data.demand.sum(),2) * water_price_per_litre * water_needed_per_mwh_h2 / 1000
+
+                    time_series_file = os.path.join(output_dir_high_level, output_dir, str(analysis_year)+'_'+str(self.input_combination)+'_output_time_series.csv')
+
+                    year_result = None
+                    if dispatch_cache_dir is not None:
+                        year_cache_keys[analysis_year] = dispatch_cache_key(self.input_bundle.files_hash, self.input_combination[0:4], demand_year, price_year, efficiency_adjustment, tank, control_settings)
+                        year_result = load_dispatch_result(dispatch_cache_dir, year_cache_keys[analysis_year], time_series_file)
+
+                    if year_result is not None:
+                        print('Reusing the dispatch saved for this year by an earlier run')
+                        total_cached_years += 1
+                    elif unique_year_worker_processes > 1:
+                        year_jobs[analysis_year] = (data.copy(), efficiency_adjustment, max_h2_production, electrolyser, copy.deepcopy(tank), {}, control_settings, time_series_file)
+                    else:
+                        year_result = dispatch_year(data, efficiency_adjustment, max_h2_production, electrolyser, tank, dispatch_models, control_settings, time_series_file)
+                        if dispatch_cache_dir is not None and not year_result['failed_combination_flag']:
+                            save_dispatch_result(dispatch_cache_dir, year_cache_keys[analysis_year], year_result, time_series_file)
+
+                    if year_result is not None:
+                        year_results[analysis_year] = year_result
+                        failed_combination_flag = store_year_result(year_result, analysis_year, unique_years, results_years, data, kwh_per_kg, water_price_per_litre, water_needed_per_mwh_h2)
+                        total_curtailed_days += year_result['days_with_solver_time_curtailed']
+                        total_warm_start_curtailed_days += year_result['days_curtailed_with_warm_start']
+                        total_convex_days += year_result['days_solved_convex']
 
                 else:
                     print('Combination failed to Solve')
@@ -301,48 +510,45 @@ class Analysis():
                 print('Max production insufficient to meet the P80 demand level!')
                 failed_combination_flag = True
 
-        end_time = datetime.datetime.now()
-        time_taken = end_time - start_time
-        print('Total time taken = ', time_taken)
+        if year_jobs and not failed_combination_flag:
 
-        average_days_curtailed_per_run = total_curtailed_days / len(unique_years)
-
-        if not failed_combination_flag:
+            print('\nOptimising the control for ' + str(len(year_jobs)) + ' unique years in parallel... ')
 
-            operational_filter = results_years['OperationalYear'] > 0
+            with ProcessPoolExecutor(max_workers=min(unique_year_worker_processes, len(year_jobs))) as executor:
+                year_futures = {analysis_year: executor.submit(dispatch_year, *job) for analysis_year, job in year_jobs.items()}
 
-            results_years['years_since_costs_baseline'] = results_years['CalendarYear'] - min(results_years['CalendarYear'])
+                for analysis_year, year_future in year_futures.items():
+                    year_result = year_future.result()
+                    if dispatch_cache_dir is not None and not year_result['failed_combination_flag']:
+                        save_dispatch_result(dispatch_cache_dir, year_cache_keys[analysis_year], year_result, year_jobs[analysis_year][-1])
+                    set_year_data(data, unique_years.loc[analysis_year, 'DemandYear'], int(unique_years.loc[analysis_year, 'PriceYear']), combined_elec_price_inflation)
+                    year_results[analysis_year] = year_result
+                    if store_year_result(year_result, analysis_year, unique_years, results_years, data, kwh_per_kg, water_price_per_litre, water_needed_per_mwh_h2):
+                        failed_combination_flag = True
+                    total_curtailed_days += year_result['days_with_solver_time_curtailed']
+                    total_warm_start_curtailed_days += year_result['days_curtailed_with_warm_start']
+                    total_convex_days += year_result['days_solved_convex']
 
-            results_years['discount_factor'] = 1 / ((1 + discount_rate_percent / 100) ** (results_years['years_since_costs_baseline']))
-            results_years['electrolyser_capex'] = 0.0
-            results_years['tank_capex'] = 0.0
-            results_years['stack_capex'] = electrolyser.combined_stack_and_efficiencies_df['stack_replacement'] * electrolyser.combined_stack_and_efficiencies_df['stack_final_capex']
-            results_years.loc[operational_filter, 'electrolyser_opex_yr'] = electrolyser.opex_per_year
-            results_years.loc[operational_filter, 'tank_opex_yr'] = tank.opex_per_year
-            results_years.loc[0,'electrolyser_capex'] = electrolyser.capex
-            results_years.loc[0, 'tank_capex'] = tank.capex
-            results_years.loc[operational_filter, 'other_energy_costs'] = annual_fixed_charge
-            results_years.loc[operational_filter, 'sleeving_cost'] = annual_admin_costs
 
-            results_years = results_years.fillna(0)
+        end_time = datetime.datetime.now()
+        time_taken = end_time - start_time
+        print('Total time taken = ', time_taken)
 
-            levilised_cost = np.dot(results_years['total_elec_cost'], results_years['discount_factor'])
-            levilised_cost += np.dot(results_years['other_energy_costs'], results_years['discount_factor'])
-            levilised_cost += np.dot(results_years['sleeving_cost'], results_years['discount_factor'])
-            levilised_cost += np.dot(results_years['electrolyser_opex_yr'], results_years['discount_factor'])
-            levilised_cost += np.dot(results_years['stack_capex'], results_years['discount_factor'])
-            levilised_cost += np.dot(results_years['tank_capex'], results_years['discount_factor'])
-            levilised_cost += np.dot(results_years['tank_opex_yr'], results_years['discount_factor'])
-            levilised_cost += np.dot(results_years['water_cost'], results_years['discount_factor'])
+        average_days_curtailed_per_run = total_curtailed_days / len(unique_years)
+        average_warm_start_curtailed_days_per_run = total_warm_start_curtailed_days / len(unique_years)
+        average_convex_days_per_run = total_convex_days / len(unique_years)
 
-            levilised_cost += np.dot(results_years['electrolyser_capex'], results_years['discount_factor'])
-            levilised_cost += np.dot(results_years['tank_capex'], results_years['discount_factor'])
+        if not failed_combination_flag:
 
-            levilised_production = np.dot(results_years['h2_to_demand_kg'], results_years['discount_factor'])
+            results_years = add_annual_costs(results_years, electrolyser, tank, settings)
 
-            lcoh2 = levilised_cost / levilised_production
+            lcoh2 = levelised_cost_of_h2([results_years])[0]
 
             print('lcoh2 = ', lcoh2)
+            if full_year_lp_bound:
+                print('(from the full year LP, whose electricity cost before price scaling is a lower bound on the other control modes)')
+            if representative_days > 0:
+                print('(a low fidelity estimate from ' + str(representative_days) + ' representative days a year)')
 
             results_years.to_csv(os.path.join(
                 output_dir_high_level,
@@ -350,6 +556,9 @@ class Analysis():
                 str(self.input_combination) + '_output_annual_results.csv',
             ))
 
+            # what recalculate_lcoh2 needs to price this combination again with other economic inputs
+            save_dispatch_outputs(dispatch_outputs_file(os.path.join(output_dir_high_level, output_dir), self.input_combination), unique_years, year_results)
+
 
         else:
             lcoh2 = 9999
@@ -359,21 +568,31 @@ class Analysis():
                 'combination': self.input_combination,
                 'lcoh2': lcoh2,
                 'total_time_taken': str(time_taken),
-                'average_days_curtailed_by_time_limit': str(average_days_curtailed_per_run)
+                'average_days_curtailed_by_time_limit': str(average_days_curtailed_per_run),
+                'warm_start_mip_solves': warm_start_mip_solves and build_lp_matrices_directly,
+                'average_days_curtailed_with_warm_start': str(average_warm_start_curtailed_days_per_run),
+                'average_days_curtailed_without_warm_start': str(average_days_curtailed_per_run - average_warm_start_curtailed_days_per_run),
+                'average_days_solved_convex': str(average_convex_days_per_run),
+                'full_year_lp_bound': full_year_lp_bound,
+                'representative_days': representative_days,
+                'unique_years_reused_from_cache': total_cached_years
             }, f, indent=2)
 
         return lcoh2
 
 if __name__ == "__main__":
 
-    if len(sys.argv) == 3:
+    representative_days = None
+    if len(sys.argv) in [3, 4]:
         input_combination = sys.argv[1]
         run_in_azure = sys.argv[2]
+        if len(sys.argv) == 4:
+            representative_days = int(sys.argv[3])
     else:
         raise Exception(f'Invalid number of command line arguments:{len(sys.argv)}')
 
     analysis = Analysis(
-        input_combination=input_combination, run_in_azure=run_in_azure
+        input_combination=input_combination, run_in_azure=run_in_azure, representative_days=representative_days
     )
 
     lcoh2_this_combination = round(analysis.run(),1)
@@ -0,0 +1,73 @@
+import pandas as pd
+
+from hoptimiser.component_classes import CombinedElectrolyser
+
+
+def make_selected_electrolyser():
+    return {
+        'Capacity (MW)': 1.0,
+        'electrolyser_efficiency_load_factors': [[0.1, 0.5, 1.0]],
+        'electrolyser_efficiency': [[0.6, 0.65, 0.6]],
+        'CAPEX': 1000.,
+        'OPEX (£/year)': 10.,
+        'Floor Space (m2)': 50.,
+        'Start Stack Replacement Cost': 300.,
+        'stack_replacement_capex': [[-0.05, -0.04, -0.03, -0.02, -0.02, -0.01, -0.01, 0.0, 0.0, 0.0, 0.0, 0.0]],
+        'stack_replacement_capex_year': [list(range(2025, 2037))],
+        'efficiency_degradation': [[-0.01, -0.01, -0.01]],
+        # from a year earlier than the stack replacement data, and past the n_years of it kept, which the merge drops
+        'efficiency_learning': [[0.0, 0.01, 0.01, 0.008, 0.006, 0.005, 0.004, 0.003, 0.002, 0.001, 0.001, 0.0, 0.0]],
+        'efficiency_learning_year': [list(range(2024, 2037))],
+    }
+
+
+def combine_learning_data_loop(electrolyser, first_operational_year, stack_replacement_years, n_years, years_to_add):
+    # the DataFrame merge and .loc loops that learning_curves and _combine_learning_data replaced
+
+    efficiency_learning_df = pd.DataFrame()
+    efficiency_learning_df['Year'] = electrolyser.efficiency_learning_curve_year
+    efficiency_learning_df['efficiency_learning_curve'] = electrolyser.efficiency_learning_curve
+    stack_replacement_df = pd.DataFrame()
+    stack_replacement_df['Year'] = electrolyser.stack_replacement_capex_curve_year
+    stack_replacement_df['stack_replacement_capex_curve'] = electrolyser.stack_replacement_capex_curve
+    stack_replacement_df['stack_replacement'] = False
+    stack_replacement_df['cumulative_capex_curve'] = 1 + stack_replacement_df['stack_replacement_capex_curve']
+
+    stack_replacement_df = stack_replacement_df[0:n_years + years_to_add]
+
+    for replacement_year in stack_replacement_years:
+        stack_replacement_df.loc[replacement_year + years_to_add - 1, 'stack_replacement'] = True
+
+    for y in range(1, len(stack_replacement_df)):
+        stack_replacement_df.loc[y, 'cumulative_capex_curve'] = stack_replacement_df.loc[y - 1, 'cumulative_capex_curve'] * stack_replacement_df.loc[y, 'cumulative_capex_curve']
+
+    stack_replacement_df['stack_final_capex'] = stack_replacement_df['cumulative_capex_curve'] * electrolyser.start_stack_replacement_cost
+
+    combined_stack_and_efficiencies_df = efficiency_learning_df.merge(stack_replacement_df)
+
+    combined_stack_and_efficiencies_df['cumulative_learning_curve'] = 1 + combined_stack_and_efficiencies_df['efficiency_learning_curve']
+    for y in range(1, len(combined_stack_and_efficiencies_df)):
+        combined_stack_and_efficiencies_df.loc[y, 'cumulative_learning_curve'] = combined_stack_and_efficiencies_df.loc[y - 1, 'cumulative_learning_curve'] * combined_stack_and_efficiencies_df.loc[y, 'cumulative_learning_curve']
+
+    combined_stack_and_efficiencies_df['degradation'] = electrolyser.efficiency_degradation[-1]
+    combined_stack_and_efficiencies_df['final_relative_efficiency'] = 1.0
+
+    for i in range(0, len(combined_stack_and_efficiencies_df)):
+        if combined_stack_and_efficiencies_df.loc[i, 'Year'] > first_operational_year:
+            if not combined_stack_and_efficiencies_df.loc[i, 'stack_replacement']:
+                combined_stack_and_efficiencies_df.loc[i, 'final_relative_efficiency'] = combined_stack_and_efficiencies_df.loc[i - 1, 'final_relative_efficiency'] * (1 + combined_stack_and_efficiencies_df.loc[i, 'degradation'])
+            else:
+                combined_stack_and_efficiencies_df.loc[i, 'final_relative_efficiency'] = combined_stack_and_efficiencies_df.loc[i, 'cumulative_learning_curve']
+
+    return combined_stack_and_efficiencies_df.rename(columns={'Year': 'CalendarYear'})
+
+
+def test_learning_data_matches_loop():
+    for first_operational_year, component_delivery_year, stack_replacement_years in [(2025, 2025, []), (2026, 2024, [4, 7]), (2027, 2027, [1, 5, 6])]:
+        n_years = 8
+        electrolyser = CombinedElectrolyser(make_selected_electrolyser(), 2, stack_replacement_years, first_operational_year, component_delivery_year, n_years, 0.1, False, False)
+
+        years_to_add = first_operational_year - component_delivery_year
+        expected = combine_learning_data_loop(electrolyser, first_operational_year, stack_replacement_years, n_years, years_to_add)
+
+        pd.testing.assert_frame_equal(electrolyser.combined_stack_and_efficiencies_df, expected, check_dtype=False, check_exact=True)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+
+from hoptimiser.dispatch_model import DailyDispatchModel, ConvexDispatchModel, achievable_storage_lower_bounds, concave_h2_segments, max_rolling_undersupply
+from hoptimiser.control_algorithm import LPcontrol, LPcontrolMatrix, LPcontrolRollingWindow
+
+
+def make_dispatch_model(solver='HiGHS'):
+    electrolyser = SimpleNamespace(
+        efficiency_load_factor=[0.15, 0.5, 1.0],
+        efficiency=[0.6, 0.65, 0.6],
+        rated_power=1000.,
+        max_power=1000.,
+        min_power=150.,
+    )
+    tank = SimpleNamespace(remaining_fraction_after_half_hour=1.0, max_storage_kwh=1000., min_storage_kwh=100.)
+
+    return DailyDispatchModel(electrolyser, tank, 1.0, False, n_periods=48, solver=solver)
+
+
+def make_window(demand_kwh):
+    times = pd.date_range('2023-01-01', periods=48, freq='30min').to_numpy()
+    return {
+        'Time': times,
+        'Day': pd.to_datetime(times).normalize().to_numpy(),
+        'combined_price': np.full(48, 50.),
+        'import_price': np.full(48, 40.),
+        'uos_charge': np.full(48, 10.),
+        'demand': np.full(48, demand_kwh),
+    }
+
+
+def test_storage_lower_bounds_not_below_empty():
+    tank = SimpleNamespace(remaining_fraction_after_half_hour=1.0, max_storage_kwh=1000.)
+    storage_lower_bounds = achievable_storage_lower_bounds(np.full(10, 400.), 200., 100., 300., tank)
+
+    assert np.all(storage_lower_bounds >= -1E-6)
+
+
+def test_rolling_window_fails_when_demand_exceeds_storage_and_production():
+    # 300 kWh of H2 a period at most and 200 kWh stored cannot meet 400 kWh a period
+    day_results, solver_time, failed_combination_flag, mean_production_price = LPcontrolRollingWindow(make_window(400.), 48, 200., 10, make_dispatch_model(), 1.0, False, 0.)
+
+    assert failed_combination_flag
+    assert day_results is None
+
+
+def test_rolling_window_solves_when_demand_can_be_met():
+    day_results, solver_time, failed_combination_flag, mean_production_price = LPcontrolRollingWindow(make_window(100.), 48, 200., 10, make_dispatch_model(), 1.0, False, 0.)
+
+    assert not failed_combination_flag
+    assert np.all(day_results['h2_in_storage_kWh'] >= -1E-6)
+
+
+def test_convex_model_matches_binary_on_columns_and_respects_min_power():
+    load_factor = [0.1, 0.3, 0.5, 0.7, 0.9, 1.0]
+    efficiency = [0.7257, 0.7893, 0.7893, 0.7666, 0.7422, 0.7302]
+    electrolyser = SimpleNamespace(rated_power=1000., max_power=1000., min_power=100.)
+    tank = SimpleNamespace(remaining_fraction_after_half_hour=0.9999, max_storage_kwh=3000.)
+    segment_kw, segment_efficiency = concave_h2_segments(electrolyser, load_factor, efficiency)
+    convex_model = ConvexDispatchModel(tank, 1.0, segment_kw, segment_efficiency, n_periods=48, solver='HiGHS')
+
+    for seed in range(3):
+        rng = np.random.default_rng(seed)
+        price = 50 + 30 * np.sin(np.arange(48) / 48 * 2 * np.pi) + rng.normal(0, 15, 48)
+        convex_model.update(price, rng.uniform(50, 250, 48), 500., np.full(48, 100.), 1.0)
+
+        solved, kw, h2_produced_kwh = convex_model.solve(60)
+        assert solved
+        assert np.all((kw == 0) | (kw >= electrolyser.min_power - 1E-6))
+
+        convex_model.integrality[convex_model.on_cols] = 1
+        solved, x = convex_model._solve_function(convex_model.c, convex_model.a_matrix, convex_model.row_lower, convex_model.row_upper,
+                                                 convex_model.col_lower, convex_model.col_upper, convex_model.integrality, 60)
+        assert solved
+        assert np.isclose(convex_model.c[convex_model.kw_cols[:, 0]].dot(kw), convex_model.c.dot(x), rtol=1E-6)
+
+
+def test_matrix_day_matches_pulp_day():
+    data_day = make_window(150.)
+    data_day['combined_price'] = 50 + 30 * np.sin(np.arange(48) / 48 * 2 * np.pi) + 10 * np.cos(np.arange(48) / 7)
+    dispatch_model = make_dispatch_model()
+
+    # no time limit for PuLP and one far beyond the solve for the matrix model, so every solve is to optimality
+    pulp_results = LPcontrol(data_day, 200., 1.0, None, dispatch_model.electrolyser, dispatch_model.tank, 1.0, 100., 0., 300., False, 0., False)
+    assert not pulp_results[4]
+
+    for solver in ['HiGHS', 'CBC']:
+        matrix_results = LPcontrolMatrix(data_day, 200., 1E6, make_dispatch_model(solver), 1.0, 100., 0., 300., False, 0.)
+        assert not matrix_results[4]
+
+        assert np.isclose(matrix_results[0]['h2_cost_total_solver'].sum(), pulp_results[0]['h2_cost_total_solver'].sum(), rtol=1E-6)
+
+
+def test_max_rolling_undersupply_matches_rolling_sums():
+    rng = np.random.default_rng(0)
+    under_supply = pd.Series(rng.normal(-20, 100, 48 * 30))
+
+    # the loop max_rolling_undersupply replaced in the orchestrators
+    max_cumulative_undersupply = 0
+    for i in range(1, 48 * 10):
+        test = max(under_supply.rolling(i).sum().shift(-(i - 1)))
+        max_cumulative_undersupply = max(test, max_cumulative_undersupply)
+
+    assert np.isclose(max_rolling_undersupply(under_supply.to_numpy(), 48 * 10 - 1), max_cumulative_undersupply, rtol=1E-10)
+    assert max_rolling_undersupply(np.full(100, -1.)) == 0
@@ -0,0 +1,42 @@
+import os
+import numpy as np
+import pandas as pd
+
+from hoptimiser.config import PROJECT_ROOT_DIR
+from hoptimiser.economics import recalculate_lcoh2
+from hoptimiser.input_bundle import InputBundle
+from hoptimiser.variable_price_orchestrator import Analysis
+
+
+def make_input_bundle(input_dir, n_days=2):
+    rng = np.random.default_rng(1)
+    times = pd.date_range('2027-01-01', periods=48 * n_days, freq='30min')
+    half_hour = np.arange(len(times)) % 48
+    time_strings = times.strftime('%d/%m/%Y %H:%M')
+
+    demand = 2000 * (1 + 0.3 * np.sin(2 * np.pi * half_hour / 48)) * rng.uniform(0.6, 1.3, len(times))
+    pd.DataFrame({'Time': time_strings, 'demand_profile_2': demand}).to_csv(os.path.join(input_dir, 'demand_profiles.csv'), index=False)
+
+    prices = {'Time': time_strings}
+    for year in range(2020, 2050):
+        prices[str(year)] = 80 + (year - 2026) + 40 * np.sin(2 * np.pi * (half_hour - 14) / 48) + rng.normal(0, 15, len(times))
+    pd.DataFrame(prices).to_csv(os.path.join(input_dir, 'price_profiles.csv'), index=False)
+
+    input_bundle = InputBundle.from_files(os.path.join(PROJECT_ROOT_DIR, 'inputs', 'component_inputs.xlsx'), os.path.join(input_dir, 'demand_profiles.csv'), os.path.join(input_dir, 'price_profiles.csv'))
+    input_bundle.technical_inputs.loc['Build LP Matrices Directly', 'Value'] = 1
+    input_bundle.technical_inputs.loc['Linear Solver', 'Value'] = 'HiGHS'
+    input_bundle.technical_inputs.loc['Linear Solver Per Day Time Limit (s)', 'Value'] = 30
+
+    return input_bundle
+
+
+def test_recalculated_lcoh2_matches_run(tmp_path):
+    input_bundle = make_input_bundle(str(tmp_path))
+    results_dir = os.path.join(str(tmp_path), 'results')
+
+    lcoh2 = Analysis(input_combination='[0,5,0,5,8]', run_in_azure=False, input_bundle=input_bundle, results_dir=results_dir).run()
+    assert lcoh2 < 9999
+
+    recalculated = recalculate_lcoh2([[0, 5, 0, 5, 8]], input_bundle, results_dir)
+
+    assert recalculated['lcoh2'][0] == lcoh2
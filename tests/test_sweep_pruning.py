@@ -0,0 +1,85 @@
+import numpy as np
+from scipy.optimize import linprog
+from types import SimpleNamespace
+
+from hoptimiser.dispatch_model import DailyDispatchModel, daily_storage_lower_bounds
+from hoptimiser.sweep_pruning import SweepScheduler, _cheapest_h2_cost, _price_scaling_range, _sorted_prices
+
+
+def test_cheapest_h2_cost_matches_lp():
+    rng = np.random.default_rng(0)
+
+    for required_kwh in [0., 500., 5000., 40000.]:
+        prices = rng.normal(20, 30, 48)
+        # least cost of x kWh a period, up to 300, making at least required_kwh of H2 at 0.7
+        lp = linprog(prices, A_ub=-0.7 * np.ones((1, 48)), b_ub=[-required_kwh], bounds=(0, 300.))
+        cost = _cheapest_h2_cost(*_sorted_prices(prices), required_kwh, 300., 0.7)
+
+        if lp.status == 2:
+            # more than can be made, so every period is flat out
+            assert np.isclose(cost, 300. * prices.sum())
+        else:
+            assert np.isclose(cost, lp.fun)
+
+
+def test_price_scaling_range_bounds_every_percentile():
+    rng = np.random.default_rng(1)
+    import_prices = np.sort(rng.uniform(10, 100, 200))
+    scaling_prices = np.sort(rng.uniform(5, 150, 200))
+
+    low, high = _price_scaling_range(import_prices, scaling_prices)
+    percentiles = np.linspace(0, 100, 1001)
+    ratio = np.percentile(scaling_prices, percentiles) / np.percentile(import_prices, percentiles)
+
+    assert np.all(ratio >= low - 1E-12)
+    assert np.all(ratio <= high + 1E-12)
+
+
+def test_price_scaling_range_unbounded_when_import_price_changes_sign():
+    assert _price_scaling_range(np.array([-5., 10., 20.]), np.array([1., 2., 3.])) == (-np.inf, np.inf)
+
+
+def test_bound_not_above_dispatched_electricity_cost():
+    electrolyser = SimpleNamespace(
+        efficiency_load_factor=[0.15, 0.5, 1.0],
+        efficiency=[0.6, 0.65, 0.6],
+        rated_power=1000.,
+        max_power=1000.,
+        min_power=150.,
+    )
+    tank = SimpleNamespace(remaining_fraction_after_half_hour=1.0, max_storage_kwh=1000., min_storage_kwh=100.)
+    dispatch_model = DailyDispatchModel(electrolyser, tank, 1.0, False, n_periods=48, solver='HiGHS')
+
+    for seed in range(3):
+        rng = np.random.default_rng(seed)
+        prices = 40 + 40 * np.sin(np.arange(48) / 48 * 2 * np.pi) + rng.normal(0, 20, 48)
+        demand = rng.uniform(50, 250, 48)
+
+        solved, kw_levels, level_efficiency = dispatch_model.dispatch(prices, demand, 500., daily_storage_lower_bounds(48, 0., 0., 0.), 1.0, 60)
+        assert solved
+
+        # as in lcoh2_lower_bounds, the day can start with at most a full tank
+        required_kwh = max(demand.sum() - tank.max_storage_kwh, 0)
+        bound = _cheapest_h2_cost(*_sorted_prices(prices), required_kwh, electrolyser.max_power * 0.5, max(electrolyser.efficiency))
+
+        assert bound <= prices.dot(kw_levels.sum(axis=1) * 0.5) + 1E-6
+
+
+def test_scheduler_prunes_only_on_bound_by_default():
+    combinations = [[0, 1, 0, 1, 0], [0, 1, 0, 2, 0], [0, 1, 0, 3, 0]]
+    capex_lcoh2 = np.array([1.2, 1.1, 1.])
+    electricity_lcoh2 = np.array([1., 1., 1.])
+
+    for line_heuristic, expected in [(False, [0, 1, 2]), (True, [2])]:
+        scheduler = SweepScheduler(combinations, [0, 1, 2], [None] * 3, capex_lcoh2, electricity_lcoh2, line_heuristic=line_heuristic)
+
+        run = []
+        i = scheduler.next_combination()
+        while i is not None:
+            run.append(i)
+            # the most tanks are run first, and a share taken not to rise with tanks rules out the others
+            scheduler.record(i, 10. - combinations[i][3])
+            i = scheduler.next_combination()
+
+        assert sorted(run) == expected
+        assert all(scheduler.lower_bound(j) <= scheduler.results[j] for j in run)